@@ -0,0 +1,91 @@
+# celestial_service/batch.py
+"""Daily paths for many locations at once.
+
+A body's geocentric RA/Dec for a given timestamp is the same everywhere, so
+it is computed once per (body, date) and then converted to alt/az for a
+whole chunk of locations in one broadcast NumPy pass. Results are produced
+as NDJSON lines, one per (location, date), so they can be streamed. A body
+counts as visible at a location if it clears that location's horizon mask
+(see ``horizon.py``) at any sample.
+"""
+import json
+from datetime import date, datetime, time
+from typing import Iterator, List
+
+import ephem
+import numpy as np
+
+from ephemeris import BODY_CLASSES, geocentric_radec, make_body, time_grid, to_datetimes, topocentric_altaz
+from locations import horizon_mask
+from models import BatchLocation
+
+MAX_BATCH_LOCATIONS = 10000
+MAX_BATCH_DATES = 31
+# Locations converted together in one broadcast pass
+LOCATION_CHUNK = 256
+
+
+def validate_batch(locations: List[BatchLocation], dates: List[date],
+                   bodies: List[str], step_minutes: int) -> None:
+    """Raise ValueError if a batch request is outside the supported limits"""
+    if not locations:
+        raise ValueError("At least one location is required")
+    if len(locations) > MAX_BATCH_LOCATIONS:
+        raise ValueError(f"At most {MAX_BATCH_LOCATIONS} locations per batch")
+    if len(dates) > MAX_BATCH_DATES:
+        raise ValueError(f"At most {MAX_BATCH_DATES} dates per batch")
+    unknown = [name for name in bodies if name not in BODY_CLASSES]
+    if unknown:
+        raise ValueError(
+            f"Unknown bodies: {', '.join(unknown)}. Supported bodies: {', '.join(BODY_CLASSES)}"
+        )
+    if step_minutes < 1 or (24 * 60) % step_minutes:
+        raise ValueError("step_minutes must be a positive divisor of 1440")
+
+
+def iter_batch_results(locations: List[BatchLocation], dates: List[date],
+                       bodies: List[str], step_minutes: int) -> Iterator[str]:
+    """Yield one NDJSON line with every body's daily path per (location, date)"""
+    count = (24 * 60) // step_minutes
+    geocentric_observer = ephem.Observer()
+
+    for day in dates:
+        times = time_grid(datetime.combine(day, time()), step_minutes, count)
+        time_strings = [t.isoformat() for t in to_datetimes(times)]
+        tracks = {
+            name: geocentric_radec(make_body(name), geocentric_observer, times)
+            for name in bodies
+        }
+
+        for start in range(0, len(locations), LOCATION_CHUNK):
+            chunk = locations[start:start + LOCATION_CHUNK]
+            lat = np.radians([loc.lat for loc in chunk])[:, None]
+            lon = np.radians([loc.lon for loc in chunk])[:, None]
+            elevation = np.array([loc.elevation for loc in chunk], dtype=float)[:, None]
+            masks = [horizon_mask(loc.lat, loc.lon) for loc in chunk]
+            altaz = {
+                name: topocentric_altaz(*tracks[name], times, lat, lon, elevation)
+                for name in bodies
+            }
+
+            for i, loc in enumerate(chunk):
+                daily_paths = {}
+                visible_objects = []
+                for name in bodies:
+                    altitudes, azimuths = altaz[name][0][i], altaz[name][1][i]
+                    mask = masks[i]
+                    if (altitudes > 0 if mask is None else mask.above(altitudes, azimuths)).any():
+                        visible_objects.append(name)
+                    daily_paths[name] = [
+                        {"time": t, "altitude": alt, "azimuth": az}
+                        for t, alt, az in zip(time_strings, altitudes.tolist(), azimuths.tolist())
+                    ]
+                yield json.dumps({
+                    "id": loc.id,
+                    "lat": loc.lat,
+                    "lon": loc.lon,
+                    "elevation": loc.elevation,
+                    "date": day.isoformat(),
+                    "visible_objects": visible_objects,
+                    "daily_paths": daily_paths,
+                }) + "\n"
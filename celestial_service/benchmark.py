@@ -0,0 +1,307 @@
+# celestial_service/benchmark.py
+"""Reproducible benchmarks for the service's hot paths.
+
+Covers the calculator methods behind the endpoints (per body where that
+applies) and the full ``/combined-positions``, ``/daily_positions``,
+``/planet/{name}``, ``/sky``, ``/stars``, ``/plan`` and ``/weather``
+endpoints (the latter on the stub provider), driven in-process through the ASGI app at several
+concurrency levels. Each case reports p50/p99 latency, throughput and
+allocations per call (a separate ``tracemalloc`` pass, so tracing
+doesn't distort the timings).
+
+    python benchmark.py                     # run everything
+    python benchmark.py --only endpoint     # cases whose name contains "endpoint"
+    python benchmark.py --cold              # clear the caches before every call
+    python benchmark.py --save              # record the results as the baseline
+    python benchmark.py --compare           # fail if p50 regressed past --threshold
+
+Baselines are machine-specific, so they are written next to this file
+(``BASELINE_PATH``, ignored by git) rather than shipped.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+# Deterministic weather with no upstream; must be set before ``weather`` is imported
+os.environ.setdefault("CELESTIAL_WEATHER_PROVIDER", "stub")
+
+from calculator import path_cache, shared_path_cache
+from conditional import utc_now
+from ephemeris import BODY_CLASSES, make_body
+from events import events_cache
+from metadata import info_cache
+from planner import plan_cache
+from snapshot import sky_snapshot
+from locations import calculator_pool, get_calculator
+from weather import get_weather_service
+import main
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+DEFAULT_ITERATIONS = 50
+DEFAULT_CONCURRENCY = (1, 8, 32)
+DEFAULT_THRESHOLD = 0.2  # fractional p50 slowdown reported as a regression
+WARMUP_CALLS = 3
+
+ENDPOINTS = {
+    "combined-positions": "/combined-positions",
+    "combined-positions-packed": "/combined-positions?format=packed",
+    "daily_positions": "/daily_positions",
+    "planet-mars": "/planet/mars",
+    "sky": "/sky",
+    "body-info-moon": "/bodies/moon/info",
+    "stars": "/stars?max_magnitude=6",
+    "weather": "/weather",
+    "plan-30": "/plan?nights=30",
+}
+
+
+class Result(NamedTuple):
+    name: str
+    calls: int
+    concurrency: int
+    p50_ms: float
+    p99_ms: float
+    mean_ms: float
+    throughput: float  # calls per second
+    alloc_kib: float  # peak traced memory per call
+    alloc_blocks: int  # blocks still allocated after one call
+
+
+def clear_caches() -> None:
+    path_cache.clear()
+    if shared_path_cache is not None:
+        shared_path_cache.clear()
+    events_cache.clear()
+    calculator_pool.clear()
+    plan_cache.clear()
+    info_cache.clear()
+    get_weather_service().cache.clear()
+
+
+def _summarize(name: str, latencies: Sequence[float], elapsed: float, concurrency: int,
+               alloc_kib: float, alloc_blocks: int) -> Result:
+    ms = np.asarray(latencies) * 1000.0
+    return Result(
+        name=name,
+        calls=len(ms),
+        concurrency=concurrency,
+        p50_ms=float(np.percentile(ms, 50)),
+        p99_ms=float(np.percentile(ms, 99)),
+        mean_ms=float(ms.mean()),
+        throughput=len(ms) / elapsed if elapsed > 0 else 0.0,
+        alloc_kib=alloc_kib,
+        alloc_blocks=alloc_blocks,
+    )
+
+
+def _allocations(call: Callable[[], object]) -> tuple:
+    """Peak KiB traced during one call and the blocks it left allocated"""
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename"))
+    return peak / 1024.0, blocks
+
+
+def bench_sync(name: str, func: Callable[[], object], iterations: int, cold: bool) -> Result:
+    """Time ``func`` sequentially, ``iterations`` times"""
+    for _ in range(WARMUP_CALLS):
+        func()
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(iterations):
+        if cold:
+            clear_caches()
+        t = time.perf_counter()
+        func()
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+    if cold:
+        clear_caches()
+    alloc_kib, alloc_blocks = _allocations(func)
+    return _summarize(name, latencies, elapsed, 1, alloc_kib, alloc_blocks)
+
+
+async def asgi_get(path: str, headers: Optional[Dict[str, str]] = None) -> bytes:
+    """Run one GET through ``main.app`` in-process and return the body"""
+    url_path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url_path,
+        "raw_path": url_path.encode(),
+        "query_string": query.encode(),
+        "root_path": "",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": ("127.0.0.1", 50000),
+        "server": ("benchmark", 80),
+    }
+    status = 0
+    body = bytearray()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            body.extend(message.get("body", b""))
+
+    await main.app(scope, receive, send)
+    if status != 200:
+        raise RuntimeError(f"GET {path} returned {status}: {bytes(body[:200])!r}")
+    return bytes(body)
+
+
+async def _bench_endpoint(path: str, iterations: int, concurrency: int,
+                          cold: bool) -> tuple:
+    for _ in range(WARMUP_CALLS):
+        await asgi_get(path)
+    latencies: List[float] = []
+    remaining = iterations
+
+    async def worker(request: Callable[[], Awaitable[bytes]]):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            if cold:
+                clear_caches()
+            t = time.perf_counter()
+            await request()
+            latencies.append(time.perf_counter() - t)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(lambda: asgi_get(path)) for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started
+
+
+def bench_endpoint(name: str, path: str, iterations: int, concurrency: int, cold: bool) -> Result:
+    """Time ``iterations`` GETs of ``path`` with ``concurrency`` requests in flight"""
+    latencies, elapsed = asyncio.run(_bench_endpoint(path, iterations, concurrency, cold))
+    if cold:
+        clear_caches()
+    alloc_kib, alloc_blocks = _allocations(lambda: asyncio.run(asgi_get(path)))
+    return _summarize(f"{name}@{concurrency}", latencies, elapsed, concurrency, alloc_kib, alloc_blocks)
+
+
+def calculator_cases() -> Dict[str, Callable[[], object]]:
+    calculator = get_calculator(main.DEFAULT_LAT, main.DEFAULT_LONG, main.DEFAULT_ELEVATION)
+    cases: Dict[str, Callable[[], object]] = {
+        "calculator.get_all_visible_objects": calculator.get_all_visible_objects,
+        "snapshot.sky_snapshot": lambda: sky_snapshot(calculator, utc_now()),
+    }
+    for name in BODY_CLASSES:
+        cases[f"calculator.calculate_daily_path[{name}]"] = (
+            lambda name=name: calculator.calculate_daily_path(make_body(name), utc_now())
+        )
+    for name in main.SUPPORTED_PLANETS:
+        cases[f"main.get_planet_data[{name}]"] = (
+            lambda name=name: main.get_planet_data(name, calculator)
+        )
+    return cases
+
+
+def run(only: Optional[str], iterations: int, concurrency: Sequence[int], cold: bool) -> List[Result]:
+    results = []
+    for name, func in calculator_cases().items():
+        if only is None or only in name:
+            results.append(bench_sync(name, func, iterations, cold))
+            print(format_result(results[-1]), flush=True)
+    for name, path in ENDPOINTS.items():
+        for level in concurrency:
+            case = f"endpoint.{name}@{level}"
+            if only is None or only in case:
+                result = bench_endpoint(f"endpoint.{name}", path, iterations, level, cold)
+                results.append(result)
+                print(format_result(result), flush=True)
+    main.shutdown_executor()
+    return results
+
+
+def format_result(result: Result) -> str:
+    return (
+        f"{result.name:<48} p50 {result.p50_ms:8.2f} ms  p99 {result.p99_ms:8.2f} ms  "
+        f"{result.throughput:8.1f} /s  {result.alloc_kib:9.1f} KiB  {result.alloc_blocks:6d} blocks"
+    )
+
+
+def save_baseline(results: List[Result], path: str, cold: bool) -> None:
+    baseline = {
+        "created": datetime.now().isoformat(),
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "executor": os.environ.get("CELESTIAL_EXECUTOR", "thread"),
+        "cold": cold,
+        "results": {result.name: result._asdict() for result in results},
+    }
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Saved baseline for {len(results)} cases to {path}")
+
+
+def compare_baseline(results: List[Result], path: str, threshold: float, cold: bool) -> List[str]:
+    """Names of cases whose p50 is more than ``threshold`` slower than the baseline"""
+    with open(path) as f:
+        saved = json.load(f)
+    if saved.get("cold") != cold:
+        print(f"Warning: baseline was recorded with cold={saved.get('cold')}, this run has cold={cold}")
+    baseline = saved["results"]
+    regressions = []
+    print(f"\n{'case':<48} {'base p50':>10} {'now p50':>10} {'change':>8}")
+    for result in results:
+        old = baseline.get(result.name)
+        if old is None:
+            continue
+        change = result.p50_ms / old["p50_ms"] - 1 if old["p50_ms"] else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        print(f"{result.name:<48} {old['p50_ms']:10.2f} {result.p50_ms:10.2f} {change:+8.0%}{flag}")
+        if flag:
+            regressions.append(result.name)
+    return regressions
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--only", help="run only cases whose name contains this string")
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument("--cold", action="store_true", help="clear the caches before every call")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--compare", action="store_true", help="compare against the saved baseline")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    # Request logging would otherwise dominate the output (and the timings)
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run(args.only, args.iterations, args.concurrency, args.cold)
+    regressions = compare_baseline(results, args.baseline, args.threshold, args.cold) if args.compare else []
+    if args.save:
+        save_baseline(results, args.baseline, args.cold)
+    if regressions:
+        print(f"\n{len(regressions)} case(s) regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
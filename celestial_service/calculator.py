@@ -1,27 +1,128 @@
 # celestial_service/calculator.py
 import ephem
-from datetime import datetime, timedelta
+from datetime import date, datetime, time, timedelta
 import numpy as np
-from typing import List, Dict
+from typing import Callable, List, Dict, Hashable, Iterable, NamedTuple, Optional, Tuple
 from models import Position, CelestialObject, BaseData, Visibility
+from conditional import utc_now
+from ephemeris import BODY_CLASSES, compute_altaz, make_body, time_grid, to_datetimes
+from cache import TTLCache
+from events import solve_events
+from horizon import HorizonMask
+from sampling import adaptive_body_path
+from metadata import body_attributes
+from metrics import register_cache, stage_timer
+from shared_cache import make_shared_cache
+
+# Daily paths only depend on (body, location, day, sampling interval), so they
+# are computed once and shared by every endpoint and calculator instance
+PATH_CACHE_SIZE = 512
+PATH_CACHE_TTL = 6 * 3600  # seconds
+path_cache = TTLCache(maxsize=PATH_CACHE_SIZE, ttl=PATH_CACHE_TTL)
+register_cache("path", path_cache)
+
+
+class DailyPath(NamedTuple):
+    """A body's sampled path over one day, as read-only arrays plus Positions"""
+    times: np.ndarray  # ephem dates
+    altitudes: np.ndarray
+    azimuths: np.ndarray
+    positions: Tuple[Position, ...]
+
+
+def positions_from_arrays(times: np.ndarray, altitudes: np.ndarray,
+                          azimuths: np.ndarray) -> List[Position]:
+    """Build Position models from parallel ephem-date/altitude/azimuth arrays"""
+    return [
+        Position(time=time.isoformat(), altitude=float(alt), azimuth=float(az))
+        for time, alt, az in zip(to_datetimes(times), altitudes, azimuths)
+    ]
+
+
+def _encode_path(path: DailyPath) -> Dict[str, np.ndarray]:
+    return {"times": path.times, "altitudes": path.altitudes, "azimuths": path.azimuths}
+
+
+def _decode_path(arrays: Dict[str, np.ndarray]) -> DailyPath:
+    times, altitudes, azimuths = arrays["times"], arrays["altitudes"], arrays["azimuths"]
+    for array in (times, altitudes, azimuths):
+        array.setflags(write=False)
+    with stage_timer("model"):
+        positions = tuple(positions_from_arrays(times, altitudes, azimuths))
+    return DailyPath(times, altitudes, azimuths, positions)
+
+
+# Behind path_cache: paths computed by any worker process, when configured.
+# Only the arrays are stored; the Positions are rebuilt on read
+shared_path_cache = make_shared_cache(PATH_CACHE_TTL, _encode_path, _decode_path)
+if shared_path_cache is not None:
+    register_cache("shared_path", shared_path_cache)
+
+
+def cached_path(key: tuple, compute: Callable[[], DailyPath]) -> DailyPath:
+    """Path from this process's cache, else from the shared store, else computed once"""
+    if shared_path_cache is None:
+        return path_cache.get_or_compute(key, compute)
+    return path_cache.get_or_compute(key, lambda: shared_path_cache.get_or_compute(key, compute))
 
 class CelestialCalculator:
-    def __init__(self, lat: float = 43.397221, lon: float = -80.311386):
-        self.observer = ephem.Observer()
-        self.observer.lat = str(lat)
-        self.observer.lon = str(lon)
-        self.observer.elevation = 0
+    """Ephemeris calculations for one location.
+
+    Every calculation uses its own observer from ``observer_at``, so a single
+    instance can be shared by requests running on different threads.
+    """
+
+    def __init__(self, lat: float = 43.397221, lon: float = -80.311386, elevation: float = 0,
+                 horizon: Optional[HorizonMask] = None):
+        self.lat = lat
+        self.lon = lon
+        self.elevation = elevation
+        # The site's horizon mask; without one the horizon is at 0°
+        self.horizon = horizon
+        self._template = ephem.Observer()
+        self._template.lat = str(lat)
+        self._template.lon = str(lon)
+        self._template.elevation = elevation
+
+    def __reduce__(self):
+        # ephem.Observer can't be pickled; rebuild from the location instead
+        return (CelestialCalculator, (self.lat, self.lon, self.elevation, self.horizon))
+
+    @property
+    def horizon_key(self) -> Optional[str]:
+        """Identifies the horizon in cache keys: results differ between masks"""
+        return self.horizon.key if self.horizon is not None else None
+
+    def observer_at(self, date=None) -> ephem.Observer:
+        """A private observer for this location, set to ``date`` (default: now)"""
+        observer = self._template.copy()
+        observer.date = utc_now() if date is None else date
+        return observer
         
+    def horizon_altitude(self, azimuths) -> np.ndarray:
+        """Lowest visible altitude towards ``azimuths`` (degrees): the mask, else 0"""
+        if self.horizon is None:
+            return np.zeros(np.shape(azimuths))
+        return self.horizon.altitude(azimuths)
+
+    def above_horizon(self, altitudes, azimuths) -> np.ndarray:
+        """Which alt/az samples (degrees) clear the site's horizon"""
+        if self.horizon is None:
+            return np.asarray(altitudes) > 0
+        return self.horizon.above(altitudes, azimuths)
+
     def is_visible(self, body: ephem.Body) -> Visibility:
         """Determine if a celestial body is visible and return visibility info"""
         altitude_deg = float(body.alt) * 180/np.pi
-        is_visible = altitude_deg > 0  # Basic visibility check - above horizon
+        azimuth_deg = float(body.az) * 180/np.pi
+        is_visible = bool(self.above_horizon(altitude_deg, azimuth_deg))
         
-        message = (
-            f"Visible at {altitude_deg:.1f}° altitude"
-            if is_visible
-            else "Below horizon"
-        )
+        if is_visible:
+            message = f"Visible at {altitude_deg:.1f}° altitude"
+        elif altitude_deg > 0:
+            message = f"Behind the local horizon ({altitude_deg:.1f}° altitude)"
+        else:
+            message = "Below horizon"
         
         return Visibility(
             isVisible=is_visible,
@@ -29,64 +130,158 @@ class CelestialCalculator:
         )
 
     def calculate_daily_path(self, body: ephem.Body, date: datetime) -> List[Position]:
-        positions = []
-        
-        # Determine rise and set times to optimize calculations
-        now = date.replace(hour=0, minute=0, second=0, microsecond=0)
-        self.observer.date = now
-        body.compute(self.observer)
-        
-        try:
-            # Try to get rise/set times for today to determine visibility window
-            next_rising = self.observer.next_rising(body).datetime()
-            next_setting = self.observer.next_setting(body).datetime()
-            
-            # If rise time is after set time, it means the object is already up
-            # In this case, get previous rising time
-            if next_rising > next_setting:
-                self.observer.date = (now - timedelta(hours=24))
-                body.compute(self.observer)
-                next_rising = self.observer.next_rising(body).datetime()
-                
-            # Calculate only for times when object might be visible (1 hour before rise to 1 hour after set)
-            start_hour = max(0, (next_rising.hour - 1) % 24)
-            end_hour = min(24, (next_setting.hour + 1) % 24)
-            
-            if end_hour < start_hour:  # Handle overnight visibility
-                end_hour += 24
-                
-        except (ephem.AlwaysUpError, ephem.NeverUpError, AttributeError, ValueError):
-            # Fallback to calculating all 24 hours if we can't determine rise/set times
-            start_hour = 0
-            end_hour = 24
-        
-        # Calculate positions at 15-minute intervals, but only during likely visibility
-        minute_interval = 30  # Reduced from 15 to 30 minutes for better performance
-        
-        for hour in range(start_hour, end_hour):
-            actual_hour = hour % 24
-            for minute in range(0, 60, minute_interval):
-                time = date.replace(hour=actual_hour, minute=minute, second=0, microsecond=0)
-                self.observer.date = time
-                
-                try:
-                    body.compute(self.observer)
-                    alt_deg = float(body.alt) * 180/np.pi
-                    
-                    # Only include positions above horizon
-                    if alt_deg > 0:
-                        positions.append(Position(
-                            time=time.isoformat(),
-                            altitude=alt_deg,
-                            azimuth=float(body.az) * 180/np.pi
-                        ))
-                except (ephem.AlwaysUpError, ephem.NeverUpError):
-                    continue
-        
-        # Sort by time to ensure proper order
-        positions.sort(key=lambda p: p.time)
-                
-        return positions
+        """Positions every 30 minutes, sampled only while the body is above the horizon"""
+        day_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
+        minute_interval = 30
+
+        # Above-horizon windows come from the (cached) event solver
+        day_events = solve_events(self, day_start.date())[0]
+        grid = time_grid(day_start, minute_interval, (24 * 60) // minute_interval)
+        inside = np.zeros(len(grid), dtype=bool)
+        for start, end in day_events.bodies[body.name].intervals:
+            inside |= (grid >= start) & (grid <= end)
+        times = grid[inside]
+        if times.size == 0:
+            return []
+
+        with stage_timer("path_sampling"):
+            altitudes, azimuths = compute_altaz(body, self.observer_at(day_start), times)
+
+        # Only include positions above the site's horizon
+        above = self.above_horizon(altitudes, azimuths)
+        with stage_timer("model"):
+            return positions_from_arrays(times[above], altitudes[above], azimuths[above])
+
+    def _path_key(self, body_name: str, day: datetime, sampling: Hashable) -> tuple:
+        # ``sampling`` is the step in minutes, or ("adaptive", tolerance)
+        return (
+            body_name,
+            round(self.lat, 6),
+            round(self.lon, 6),
+            round(self.elevation, 1),
+            day.date(),
+            sampling,
+        )
+
+    def _compute_daily_path(self, body_name: str, day: datetime,
+                            step_minutes: int) -> DailyPath:
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        with stage_timer("path_sampling"):
+            times = time_grid(start, step_minutes, (24 * 60) // step_minutes)
+            altitudes, azimuths = compute_altaz(make_body(body_name), self.observer_at(start), times)
+        for array in (times, altitudes, azimuths):
+            array.setflags(write=False)
+        with stage_timer("model"):
+            positions = tuple(positions_from_arrays(times, altitudes, azimuths))
+        return DailyPath(times, altitudes, azimuths, positions)
+
+    def daily_path(self, body_name: str, day: datetime, step_minutes: int = 60) -> DailyPath:
+        """Cached path of a body over the whole UTC day containing ``day``"""
+        return cached_path(
+            self._path_key(body_name, day, step_minutes),
+            lambda: self._compute_daily_path(body_name, day, step_minutes)
+        )
+
+    def _compute_path_run(self, body_name: str, first_day: date, n_days: int,
+                          step_minutes: int) -> List[DailyPath]:
+        """Paths for consecutive days from one fitted track and one vectorized pass"""
+        start = datetime.combine(first_day, time())
+        per_day = (24 * 60) // step_minutes
+        with stage_timer("path_sampling"):
+            times = time_grid(start, step_minutes, per_day * n_days)
+            altitudes, azimuths = compute_altaz(make_body(body_name), self.observer_at(start), times)
+        paths = []
+        for d in range(n_days):
+            day = slice(d * per_day, (d + 1) * per_day)
+            arrays = [np.array(values[day]) for values in (times, altitudes, azimuths)]
+            for array in arrays:
+                array.setflags(write=False)
+            with stage_timer("model"):
+                positions = tuple(positions_from_arrays(*arrays))
+            paths.append(DailyPath(*arrays, positions))
+        return paths
+
+    def daily_paths(self, body_name: str, first_day: date, n_days: int,
+                    step_minutes: int = 60) -> List[DailyPath]:
+        """Cached paths for ``n_days`` UTC days from ``first_day``.
+
+        Days already cached are reused; each contiguous run of missing days
+        is computed in one pass, so sliding a window forward by a day costs
+        one day of computation.
+        """
+        days = [first_day + timedelta(days=d) for d in range(n_days)]
+        keys = {day: self._path_key(body_name, datetime.combine(day, time()), step_minutes) for day in days}
+        results: Dict[date, DailyPath] = {}
+
+        def lookup(candidates: List[date], shared: bool) -> List[date]:
+            """Fill ``results`` from the caches; returns the days still missing"""
+            missing = []
+            for day in candidates:
+                path = path_cache.get(keys[day])
+                if path is None and shared:
+                    path = shared_path_cache.get(keys[day])
+                    if path is not None:
+                        path_cache.set(keys[day], path)
+                if path is None:
+                    missing.append(day)
+                else:
+                    results[day] = path
+            return missing
+
+        def compute_runs(missing: List[date]) -> None:
+            run: List[date] = []
+            for day in missing + [None]:
+                if run and (day is None or day != run[-1] + timedelta(days=1)):
+                    for run_day, path in zip(run, self._compute_path_run(body_name, run[0], len(run),
+                                                                         step_minutes)):
+                        path_cache.set(keys[run_day], path)
+                        if shared_path_cache is not None:
+                            shared_path_cache.set(keys[run_day], path)
+                        results[run_day] = path
+                    run = []
+                if day is not None:
+                    run.append(day)
+
+        missing = lookup(days, shared_path_cache is not None)
+        if missing and shared_path_cache is not None:
+            # Single flight across workers: hold every missing day's lock,
+            # then compute only what no other worker stored meanwhile
+            with shared_path_cache.locked(keys[day] for day in missing):
+                compute_runs(lookup(missing, True))
+        else:
+            compute_runs(missing)
+
+        return [results[day] for day in days]
+
+    def _compute_adaptive_path(self, body_name: str, day: datetime, tolerance: float) -> DailyPath:
+        start = day.replace(hour=0, minute=0, second=0, microsecond=0)
+        observer = self.observer_at(start)
+        t0 = float(observer.date)
+        with stage_timer("path_sampling"):
+            times, altitudes, azimuths = adaptive_body_path(make_body(body_name), observer, t0, t0 + 1, tolerance)
+        for array in (times, altitudes, azimuths):
+            array.setflags(write=False)
+        with stage_timer("model"):
+            positions = tuple(positions_from_arrays(times, altitudes, azimuths))
+        return DailyPath(times, altitudes, azimuths, positions)
+
+    def adaptive_path(self, body_name: str, day: datetime, tolerance: float) -> DailyPath:
+        """Cached path over the UTC day, sampled so interpolation stays within ``tolerance`` degrees"""
+        return cached_path(
+            self._path_key(body_name, day, ("adaptive", tolerance)),
+            lambda: self._compute_adaptive_path(body_name, day, tolerance)
+        )
+
+    def precompute_daily_paths(self, day: datetime, step_minutes: int = 60,
+                               body_names: Iterable[str] = BODY_CLASSES) -> None:
+        """Fill the path cache for every body on ``day`` in one go"""
+        for body_name in body_names:
+            self.daily_path(body_name, day, step_minutes)
+
+    @staticmethod
+    def _base_data(body_name: str) -> BaseData:
+        attributes = body_attributes(body_name)
+        return BaseData(magnitude=attributes["magnitude"], constellation=attributes["constellation"])
 
     def get_planets_data(self) -> Dict[str, CelestialObject]:
         visible_planets = {}
@@ -100,11 +295,11 @@ class CelestialCalculator:
             (ephem.Neptune(), "Neptune")
         ]
         
-        self.observer.date = datetime.now()
+        observer = self.observer_at()
         
         for body, name in planet_bodies:
             try:
-                body.compute(self.observer)
+                body.compute(observer)
                 visibility = self.is_visible(body)
                 
                 # Only include if planet is currently visible
@@ -112,12 +307,9 @@ class CelestialCalculator:
                     visible_planets[name] = CelestialObject(
                         name=name,
                         type="planet",
-                        base_data=BaseData(
-                            magnitude=float(body.mag),
-                            constellation=ephem.constellation(body)[1]
-                        ),
+                        base_data=self._base_data(name),
                         visibility=visibility,
-                        daily_path=self.calculate_daily_path(body, datetime.now())
+                        daily_path=self.calculate_daily_path(body, utc_now())
                     )
             except Exception as e:
                 print(f"Error calculating data for {name}: {str(e)}")
@@ -127,8 +319,7 @@ class CelestialCalculator:
 
     def get_moon_data(self) -> Dict[str, CelestialObject]:
         moon = ephem.Moon()
-        self.observer.date = datetime.now()
-        moon.compute(self.observer)
+        moon.compute(self.observer_at())
         
         visibility = self.is_visible(moon)
         if not visibility.isVisible:
@@ -138,19 +329,15 @@ class CelestialCalculator:
             "Moon": CelestialObject(
                 name="Moon",
                 type="moon",
-                base_data=BaseData(
-                    magnitude=float(moon.mag),
-                    constellation=ephem.constellation(moon)[1]
-                ),
+                base_data=self._base_data("Moon"),
                 visibility=visibility,
-                daily_path=self.calculate_daily_path(moon, datetime.now())
+                daily_path=self.calculate_daily_path(moon, utc_now())
             )
         }
 
     def get_sun_data(self) -> Dict[str, CelestialObject]:
         sun = ephem.Sun()
-        self.observer.date = datetime.now()
-        sun.compute(self.observer)
+        sun.compute(self.observer_at())
         
         visibility = self.is_visible(sun)
         if not visibility.isVisible:
@@ -162,7 +349,7 @@ class CelestialCalculator:
                 type="sun",
                 base_data=BaseData(),
                 visibility=visibility,
-                daily_path=self.calculate_daily_path(sun, datetime.now())
+                daily_path=self.calculate_daily_path(sun, utc_now())
             )
         }
 
@@ -0,0 +1,82 @@
+# celestial_service/conditional.py
+"""HTTP caching for responses that only change once per time bucket.
+
+"Now" (UTC) is quantized to ``CELESTIAL_RESPONSE_BUCKET`` seconds: every request
+within a bucket computes current positions and visibility for the bucket's
+start, so the body only depends on the endpoint, the pooled location, the
+bucket, the bodies and the path format. The ETag is a digest of exactly
+those, so it is known before anything is computed: a matching
+``If-None-Match`` gets a 304 straight away. ``Cache-Control: max-age`` is
+what is left of the bucket, and ``Last-Modified`` is its start.
+"""
+import hashlib
+import os
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+from typing import Dict, NamedTuple, Optional
+
+from fastapi import Request, Response
+
+RESPONSE_BUCKET_SECONDS = int(os.environ.get("CELESTIAL_RESPONSE_BUCKET", "60"))
+
+
+class TimeBucket(NamedTuple):
+    start: datetime  # naive UTC, as ephem reads naive datetimes
+    end: datetime
+
+
+def utc_now() -> datetime:
+    """The current time as a naive UTC datetime, whatever the host's time zone"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def time_bucket(now: Optional[datetime] = None, seconds: int = RESPONSE_BUCKET_SECONDS) -> TimeBucket:
+    """The bucket containing ``now`` (naive UTC; default: the current time)"""
+    now = now or utc_now()
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    elapsed = (now - midnight).total_seconds()
+    start = midnight + timedelta(seconds=elapsed // seconds * seconds)
+    return TimeBucket(start, start + timedelta(seconds=seconds))
+
+
+def make_etag(*parts) -> str:
+    """Weak validator for a response determined by ``parts``"""
+    return 'W/"' + hashlib.sha1(repr(parts).encode()).hexdigest()[:24] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison against an ``If-None-Match`` header, as RFC 9110 asks for GET"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag[2:] if etag.startswith("W/") else etag
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if (candidate[2:] if candidate.startswith("W/") else candidate) == opaque:
+            return True
+    return False
+
+
+def caching_headers(etag: str, bucket: TimeBucket, now: Optional[datetime] = None) -> Dict[str, str]:
+    now = now or utc_now()
+    max_age = max(0, int((bucket.end - now).total_seconds()))
+    # Buckets are cut from UTC, so the start only needs labelling as such
+    last_modified = bucket.start.replace(tzinfo=timezone.utc)
+    return {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}",
+        "Last-Modified": format_datetime(last_modified, usegmt=True),
+        # The path format may come from the Accept header
+        "Vary": "Accept",
+    }
+
+
+def conditional_response(request: Request, response: Response, etag: str,
+                         bucket: TimeBucket) -> Optional[Response]:
+    """Set the caching headers on ``response``; a 304 to return instead if the client's copy is current"""
+    headers = caching_headers(etag, bucket)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
@@ -0,0 +1,314 @@
+# celestial_service/ephemeris.py
+"""Batch position engine.
+
+Instead of setting ``observer.date`` and calling ``body.compute()`` once per
+sample, the body's geocentric apparent RA/Dec and distance are sampled with
+``ephem`` at a handful of Chebyshev nodes per segment, fitted with Chebyshev
+polynomials, and then evaluated for every requested time at once. The
+conversion to topocentric altitude/azimuth (sidereal time, parallax,
+refraction) is done in NumPy over the whole time array.
+
+When a precomputed table is installed with ``set_ephemeris_table`` (see
+``tables.py``), ``fitted_track`` slices its stored segments instead of
+fitting, so covered spans need no ``body.compute()`` calls at all.
+"""
+import ephem
+import numpy as np
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Sequence, Tuple, Type
+
+from metrics import body_computations
+
+# Offset between Julian Date and ephem's Dublin Julian Date
+DJD_OFFSET = 2415020.0
+
+# Each fitted segment spans at most this many days
+SEGMENT_DAYS = 1.0
+# Chebyshev nodes (and polynomial degree + 1) per segment
+SEGMENT_NODES = 9
+
+EARTH_RADIUS_AU = 6378.137 / 149597870.7
+EARTH_FLATTENING = 1 / 298.257
+
+BODY_CLASSES: Dict[str, Type[ephem.Body]] = {
+    "Mercury": ephem.Mercury,
+    "Venus": ephem.Venus,
+    "Mars": ephem.Mars,
+    "Jupiter": ephem.Jupiter,
+    "Saturn": ephem.Saturn,
+    "Uranus": ephem.Uranus,
+    "Neptune": ephem.Neptune,
+    "Moon": ephem.Moon,
+    "Sun": ephem.Sun,
+}
+
+
+def make_body(name: str) -> ephem.Body:
+    """Create a fresh ephem body by name"""
+    body_class = BODY_CLASSES.get(name)
+    if not body_class:
+        raise ValueError(f"Unknown body: {name}")
+    return body_class()
+
+
+def to_ephem_dates(times) -> np.ndarray:
+    """Convert a sequence of datetimes (treated as UTC) to ephem date floats"""
+    return np.array([float(ephem.Date(t)) for t in times], dtype=float)
+
+
+def time_grid(start: datetime, step_minutes: float, count: int) -> np.ndarray:
+    """Evenly spaced ephem dates starting at ``start``"""
+    return float(ephem.Date(start)) + np.arange(count) * (step_minutes / 1440.0)
+
+
+def to_datetimes(dates: np.ndarray) -> list:
+    """Convert ephem date floats back to naive datetimes, rounded to the second"""
+    epoch = ephem.Date(0).datetime()
+    return [
+        epoch + timedelta(seconds=round(float(d) * 86400.0))
+        for d in dates
+    ]
+
+
+# Chebyshev nodes on [-1, 1] and the matrix mapping node values to
+# interpolating-polynomial coefficients, shared by every segment
+_UNIT_NODES = np.cos(np.pi * (np.arange(SEGMENT_NODES) + 0.5) / SEGMENT_NODES)[::-1]
+_NODES_TO_COEFFS = np.linalg.inv(
+    np.polynomial.chebyshev.chebvander(_UNIT_NODES, SEGMENT_NODES - 1)
+)
+
+
+def _geocentre(observer: ephem.Observer) -> ephem.Observer:
+    """Copy of ``observer`` moved to the Earth's centre.
+
+    ephem reports the Moon's ``earth_distance`` from the observer's site, not
+    from the geocentre; sampling from the centre gives the true geocentric
+    distance that the parallax correction expects, and makes tracks the same
+    for every site.
+    """
+    geocentre = observer.copy()
+    geocentre.lat, geocentre.lon = 0.0, 0.0
+    geocentre.elevation = -6378137.0
+    return geocentre
+
+
+def _sample_geocentric(body: ephem.Body, observer: ephem.Observer,
+                       nodes: np.ndarray) -> np.ndarray:
+    samples = np.empty((len(nodes), 3))
+    for i, node in enumerate(nodes):
+        observer.date = node
+        body.compute(observer)
+        samples[i] = (body.g_ra, body.g_dec, body.earth_distance)
+    samples[:, 0] = np.unwrap(samples[:, 0])
+    return samples
+
+
+class GeocentricTrack:
+    """A body's geocentric apparent RA/Dec and distance fitted over ``[t0, t1]``.
+
+    The span is split into segments of at most ``segment_days``; each segment
+    costs ``SEGMENT_NODES`` calls to ``body.compute()``. Once fitted, the
+    track can be evaluated at any number of times without touching ephem.
+    """
+
+    def __init__(self, body: ephem.Body, observer: ephem.Observer, t0: float, t1: float,
+                 segment_days: float = SEGMENT_DAYS):
+        t0, t1 = float(t0), float(t1)
+        if t1 - t0 < 1e-6:
+            t1 = t0 + 1e-3
+        self.n_segments = max(1, int(np.ceil((t1 - t0) / segment_days)))
+        self.edges = np.linspace(t0, t1, self.n_segments + 1)
+        self.coeffs = np.empty((self.n_segments, SEGMENT_NODES, 3))
+
+        body_computations.inc(body.name, "track")
+        geocentre = _geocentre(observer)
+        try:
+            for s in range(self.n_segments):
+                lo, hi = self.edges[s], self.edges[s + 1]
+                nodes = lo + (_UNIT_NODES + 1.0) * 0.5 * (hi - lo)
+                self.coeffs[s] = _NODES_TO_COEFFS @ _sample_geocentric(body, geocentre, nodes)
+        finally:
+            # Leave the body as the caller had it
+            body.compute(observer)
+        # Angular radius barely changes over a track, so one value is kept
+        self.radius = float(body.radius)
+
+    @classmethod
+    def from_segments(cls, edges: np.ndarray, coeffs: np.ndarray, radius: float) -> "GeocentricTrack":
+        """A track over already fitted segments (e.g. slices of a precomputed table)"""
+        track = cls.__new__(cls)
+        track.n_segments = len(edges) - 1
+        track.edges = edges
+        track.coeffs = coeffs
+        track.radius = float(radius)
+        return track
+
+    @property
+    def start(self) -> float:
+        return float(self.edges[0])
+
+    @property
+    def end(self) -> float:
+        return float(self.edges[-1])
+
+    def __call__(self, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """RA/Dec (radians) and distance (AU) at ``times``"""
+        times = np.asarray(times, dtype=float)
+        segment = np.clip(
+            np.searchsorted(self.edges, times, side="right") - 1, 0, self.n_segments - 1
+        )
+        lo = self.edges[segment]
+        half_span = 0.5 * (self.edges[segment + 1] - lo)
+        return _chebyshev((times - lo) / half_span - 1.0, self.coeffs[segment])
+
+
+def _chebyshev(x: np.ndarray, coeffs: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """RA/Dec/distance series ``coeffs[..., node, 3]`` at segment coordinates ``x`` in [-1, 1]"""
+    x = x[..., None]
+    # Clenshaw recurrence, evaluated for every time at once
+    b1 = np.zeros(x.shape[:-1] + (3,))
+    b2 = np.zeros_like(b1)
+    for k in range(coeffs.shape[-2] - 1, 0, -1):
+        b1, b2 = coeffs[..., k, :] + 2.0 * x * b1 - b2, b1
+    values = coeffs[..., 0, :] + x * b1 - b2
+    return np.mod(values[..., 0], 2 * np.pi), values[..., 1], values[..., 2]
+
+
+def evaluate_tracks(tracks: Sequence[GeocentricTrack], t: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """RA/Dec (radians) and distance (AU) of every track at one ephem date ``t``, in one pass"""
+    nodes = max(track.coeffs.shape[-2] for track in tracks)
+    # Zero-padding a Chebyshev series to more nodes leaves it unchanged
+    coeffs = np.zeros((len(tracks), nodes, 3))
+    x = np.empty(len(tracks))
+    for i, track in enumerate(tracks):
+        segment = min(max(int(np.searchsorted(track.edges, t, side="right")) - 1, 0), track.n_segments - 1)
+        lo, hi = float(track.edges[segment]), float(track.edges[segment + 1])
+        x[i] = (t - lo) / (0.5 * (hi - lo)) - 1.0
+        coeffs[i, :track.coeffs.shape[-2]] = track.coeffs[segment]
+    return _chebyshev(x, coeffs)
+
+
+_ephemeris_table = None
+
+
+def set_ephemeris_table(table) -> None:
+    """Serve covered spans from ``table`` (anything with ``track(name, t0, t1)``); ``None`` disables"""
+    global _ephemeris_table
+    _ephemeris_table = table
+
+
+def fitted_track(body: ephem.Body, observer: ephem.Observer, t0: float, t1: float) -> GeocentricTrack:
+    """Track over ``[t0, t1]`` from the installed table if it covers the span, else freshly fitted"""
+    table = _ephemeris_table
+    track: Optional[GeocentricTrack] = None if table is None else table.track(body.name, t0, t1)
+    if track is not None:
+        body_computations.inc(body.name, "table")
+        return track
+    return GeocentricTrack(body, observer, t0, t1)
+
+
+def geocentric_radec(body: ephem.Body, observer: ephem.Observer,
+                     times: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Geocentric apparent RA/Dec (radians) and distance (AU) at ``times``"""
+    times = np.asarray(times, dtype=float)
+    if times.size == 0:
+        return np.empty(0), np.empty(0), np.empty(0)
+    return fitted_track(body, observer, times.min(), times.max())(times)
+
+
+def local_sidereal_time(times: np.ndarray, lon: float) -> np.ndarray:
+    """Local mean sidereal time (radians) for ephem dates and east longitude (radians)"""
+    d = np.asarray(times, dtype=float) + DJD_OFFSET - 2451545.0
+    t = d / 36525.0
+    gmst = (280.46061837 + 360.98564736629 * d
+            + 0.000387933 * t * t - t * t * t / 38710000.0)
+    return np.mod(np.radians(gmst) + lon, 2 * np.pi)
+
+
+def _unrefract(apparent: np.ndarray, pressure: float, temp: float) -> np.ndarray:
+    """True altitude for an apparent altitude (radians), as libastro's unrefract()"""
+    a = np.degrees(apparent)
+    low = np.radians(
+        ((2e-5 * a + 1.96e-2) * a + 0.1594) * pressure
+        / ((273.0 + temp) * ((8.45e-2 * a + 5.05e-1) * a + 1.0))
+    )
+    low = np.where((apparent < 0) & (low < 0), 0.0, low)
+    with np.errstate(divide="ignore"):
+        high = 7.888888e-5 * pressure / ((273.0 + temp) * np.tan(apparent))
+    return apparent - np.where(apparent < np.radians(15.0), low, high)
+
+
+def _refract(alt: np.ndarray, pressure: float, temp: float) -> np.ndarray:
+    """Apparent altitude for a true altitude (radians), as libastro's refract()"""
+    if pressure <= 0:
+        return alt
+    # Secant iteration on unrefract(apparent) == alt, run for a fixed number
+    # of rounds over the whole array
+    prev_apparent = alt
+    prev_true = _unrefract(prev_apparent, pressure, temp)
+    apparent = alt + 0.8 * (alt - prev_true)
+    for _ in range(5):
+        true = _unrefract(apparent, pressure, temp)
+        slope = true - prev_true
+        step = np.divide(
+            (alt - true) * (apparent - prev_apparent), slope,
+            out=np.zeros_like(alt), where=np.abs(slope) > 1e-15
+        )
+        prev_apparent, prev_true = apparent, true
+        apparent = apparent + step
+    return apparent
+
+
+def topocentric_altaz(ra: np.ndarray, dec: np.ndarray, dist: np.ndarray, times: np.ndarray,
+                      lat, lon, elevation=0.0, pressure: float = 1010.0,
+                      temp: float = 15.0) -> Tuple[np.ndarray, np.ndarray]:
+    """Altitude/azimuth (degrees) from geocentric RA/Dec arrays.
+
+    ``lat``/``lon`` (radians) and ``elevation`` (metres) may be scalars or
+    arrays that broadcast against ``times``, e.g. shape ``(n_locations, 1)``
+    to evaluate one body's track for many sites in a single pass.
+    """
+    lat = np.asarray(lat, dtype=float)
+    elevation = np.asarray(elevation, dtype=float)
+
+    hour_angle = local_sidereal_time(times, lon) - ra
+
+    # Diurnal parallax (Meeus, ch. 40); only significant for the Moon
+    u = np.arctan((1 - EARTH_FLATTENING) * np.tan(lat))
+    elev_ratio = elevation / 6378137.0
+    rho_sin = (1 - EARTH_FLATTENING) * np.sin(u) + elev_ratio * np.sin(lat)
+    rho_cos = np.cos(u) + elev_ratio * np.cos(lat)
+    sin_par = EARTH_RADIUS_AU / dist
+    cos_dec = np.cos(dec)
+    denom = cos_dec - rho_cos * sin_par * np.cos(hour_angle)
+    d_ra = np.arctan2(-rho_cos * sin_par * np.sin(hour_angle), denom)
+    hour_angle = hour_angle - d_ra
+    dec = np.arctan2((np.sin(dec) - rho_sin * sin_par) * np.cos(d_ra), denom)
+
+    sin_lat, cos_lat = np.sin(lat), np.cos(lat)
+    sin_dec, cos_dec = np.sin(dec), np.cos(dec)
+    cos_ha = np.cos(hour_angle)
+    alt = np.arcsin(np.clip(sin_lat * sin_dec + cos_lat * cos_dec * cos_ha, -1.0, 1.0))
+    az = np.arctan2(-cos_dec * np.sin(hour_angle),
+                    sin_dec * cos_lat - cos_dec * sin_lat * cos_ha)
+
+    alt = _refract(alt, pressure, temp)
+    return np.degrees(alt), np.mod(np.degrees(az), 360.0)
+
+
+def radec_to_altaz(ra: np.ndarray, dec: np.ndarray, dist: np.ndarray,
+                   observer: ephem.Observer, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Topocentric altitude/azimuth (degrees) from geocentric RA/Dec arrays"""
+    return topocentric_altaz(
+        ra, dec, dist, times,
+        float(observer.lat), float(observer.lon), float(observer.elevation),
+        float(observer.pressure), float(observer.temp)
+    )
+
+
+def compute_altaz(body: ephem.Body, observer: ephem.Observer,
+                  times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Altitude and azimuth (degrees) of ``body`` for every ephem date in ``times``"""
+    times = np.asarray(times, dtype=float)
+    ra, dec, dist = geocentric_radec(body, observer, times)
+    return radec_to_altaz(ra, dec, dist, observer, times)
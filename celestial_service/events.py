@@ -0,0 +1,264 @@
+# celestial_service/events.py
+"""Rise, transit, set and twilight times for every body in one pass.
+
+For a run of days, each body's geocentric track is fitted once and its
+altitude evaluated on a coarse grid. Sign changes of ``altitude + radius``
+(upper limb on the refracted horizon, as ephem's ``next_rising`` uses)
+bracket rises and sets; at a site with a horizon mask the limb is measured
+against the mask's altitude at the body's azimuth instead, so rises, sets
+and above-horizon windows are when the body clears the local horizon. Sign
+changes of the hour angle bracket transits, and the Sun's unrefracted
+altitude against -6/-12/-18 degrees gives twilight. Every bracket is then
+refined with a few vectorized regula falsi steps on the fitted track.
+Results are cached per (location, horizon mask, date).
+"""
+from datetime import date, datetime, time, timedelta
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import ephem
+import numpy as np
+
+from cache import TTLCache
+from ephemeris import (
+    BODY_CLASSES, fitted_track, local_sidereal_time, make_body, to_datetimes, topocentric_altaz
+)
+from metrics import register_cache, stage_timer
+from models import BodyEvents, DayEvents, TimeWindow, Twilight
+
+if TYPE_CHECKING:
+    from calculator import CelestialCalculator
+
+EVENT_GRID_MINUTES = 10
+REFINE_ITERATIONS = 4
+TWILIGHT_ALTITUDES = {"civil": -6.0, "nautical": -12.0, "astronomical": -18.0}
+
+EVENTS_CACHE_SIZE = 2048
+EVENTS_CACHE_TTL = 24 * 3600  # seconds
+events_cache = TTLCache(maxsize=EVENTS_CACHE_SIZE, ttl=EVENTS_CACHE_TTL)
+register_cache("events", events_cache)
+
+
+class BodyEventTimes(NamedTuple):
+    """Events of one body within one day, as ephem dates"""
+    rises: Tuple[float, ...]
+    sets: Tuple[float, ...]
+    transits: Tuple[float, ...]
+    transit_altitudes: Tuple[float, ...]
+    intervals: Tuple[Tuple[float, float], ...]  # above-horizon windows, clipped to the day
+
+
+class DayEventTimes(NamedTuple):
+    day: date
+    start: float
+    end: float
+    bodies: Dict[str, BodyEventTimes]
+    twilight: Dict[str, Tuple[Optional[float], Optional[float]]]  # kind -> (dawn, dusk)
+
+
+def _refine(t_a: np.ndarray, t_b: np.ndarray, f_a: np.ndarray, f_b: np.ndarray,
+            func: Callable[[np.ndarray], np.ndarray]) -> np.ndarray:
+    """Roots of ``func`` inside sign-changing brackets, all refined together"""
+    t_root = t_a
+    for _ in range(REFINE_ITERATIONS):
+        t_root = t_a - f_a * (t_b - t_a) / (f_b - f_a)
+        f_root = func(t_root)
+        same_as_a = np.sign(f_root) == np.sign(f_a)
+        t_a = np.where(same_as_a, t_root, t_a)
+        f_a = np.where(same_as_a, f_root, f_a)
+        t_b = np.where(same_as_a, t_b, t_root)
+        f_b = np.where(same_as_a, f_b, f_root)
+    return t_root
+
+
+def _crossings(times: np.ndarray, values: np.ndarray,
+               func: Callable[[np.ndarray], np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    """Upward and downward zero crossings of ``func``, sampled as ``values`` on ``times``"""
+    positive = values > 0
+    idx = np.flatnonzero(positive[:-1] != positive[1:])
+    if idx.size == 0:
+        return np.empty(0), np.empty(0)
+    roots = _refine(times[idx], times[idx + 1], values[idx], values[idx + 1], func)
+    upward = ~positive[idx]
+    return roots[upward], roots[~upward]
+
+
+def _wrap(angle: np.ndarray) -> np.ndarray:
+    return np.mod(angle + np.pi, 2 * np.pi) - np.pi
+
+
+def _in_day(events: np.ndarray, start: float, end: float) -> np.ndarray:
+    return events[(events >= start) & (events < end)]
+
+
+def _intervals(up: np.ndarray, down: np.ndarray, start: float, end: float,
+               up_at_start: bool) -> Tuple[Tuple[float, float], ...]:
+    """Above-horizon windows within ``[start, end)`` from rise and set times"""
+    changes = sorted([(t, True) for t in _in_day(up, start, end)] +
+                     [(t, False) for t in _in_day(down, start, end)])
+    windows = []
+    opened = start if up_at_start else None
+    for t, rising in changes:
+        if rising and opened is None:
+            opened = t
+        elif not rising and opened is not None:
+            windows.append((opened, t))
+            opened = None
+    if opened is not None:
+        windows.append((opened, end))
+    return tuple((float(a), float(b)) for a, b in windows)
+
+
+def _solve_run(calculator: "CelestialCalculator", first_day: date, n_days: int) -> List[DayEventTimes]:
+    """Events for ``n_days`` consecutive days, fitting each body's track once"""
+    t0 = float(ephem.Date(datetime.combine(first_day, time())))
+    step = EVENT_GRID_MINUTES / 1440.0
+    times = t0 + np.arange(n_days * int(round(1 / step)) + 1) * step
+    observer = calculator.observer_at(t0)
+    lat, lon, elevation = float(observer.lat), float(observer.lon), float(observer.elevation)
+    pressure, temp = float(observer.pressure), float(observer.temp)
+    day_bounds = [(t0 + d, t0 + d + 1) for d in range(n_days)]
+
+    body_events: Dict[str, List[BodyEventTimes]] = {}
+    twilight: List[Dict[str, Tuple[Optional[float], Optional[float]]]] = [{} for _ in range(n_days)]
+
+    mask = calculator.horizon
+
+    for name in BODY_CLASSES:
+        track = fitted_track(make_body(name), observer, times[0], times[-1])
+        limb = np.degrees(track.radius)
+
+        def horizon_offset(t, track=track, limb=limb):
+            alt, az = topocentric_altaz(*track(t), t, lat, lon, elevation, pressure, temp)
+            return alt + limb if mask is None else alt + limb - mask.altitude(az)
+
+        def hour_angle(t, track=track):
+            return _wrap(local_sidereal_time(t, lon) - track(t)[0])
+
+        offset = horizon_offset(times)
+        rises, sets = _crossings(times, offset, horizon_offset)
+
+        ha = hour_angle(times)
+        # Upper transits are where the hour angle passes 0 going up; the jump
+        # from +pi to -pi is the lower transit and is excluded
+        idx = np.flatnonzero((ha[:-1] < 0) & (ha[1:] >= 0) & (ha[1:] - ha[:-1] < np.pi))
+        transits = _refine(times[idx], times[idx + 1], ha[idx], ha[idx + 1], hour_angle) if idx.size else np.empty(0)
+        transit_alts = (
+            topocentric_altaz(*track(transits), transits, lat, lon, elevation, pressure, temp)[0]
+            if transits.size else np.empty(0)
+        )
+
+        per_day = []
+        samples_per_day = int(round(1 / step))
+        for d, (start, end) in enumerate(day_bounds):
+            in_day = (transits >= start) & (transits < end)
+            per_day.append(BodyEventTimes(
+                rises=tuple(_in_day(rises, start, end).tolist()),
+                sets=tuple(_in_day(sets, start, end).tolist()),
+                transits=tuple(transits[in_day].tolist()),
+                transit_altitudes=tuple(transit_alts[in_day].tolist()),
+                intervals=_intervals(rises, sets, start, end, offset[d * samples_per_day] > 0),
+            ))
+        body_events[name] = per_day
+
+        if name == "Sun":
+            # Twilight uses the Sun's centre against the unrefracted horizon
+            for kind, level in TWILIGHT_ALTITUDES.items():
+                def twilight_offset(t, track=track, level=level):
+                    alt, _ = topocentric_altaz(*track(t), t, lat, lon, elevation, 0.0, temp)
+                    return alt - level
+
+                dawns, dusks = _crossings(times, twilight_offset(times), twilight_offset)
+                for d, (start, end) in enumerate(day_bounds):
+                    day_dawns = _in_day(dawns, start, end)
+                    day_dusks = _in_day(dusks, start, end)
+                    twilight[d][kind] = (
+                        float(day_dawns[0]) if day_dawns.size else None,
+                        float(day_dusks[0]) if day_dusks.size else None,
+                    )
+
+    return [
+        DayEventTimes(
+            day=first_day + timedelta(days=d),
+            start=start,
+            end=end,
+            bodies={name: body_events[name][d] for name in body_events},
+            twilight=twilight[d],
+        )
+        for d, (start, end) in enumerate(day_bounds)
+    ]
+
+
+def _cache_key(calculator: "CelestialCalculator", day: date) -> tuple:
+    return (round(calculator.lat, 6), round(calculator.lon, 6), round(calculator.elevation, 1),
+            calculator.horizon_key, day)
+
+
+def solve_events(calculator: "CelestialCalculator", first_day: date, n_days: int = 1) -> List[DayEventTimes]:
+    """Events for every body over ``n_days`` from ``first_day``.
+
+    Days already in the cache are reused; each contiguous run of missing
+    days is solved in a single pass.
+    """
+    days = [first_day + timedelta(days=d) for d in range(n_days)]
+    results: Dict[date, DayEventTimes] = {}
+    missing: List[date] = []
+    for day in days:
+        cached = events_cache.get(_cache_key(calculator, day))
+        if cached is None:
+            missing.append(day)
+        else:
+            results[day] = cached
+
+    run: List[date] = []
+    for day in missing + [None]:
+        if run and (day is None or day != run[-1] + timedelta(days=1)):
+            with stage_timer("ephemeris"):
+                solved_run = _solve_run(calculator, run[0], len(run))
+            for solved in solved_run:
+                events_cache.set(_cache_key(calculator, solved.day), solved)
+                results[solved.day] = solved
+            run = []
+        if day is not None:
+            run.append(day)
+
+    return [results[day] for day in days]
+
+
+def next_event(calculator: "CelestialCalculator", body_name: str, kind: str,
+               after: datetime, search_days: int = 2) -> Optional[datetime]:
+    """First rise or set (``kind`` is ``"rises"`` or ``"sets"``) after ``after``"""
+    after_date = float(ephem.Date(after))
+    for day in solve_events(calculator, after.date(), search_days):
+        for t in getattr(day.bodies[body_name], kind):
+            if t > after_date:
+                return to_datetimes([t])[0]
+    return None
+
+
+def _iso(t: Optional[float]) -> Optional[str]:
+    return None if t is None else to_datetimes([t])[0].isoformat()
+
+
+def to_day_events(day: DayEventTimes, bodies: List[str]) -> DayEvents:
+    """Response model for one day's events, restricted to ``bodies``"""
+    body_models = {}
+    for name in bodies:
+        events = day.bodies[name]
+        always_up = not events.rises and not events.sets and events.intervals == ((day.start, day.end),)
+        body_models[name] = BodyEvents(
+            rise=_iso(events.rises[0]) if events.rises else None,
+            transit=_iso(events.transits[0]) if events.transits else None,
+            set=_iso(events.sets[0]) if events.sets else None,
+            transit_altitude=events.transit_altitudes[0] if events.transit_altitudes else None,
+            always_up=always_up,
+            never_up=not events.intervals,
+            above_horizon=[TimeWindow(start=_iso(a), end=_iso(b)) for a, b in events.intervals],
+        )
+    return DayEvents(
+        date=day.day.isoformat(),
+        bodies=body_models,
+        twilight={
+            kind: Twilight(dawn=_iso(dawn), dusk=_iso(dusk))
+            for kind, (dawn, dusk) in day.twilight.items()
+        },
+    )
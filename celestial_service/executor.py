@@ -0,0 +1,55 @@
+# celestial_service/executor.py
+"""Offload CPU-bound ephemeris work from the event loop.
+
+``CELESTIAL_EXECUTOR`` selects where ``run_compute`` runs its function:
+
+- ``thread`` (default): a thread pool; keeps the event loop responsive
+- ``process``: a process pool; spreads ephemeris work across cores, at the
+  cost of pickling results and a separate path cache per worker process
+- ``inline``: on the event loop itself, as the service originally did
+"""
+import asyncio
+import functools
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+EXECUTOR_MODES = ("thread", "process", "inline")
+EXECUTOR_MODE = os.environ.get("CELESTIAL_EXECUTOR", "thread").lower()
+EXECUTOR_WORKERS = int(os.environ.get("CELESTIAL_EXECUTOR_WORKERS", "0")) or None
+
+if EXECUTOR_MODE not in EXECUTOR_MODES:
+    raise ValueError(
+        f"Unknown CELESTIAL_EXECUTOR {EXECUTOR_MODE!r}, expected one of {', '.join(EXECUTOR_MODES)}"
+    )
+
+_executor: Optional[Executor] = None
+
+
+def get_executor() -> Optional[Executor]:
+    """The shared pool for the configured mode, created on first use"""
+    global _executor
+    if _executor is None and EXECUTOR_MODE != "inline":
+        if EXECUTOR_MODE == "process":
+            _executor = ProcessPoolExecutor(max_workers=EXECUTOR_WORKERS)
+        else:
+            _executor = ThreadPoolExecutor(
+                max_workers=EXECUTOR_WORKERS, thread_name_prefix="ephemeris"
+            )
+    return _executor
+
+
+async def run_compute(func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run ``func(*args, **kwargs)`` according to ``EXECUTOR_MODE``"""
+    executor = get_executor()
+    if executor is None:
+        return func(*args, **kwargs)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
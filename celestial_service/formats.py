@@ -0,0 +1,136 @@
+# celestial_service/formats.py
+"""Response formats for daily paths.
+
+``json`` (the default) keeps the original list of ``Position`` objects.
+``columnar`` replaces it with a ``ColumnarPath``: a start time, a fixed step
+and parallel altitude/azimuth arrays. ``packed`` is the same shape with
+the arrays sent as base64-encoded little-endian float32. ``adaptive``
+sends an ``AdaptivePath``: samples at uneven offsets, placed so that linear
+interpolation between them stays within a requested angular tolerance.
+"""
+import base64
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List, NamedTuple, Optional, Union
+
+import numpy as np
+
+from calculator import CelestialCalculator, DailyPath
+from ephemeris import to_datetimes
+from models import AdaptivePath, CelestialObject, ColumnarPath, CompactCelestialObject, DayPaths
+from metrics import stage_timer
+from sampling import DEFAULT_TOLERANCE_DEG, MAX_TOLERANCE_DEG, MIN_TOLERANCE_DEG
+
+PATH_FORMATS = ("json", "columnar", "packed", "adaptive")
+
+# Accept header media types that opt into the compact formats
+COLUMNAR_MEDIA_TYPE = "application/vnd.skytracker.columnar+json"
+PACKED_MEDIA_TYPE = "application/vnd.skytracker.packed+json"
+ADAPTIVE_MEDIA_TYPE = "application/vnd.skytracker.adaptive+json"
+
+
+class PathFormat(NamedTuple):
+    name: str = "json"
+    tolerance: float = DEFAULT_TOLERANCE_DEG  # degrees, used by the adaptive format
+
+
+def negotiate_path_format(format: Optional[str], accept: str = "",
+                          tolerance: Optional[float] = None) -> PathFormat:
+    """Pick a path format from an explicit ``format`` flag or the Accept header"""
+    if tolerance is not None and not MIN_TOLERANCE_DEG <= tolerance <= MAX_TOLERANCE_DEG:
+        raise ValueError(f"tolerance must be between {MIN_TOLERANCE_DEG} and {MAX_TOLERANCE_DEG} degrees")
+    # Rounded so that near-identical tolerances share cached paths
+    tolerance = DEFAULT_TOLERANCE_DEG if tolerance is None else round(tolerance, 3)
+    if format:
+        if format not in PATH_FORMATS:
+            raise ValueError(f"Unknown format {format!r}, expected one of {', '.join(PATH_FORMATS)}")
+        return PathFormat(format, tolerance)
+    if ADAPTIVE_MEDIA_TYPE in accept:
+        return PathFormat("adaptive", tolerance)
+    if PACKED_MEDIA_TYPE in accept:
+        return PathFormat("packed", tolerance)
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return PathFormat("columnar", tolerance)
+    return PathFormat("json", tolerance)
+
+
+def format_path(calculator: CelestialCalculator, body_name: str, day: datetime,
+                path_format: PathFormat) -> DailyPath:
+    """The cached daily path sampled the way ``path_format`` needs it"""
+    if path_format.name == "adaptive":
+        return calculator.adaptive_path(body_name, day, path_format.tolerance)
+    return calculator.daily_path(body_name, day)
+
+
+def format_paths(calculator: CelestialCalculator, body_name: str, first_day: date, n_days: int,
+                 path_format: PathFormat) -> List[DailyPath]:
+    """``format_path`` for consecutive days; evenly sampled days missing from the cache are computed together"""
+    if path_format.name == "adaptive":
+        return [
+            calculator.adaptive_path(body_name, datetime.combine(first_day + timedelta(days=d), time()),
+                                     path_format.tolerance)
+            for d in range(n_days)
+        ]
+    return calculator.daily_paths(body_name, first_day, n_days)
+
+
+def _pack(values: np.ndarray) -> str:
+    return base64.b64encode(np.asarray(values, dtype="<f4").tobytes()).decode("ascii")
+
+
+def columnar_path(path: DailyPath, packed: bool = False) -> ColumnarPath:
+    """Columnar form of an evenly sampled daily path"""
+    step_seconds = float(round((path.times[1] - path.times[0]) * 86400.0)) if len(path.times) > 1 else 0.0
+    if packed:
+        altitude, azimuth, encoding = _pack(path.altitudes), _pack(path.azimuths), "float32-base64"
+    else:
+        altitude, azimuth, encoding = path.altitudes.tolist(), path.azimuths.tolist(), "json"
+    return ColumnarPath(
+        start=to_datetimes(path.times[:1])[0].isoformat() if len(path.times) else "",
+        step_seconds=step_seconds,
+        count=len(path.times),
+        encoding=encoding,
+        altitude=altitude,
+        azimuth=azimuth,
+    )
+
+
+def adaptive_path(path: DailyPath, tolerance: float) -> AdaptivePath:
+    """Adaptive form of an unevenly sampled daily path"""
+    offsets = np.round((path.times - path.times[0]) * 86400.0, 1) if len(path.times) else path.times
+    return AdaptivePath(
+        start=to_datetimes(path.times[:1])[0].isoformat() if len(path.times) else "",
+        tolerance=tolerance,
+        count=len(path.times),
+        offsets=offsets.tolist(),
+        # 0.001 degrees is well inside the smallest tolerance
+        altitude=np.round(path.altitudes, 3).tolist(),
+        azimuth=np.round(path.azimuths, 3).tolist(),
+    )
+
+
+def compact_path(path_format: PathFormat, path: DailyPath) -> Union[ColumnarPath, AdaptivePath]:
+    """``path`` in one of the compact formats"""
+    if path_format.name == "adaptive":
+        return adaptive_path(path, path_format.tolerance)
+    return columnar_path(path, packed=path_format.name == "packed")
+
+
+def make_celestial_object(path_format: PathFormat, path: DailyPath,
+                          **fields) -> Union[CelestialObject, CompactCelestialObject]:
+    """Build a response object carrying ``path`` in the requested format"""
+    with stage_timer("model"):
+        if path_format.name == "json":
+            return CelestialObject(daily_path=list(path.positions), **fields)
+        return CompactCelestialObject(path=compact_path(path_format, path), **fields)
+
+
+def make_day_paths(path_format: PathFormat, day: date, paths: Dict[str, DailyPath]) -> DayPaths:
+    """One day of a range response, every body's path in the requested format"""
+    with stage_timer("model"):
+        return DayPaths(
+            date=day.isoformat(),
+            paths={
+                name: list(path.positions) if path_format.name == "json" else compact_path(path_format, path)
+                for name, path in paths.items()
+            },
+        )
@@ -0,0 +1,94 @@
+# celestial_service/horizon.py
+"""Per-site horizon masks: the lowest visible altitude in every direction.
+
+``CELESTIAL_HORIZON_MASKS`` names a JSON file of sites:
+
+    {"sites": [{"name": "backyard", "lat": 43.40, "lon": -80.31,
+                "mask": [[0, 12.5], [45, 8.0], [90, 21.0], [200, 4.0]]}]}
+
+``mask`` is either a list of ``[azimuth, altitude]`` points (degrees,
+azimuth from north through east, apparent altitude) or the path, relative
+to the JSON file, of a text file with one ``azimuth altitude`` pair per
+line (as Stellarium's polygonal horizons use; ``#`` starts a comment).
+Between points the altitude is interpolated linearly, wrapping at 360°.
+
+A site applies to every request in its location grid cell (see
+``locations.py``), and its mask travels with the cell's pooled calculator.
+Each mask is resampled once into a ``MASK_RESOLUTION_DEG`` lookup table,
+so checking any number of alt/az samples against it is one array index.
+"""
+import hashlib
+import json
+import os
+import re
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+HORIZON_MASKS_PATH = os.environ.get("CELESTIAL_HORIZON_MASKS", "")
+MASK_RESOLUTION_DEG = 0.25
+
+
+class HorizonMask:
+    """Minimum visible altitude by azimuth, as a table of float32 degrees"""
+
+    def __init__(self, azimuths: Sequence[float], altitudes: Sequence[float],
+                 resolution: float = MASK_RESOLUTION_DEG):
+        azimuths = np.mod(np.asarray(azimuths, dtype=float), 360.0)
+        altitudes = np.asarray(altitudes, dtype=float)
+        if azimuths.size == 0 or azimuths.shape != altitudes.shape:
+            raise ValueError("A horizon mask needs matching, non-empty azimuth and altitude lists")
+        order = np.argsort(azimuths)
+        grid = np.arange(int(round(360.0 / resolution))) * resolution
+        self.table = np.interp(grid, azimuths[order], altitudes[order], period=360.0).astype(np.float32)
+        self.table.setflags(write=False)
+        self.resolution = resolution
+        # Identifies the mask in cache keys and ETags
+        self.key = hashlib.sha1(self.table.tobytes()).hexdigest()[:16]
+
+    def altitude(self, azimuths) -> np.ndarray:
+        """Lowest visible altitude towards ``azimuths`` (degrees), at the nearest table entry"""
+        index = np.rint(np.mod(azimuths, 360.0) / self.resolution).astype(np.intp) % self.table.size
+        return self.table[index]
+
+    def above(self, altitudes, azimuths) -> np.ndarray:
+        """Which alt/az samples (degrees) clear the mask"""
+        return np.asarray(altitudes) > self.altitude(azimuths)
+
+
+class HorizonSite(NamedTuple):
+    name: str
+    lat: float
+    lon: float
+    mask: HorizonMask
+
+
+def read_points(path: str) -> List[List[float]]:
+    """``[azimuth, altitude]`` pairs from a two-column text file"""
+    points = []
+    with open(path) as f:
+        for line in f:
+            values = re.split(r"[\s,]+", line.split("#")[0].strip())
+            if values == [""]:
+                continue
+            if len(values) < 2:
+                raise ValueError(f"Bad horizon line in {path}: {line.strip()!r}")
+            points.append([float(values[0]), float(values[1])])
+    return points
+
+
+def load_sites(path: str = HORIZON_MASKS_PATH) -> List[HorizonSite]:
+    """Sites from a ``CELESTIAL_HORIZON_MASKS`` file; none when ``path`` is empty"""
+    if not path:
+        return []
+    with open(path) as f:
+        config = json.load(f)
+    sites = []
+    for entry in config["sites"]:
+        points = entry["mask"]
+        if isinstance(points, str):
+            points = read_points(os.path.join(os.path.dirname(os.path.abspath(path)), points))
+        azimuths, altitudes = zip(*points) if points else ((), ())
+        sites.append(HorizonSite(entry.get("name", ""), float(entry["lat"]), float(entry["lon"]),
+                                 HorizonMask(azimuths, altitudes)))
+    return sites
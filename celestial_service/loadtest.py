@@ -0,0 +1,371 @@
+# celestial_service/loadtest.py
+"""Load test over real HTTP, with a local stand-in for OpenWeatherMap.
+
+Starts a fake OpenWeatherMap server and the service under uvicorn. The
+fake server answers after ``--upstream-latency`` seconds (give or take
+``--upstream-jitter``) and fails ``--upstream-error-rate`` of its requests
+with a 500. The service uses it as its ``openweathermap`` provider through
+``CELESTIAL_OPENWEATHERMAP_URL``, with weather cached for
+``--weather-ttl`` seconds (default 0, so every lookup not coalesced with
+another reaches the upstream). A weighted ``--mix`` of
+``/combined-positions``, ``/planet/{name}`` and ``/weather`` is then run at
+each ``--concurrency`` level for ``--duration`` seconds, spread over
+``--locations`` random sites so the location caches don't hide the compute.
+
+Each step reports throughput and p50/p95/p99 per endpoint, errors, how
+many calls reached the upstream, and the event-loop lag. Service lag comes
+from the ``celestial_event_loop_lag_seconds`` histogram, diffed across the
+step; with ``--workers`` > 1 that is whichever worker answered the scrape.
+The generator's own lag is reported too: when it climbs, the client rather
+than the service is the bottleneck.
+
+    python loadtest.py                                  # 1, 8, 32 and 128 in flight, 10 s each
+    python loadtest.py --mix combined=1,weather=1 --upstream-latency 0.5 --upstream-error-rate 0.05
+    python loadtest.py --target http://localhost:8000   # an already running service
+    python loadtest.py --serve-upstream --port 9000     # only the fake upstream
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+
+DEFAULT_MIX = "combined=6,planet=3,weather=1"
+DEFAULT_CONCURRENCY = (1, 8, 32, 128)
+DEFAULT_DURATION = 10.0  # seconds per concurrency level
+DEFAULT_LOCATIONS = 50
+REQUEST_TIMEOUT = 30.0  # seconds
+STARTUP_TIMEOUT = 60.0  # seconds for the service to answer after launch
+LAG_INTERVAL = 0.05  # seconds between the generator's own lag samples
+
+PLANETS = ("mercury", "venus", "mars", "jupiter", "saturn", "uranus", "neptune")
+LAG_METRIC = "celestial_event_loop_lag_seconds"
+
+
+def make_upstream(latency: float, jitter: float, error_rate: float, seed: int = 0):
+    """FastAPI app imitating OpenWeatherMap's current-weather endpoint"""
+    from fastapi import FastAPI
+    from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0}
+
+    @app.get("/data/2.5/weather")
+    async def current_weather(lat: float, lon: float, appid: str = "", units: str = "metric"):
+        stats["requests"] += 1
+        await asyncio.sleep(max(0.0, rng.gauss(latency, jitter)))
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            return JSONResponse({"cod": 500, "message": "injected failure"}, status_code=500)
+        clouds = rng.randint(0, 100)
+        return {
+            "coord": {"lat": lat, "lon": lon},
+            "weather": [{"main": "Clear" if clouds < 30 else "Clouds"}],
+            "main": {"temp": round(rng.uniform(-5, 30), 1), "humidity": rng.randint(30, 95)},
+            "wind": {"speed": round(rng.uniform(0, 12), 1)},
+            "clouds": {"all": clouds},
+            "visibility": rng.randint(2000, 10000),
+        }
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def spawn(args: List[str], env: Optional[Dict[str, str]] = None) -> Iterator[subprocess.Popen]:
+    """Run ``args`` from this directory for the duration of the block"""
+    process = subprocess.Popen(args, cwd=os.path.dirname(os.path.abspath(__file__)),
+                               env={**os.environ, **(env or {})})
+    try:
+        yield process
+    finally:
+        process.terminate()
+        try:
+            process.wait(10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def wait_until_up(url: str, process: Optional[subprocess.Popen] = None,
+                  timeout: float = STARTUP_TIMEOUT) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"{process.args[1:]} exited with {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not answer within {timeout:.0f}s")
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    """Endpoint weights from ``combined=6,planet=3,weather=1``"""
+    mix = {}
+    for entry in spec.split(","):
+        kind, _, weight = entry.partition("=")
+        if kind not in ("combined", "planet", "weather"):
+            raise ValueError(f"Unknown endpoint {kind!r} in --mix, expected combined, planet or weather")
+        mix[kind] = float(weight or 1)
+    return mix
+
+
+def request_path(kind: str, site: Tuple[float, float], rng: random.Random) -> str:
+    query = f"lat={site[0]:.4f}&lon={site[1]:.4f}"
+    if kind == "combined":
+        return f"/combined-positions?{query}"
+    if kind == "planet":
+        return f"/planet/{rng.choice(PLANETS)}?{query}"
+    return f"/weather?{query}"
+
+
+class LagHistogram(NamedTuple):
+    bounds: Tuple[float, ...]
+    cumulative: Tuple[float, ...]
+    total: float
+    count: float
+
+    def __sub__(self, other: "LagHistogram") -> "LagHistogram":
+        return LagHistogram(self.bounds, tuple(a - b for a, b in zip(self.cumulative, other.cumulative)),
+                            self.total - other.total, self.count - other.count)
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the ``q`` quantile"""
+        for bound, cumulative in zip(self.bounds, self.cumulative):
+            if cumulative >= q * self.count:
+                return bound
+        return float("inf")
+
+
+def parse_lag(metrics: str) -> Optional[LagHistogram]:
+    """The service's event-loop lag histogram from a ``/metrics`` scrape"""
+    buckets = []
+    total = count = None
+    for line in metrics.splitlines():
+        if line.startswith(f'{LAG_METRIC}_bucket{{le="'):
+            bound = line.split('"')[1]
+            buckets.append((float("inf") if bound == "+Inf" else float(bound), float(line.split()[-1])))
+        elif line.startswith(f"{LAG_METRIC}_sum"):
+            total = float(line.split()[-1])
+        elif line.startswith(f"{LAG_METRIC}_count"):
+            count = float(line.split()[-1])
+    if not buckets or count is None:
+        return None
+    return LagHistogram(tuple(b for b, _ in buckets), tuple(c for _, c in buckets), total, count)
+
+
+class StepResult(NamedTuple):
+    concurrency: int
+    elapsed: float
+    endpoints: Dict[str, dict]  # kind -> requests, throughput, p50/p95/p99 ms, errors
+    service_lag: Optional[dict]  # mean and p99 (bucket bound) in ms
+    client_lag_p99_ms: float
+    upstream_requests: Optional[int]
+    upstream_errors: Optional[int]
+
+
+def _summarize(latencies: Sequence[float], errors: int, elapsed: float) -> dict:
+    ms = np.asarray(latencies) * 1000.0 if latencies else np.zeros(1)
+    return {
+        "requests": len(latencies),
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "errors": errors,
+    }
+
+
+async def _scrape(client: httpx.AsyncClient, url: str) -> Optional[httpx.Response]:
+    try:
+        response = await client.get(url)
+        return response if response.status_code == 200 else None
+    except httpx.HTTPError:
+        return None
+
+
+async def run_step(target: str, upstream: Optional[str], mix: Dict[str, float], concurrency: int,
+                   duration: float, sites: Sequence[Tuple[float, float]], seed: int) -> StepResult:
+    """Keep ``concurrency`` requests in flight for ``duration`` seconds"""
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    latencies: Dict[str, List[float]] = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+
+    async with httpx.AsyncClient(base_url=target, timeout=REQUEST_TIMEOUT, limits=limits) as client:
+        before = await _scrape(client, "/metrics")
+        upstream_before = await _scrape(client, f"{upstream}/stats") if upstream else None
+
+        loop = asyncio.get_running_loop()
+        client_lag: List[float] = []
+        stop = loop.time() + duration
+
+        async def monitor():
+            while loop.time() < stop:
+                expected = loop.time() + LAG_INTERVAL
+                await asyncio.sleep(LAG_INTERVAL)
+                client_lag.append(max(0.0, loop.time() - expected))
+
+        async def worker():
+            while loop.time() < stop:
+                kind = rng.choices(kinds, weights)[0]
+                path = request_path(kind, rng.choice(sites), rng)
+                started = time.perf_counter()
+                try:
+                    ok = (await client.get(path)).status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[kind].append(time.perf_counter() - started)
+                else:
+                    errors[kind] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(monitor(), *(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        after = await _scrape(client, "/metrics")
+        upstream_after = await _scrape(client, f"{upstream}/stats") if upstream else None
+
+    service_lag = None
+    if before is not None and after is not None:
+        lag_before, lag_after = parse_lag(before.text), parse_lag(after.text)
+        if lag_before is not None and lag_after is not None and lag_after.count > lag_before.count:
+            lag = lag_after - lag_before
+            service_lag = {"mean_ms": lag.total / lag.count * 1000.0, "p99_ms": lag.quantile(0.99) * 1000.0}
+    upstream_requests = upstream_errors = None
+    if upstream_before is not None and upstream_after is not None:
+        upstream_requests = upstream_after.json()["requests"] - upstream_before.json()["requests"]
+        upstream_errors = upstream_after.json()["errors"] - upstream_before.json()["errors"]
+
+    return StepResult(
+        concurrency=concurrency,
+        elapsed=elapsed,
+        endpoints={kind: _summarize(latencies[kind], errors[kind], elapsed) for kind in kinds},
+        service_lag=service_lag,
+        client_lag_p99_ms=float(np.percentile(client_lag, 99)) * 1000.0 if client_lag else 0.0,
+        upstream_requests=upstream_requests,
+        upstream_errors=upstream_errors,
+    )
+
+
+def format_step(step: StepResult) -> str:
+    lines = [f"\n{step.concurrency} in flight, {step.elapsed:.1f} s",
+             f"  {'endpoint':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"]
+    for kind, stats in step.endpoints.items():
+        lines.append(f"  {kind:<10} {stats['throughput']:9.1f} {stats['p50_ms']:9.2f} {stats['p95_ms']:9.2f} "
+                     f"{stats['p99_ms']:9.2f} {stats['errors']:7d}")
+    total = sum(stats["throughput"] for stats in step.endpoints.values())
+    lines.append(f"  {'total':<10} {total:9.1f}")
+    if step.service_lag is not None:
+        lines.append(f"  service event-loop lag: mean {step.service_lag['mean_ms']:.2f} ms, "
+                     f"p99 <= {step.service_lag['p99_ms']:.1f} ms")
+    else:
+        lines.append("  service event-loop lag: not reported (CELESTIAL_LOOP_LAG_INTERVAL=0?)")
+    lines.append(f"  generator event-loop lag: p99 {step.client_lag_p99_ms:.2f} ms")
+    if step.upstream_requests is not None:
+        lines.append(f"  upstream weather calls: {step.upstream_requests} ({step.upstream_errors} failed)")
+    return "\n".join(lines)
+
+
+def run(args: argparse.Namespace) -> List[StepResult]:
+    mix = parse_mix(args.mix)
+    rng = random.Random(args.seed)
+    sites = [(rng.uniform(-60, 60), rng.uniform(-180, 180)) for _ in range(args.locations)]
+
+    def steps(target: str, upstream: Optional[str]) -> List[StepResult]:
+        results = []
+        for i, level in enumerate(args.concurrency):
+            result = asyncio.run(run_step(target, upstream, mix, level, args.duration, sites, args.seed + i))
+            print(format_step(result), flush=True)
+            results.append(result)
+        return results
+
+    if args.target:
+        return steps(args.target.rstrip("/"), None)
+
+    upstream_port, service_port = free_port(), free_port()
+    upstream = f"http://127.0.0.1:{upstream_port}"
+    target = f"http://127.0.0.1:{service_port}"
+    upstream_args = [sys.executable, os.path.basename(__file__), "--serve-upstream", "--port", str(upstream_port),
+                     "--upstream-latency", str(args.upstream_latency),
+                     "--upstream-jitter", str(args.upstream_jitter),
+                     "--upstream-error-rate", str(args.upstream_error_rate), "--seed", str(args.seed)]
+    service_env = {
+        "CELESTIAL_WEATHER_PROVIDER": "openweathermap",
+        "OPENWEATHERMAP_API_KEY": "loadtest",
+        "CELESTIAL_OPENWEATHERMAP_URL": f"{upstream}/data/2.5/weather",
+        "CELESTIAL_WEATHER_TTL": str(args.weather_ttl),
+    }
+    service_args = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                    "--port", str(service_port), "--workers", str(args.workers), "--log-level", "warning"]
+
+    with ExitStack() as stack:
+        if args.workers > 1 and not os.environ.get("CELESTIAL_SHARED_CACHE_DIR"):
+            # A fresh private directory per run, removed afterwards
+            service_env["CELESTIAL_SHARED_CACHE_DIR"] = stack.enter_context(
+                tempfile.TemporaryDirectory(prefix="celestial-loadtest-cache-"))
+        upstream_process = stack.enter_context(spawn(upstream_args))
+        service_process = stack.enter_context(spawn(service_args, service_env))
+        wait_until_up(f"{upstream}/stats", upstream_process)
+        wait_until_up(f"{target}/planets", service_process)
+        print(f"service on {target} (workers={args.workers}, "
+              f"executor={os.environ.get('CELESTIAL_EXECUTOR', 'thread')}), fake upstream on {upstream} "
+              f"(latency {args.upstream_latency * 1000:.0f} ms, errors {args.upstream_error_rate:.0%})")
+        return steps(target, upstream)
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="endpoint weights, e.g. combined=6,planet=3,weather=1")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=list(DEFAULT_CONCURRENCY))
+    parser.add_argument("--duration", type=float, default=DEFAULT_DURATION, help="seconds per concurrency level")
+    parser.add_argument("--locations", type=int, default=DEFAULT_LOCATIONS, help="distinct request sites")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--target", help="load an already running service instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started service")
+    parser.add_argument("--weather-ttl", type=float, default=0.0, help="CELESTIAL_WEATHER_TTL for the service")
+    parser.add_argument("--upstream-latency", type=float, default=0.1, help="fake upstream delay in seconds")
+    parser.add_argument("--upstream-jitter", type=float, default=0.02)
+    parser.add_argument("--upstream-error-rate", type=float, default=0.0, help="fraction answered with a 500")
+    parser.add_argument("--serve-upstream", action="store_true", help="only run the fake upstream")
+    parser.add_argument("--port", type=int, default=9000, help="port for --serve-upstream")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.serve_upstream:
+        import uvicorn
+        app = make_upstream(args.upstream_latency, args.upstream_jitter, args.upstream_error_rate, args.seed)
+        uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+        sys.exit(0)
+    results = run(args)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"args": vars(args), "steps": [result._asdict() for result in results]}, f, indent=2)
+        print(f"\nSaved {len(results)} steps to {args.save}")
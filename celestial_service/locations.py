@@ -0,0 +1,61 @@
+# celestial_service/locations.py
+"""Quantized observing locations and a bounded pool of calculators.
+
+Requests are snapped to a grid cell (``LOCATION_GRID_DEG`` in lat/lon,
+``ELEVATION_GRID_M`` in elevation) before any calculation, so nearby users
+share one pooled ``CelestialCalculator`` and therefore the same cached
+daily paths. A cell containing a ``CELESTIAL_HORIZON_MASKS`` site (see
+``horizon.py``) gets that site's mask on its calculator.
+"""
+import math
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from cache import TTLCache
+from calculator import CelestialCalculator
+from horizon import HorizonMask, load_sites
+from metrics import register_cache
+
+LOCATION_GRID_DEG = 0.1
+ELEVATION_GRID_M = 100
+CALCULATOR_POOL_SIZE = 256
+
+
+class Location(NamedTuple):
+    lat: float
+    lon: float
+    elevation: float = 0
+
+
+def quantize_location(lat: float, lon: float, elevation: float = 0) -> Location:
+    """Snap a location to the centre of its grid cell"""
+    lat = max(-90.0, min(90.0, round(lat / LOCATION_GRID_DEG) * LOCATION_GRID_DEG))
+    lon = round(lon / LOCATION_GRID_DEG) * LOCATION_GRID_DEG
+    lon = (lon + 180.0) % 360.0 - 180.0
+    elevation = round(elevation / ELEVATION_GRID_M) * ELEVATION_GRID_M
+    # Round away float noise so equal cells produce equal cache keys
+    digits = max(0, -int(math.floor(math.log10(LOCATION_GRID_DEG)))) + 1
+    return Location(round(lat, digits), round(lon, digits), float(elevation))
+
+
+# (lat, lon) of a grid cell -> its site's mask, loaded once per process
+_site_masks: Dict[Tuple[float, float], HorizonMask] = {
+    quantize_location(site.lat, site.lon)[:2]: site.mask for site in load_sites()
+}
+
+
+def horizon_mask(lat: float, lon: float) -> Optional[HorizonMask]:
+    """The configured mask for the grid cell containing (lat, lon), if any"""
+    return _site_masks.get(quantize_location(lat, lon)[:2])
+
+
+# Calculators never go stale, so entries only leave the pool through LRU eviction
+calculator_pool = TTLCache(maxsize=CALCULATOR_POOL_SIZE, ttl=math.inf)
+register_cache("calculators", calculator_pool)
+
+
+def get_calculator(lat: float, lon: float, elevation: float = 0) -> CelestialCalculator:
+    """Pooled calculator for the grid cell containing the given location"""
+    location = quantize_location(lat, lon, elevation)
+    return calculator_pool.get_or_compute(
+        location, lambda: CelestialCalculator(*location, horizon=_site_masks.get(location[:2]))
+    )
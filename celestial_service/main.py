@@ -1,11 +1,37 @@
-from fastapi import FastAPI, HTTPException
+import time
+_import_started = time.perf_counter()
+
+from fastapi import Depends, FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime, timedelta
-from typing import Dict, List
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Literal, Tuple, Union
+import asyncio
 import json
-import requests
-from calculator import CelestialCalculator
-from models import CelestialObject, Position, Visibility, Weather
+from calculator import CelestialCalculator, DailyPath, positions_from_arrays
+from conditional import TimeBucket, conditional_response, make_etag, time_bucket, utc_now
+from executor import run_compute, shutdown_executor
+from locations import Location, get_calculator
+from metrics import (CONTENT_TYPE, LOOP_LAG_INTERVAL, RequestMetricsMiddleware, TimedRoute, body_computations,
+                     monitor_event_loop, registry, stage_timer, startup_duration)
+from models import (BaseData, BatchRequest, BodyInfo, CelestialObject, CompactCelestialObject, DayEvents, DayPaths,
+                    HorizonProfile, NightPlan, Position, SatellitePassInfo, SkySnapshot, StarObject, Visibility, Weather)
+from batch import iter_batch_results, validate_batch
+from ephemeris import BODY_CLASSES, make_body, to_datetimes
+from events import next_event, solve_events, to_day_events
+from formats import (PathFormat, format_path, format_paths, make_celestial_object, make_day_paths,
+                     negotiate_path_format)
+from metadata import body_attributes, body_info, info_bucket
+from planner import MAX_PLAN_NIGHTS, cached_plan
+from snapshot import sky_snapshot
+from satellites import (MAX_WINDOW_HOURS, SatelliteCatalog, SatelliteCatalogUnavailable, SatellitePass,
+                        cached_passes, get_satellite_catalog)
+from stars import MAX_STAR_RESULTS, visible_stars
+from sampling import MAX_TOLERANCE_DEG, MIN_TOLERANCE_DEG
+from startup import WARMUP_LOCATIONS, parse_locations, warm_up
+from streaming import MAX_STREAM_INTERVAL, MIN_STREAM_INTERVAL, broadcaster
+from tables import load_configured_table
+from weather import WeatherProviderError, close_weather_service, get_weather_service
 import ephem
 import numpy as np
 import logging
@@ -18,7 +44,12 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Serve covered dates from the precomputed table named by CELESTIAL_EPHEMERIS_TABLE
+load_configured_table()
+
 app = FastAPI()
+# Set before any route is declared so every endpoint reports when it returns
+app.router.route_class = TimedRoute
 
 # Configure CORS
 app.add_middleware(
@@ -29,20 +60,27 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-calculator = CelestialCalculator()
+app.add_middleware(RequestMetricsMiddleware)
 
 SUPPORTED_PLANETS = [
     "Mercury", "Venus", "Mars", "Jupiter", 
     "Saturn", "Uranus", "Neptune"
 ]
 
+# Bodies included in /daily_positions and /combined-positions
+DAILY_BODIES = SUPPORTED_PLANETS + ["Moon"]
+
+# Longest range accepted by /events
+MAX_EVENT_DAYS = 366
+# Longest range accepted by /paths. Every day of every body is one path_cache
+# entry, so a full range of all bodies (31 x 9) must fit in PATH_CACHE_SIZE
+# with room left for the paths the position endpoints keep hot
+MAX_PATH_DAYS = 31
+
 # Default location (Cambridge)
 DEFAULT_LAT = 43.397221
 DEFAULT_LONG = -80.311386
-
-# Weather API parameters - (OpenWeatherMap API)
-WEATHER_MOCK_ENABLED = True  # Set to False when using real API
-OPENWEATHERMAP_API_KEY = ""  # Add your API key here
+DEFAULT_ELEVATION = 0
 
 def get_planet_body(planet_name: str) -> ephem.Planet:
     """Helper function to get the appropriate ephem Planet object"""
@@ -64,257 +102,596 @@ def get_planet_body(planet_name: str) -> ephem.Planet:
     
     return planet_class()
 
-async def get_planet_data(planet_name: str) -> CelestialObject:
-    """Calculate detailed data for a specific planet"""
-    logger.info(f"Calculating detailed data for planet: {planet_name}")
+def location_calculator(
+    lat: float = Query(DEFAULT_LAT, ge=-90, le=90),
+    lon: float = Query(DEFAULT_LONG, ge=-180, le=180),
+    elevation: float = Query(DEFAULT_ELEVATION, ge=-500, le=9000)
+) -> CelestialCalculator:
+    """Pooled calculator for the request's lat/lon/elevation query parameters"""
+    return get_calculator(lat, lon, elevation)
+
+def requested_path_format(
+    request: Request,
+    format: Optional[str] = None,
+    tolerance: Optional[float] = Query(None, ge=MIN_TOLERANCE_DEG, le=MAX_TOLERANCE_DEG)
+) -> PathFormat:
+    """Daily path format from the ``format`` query flag or the Accept header"""
+    try:
+        return negotiate_path_format(format, request.headers.get("accept", ""), tolerance)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def observe_body(body_name: str, observer: ephem.Observer) -> ephem.Body:
+    """A body computed once for the observer's date; shared by visibility and realtime data"""
+    body = make_body(body_name)
+    with stage_timer("ephemeris"):
+        body.compute(observer)
+    body_computations.inc(body_name, "position")
+    return body
+
+def current_position(body: ephem.Body, timestamp: str) -> Position:
+    """Position of an already computed body"""
+    return Position(
+        time=timestamp,
+        altitude=float(body.alt) * 180/np.pi,
+        azimuth=float(body.az) * 180/np.pi
+    )
+
+def build_planet_object(planet_name: str, calculator: CelestialCalculator, planet: ephem.Body,
+                        daily_path: DailyPath, current_time: datetime,
+                        path_format: PathFormat) -> Union[CelestialObject, CompactCelestialObject]:
+    """Response object for a planet already computed at ``current_time``"""
+    # Get next rise and set times from the cached event solver
+    next_rise = next_event(calculator, planet_name, "rises", current_time)
+    next_set = next_event(calculator, planet_name, "sets", current_time)
+    
+    # Determine current visibility against the site's horizon
+    current_alt = float(planet.alt) * 180/np.pi
+    is_visible = bool(calculator.above_horizon(current_alt, float(planet.az) * 180/np.pi))
+    
+    visibility_message = []
+    if is_visible:
+        visibility_message.append(f"Currently visible at {current_alt:.1f}° above horizon")
+    elif current_alt > 0:
+        visibility_message.append(f"Currently behind the local horizon at {current_alt:.1f}°")
+    else:
+        visibility_message.append("Currently below horizon")
+    
+    if next_rise:
+        visibility_message.append(f"Next rise: {next_rise.strftime('%H:%M')}")
+    if next_set:
+        visibility_message.append(f"Next set: {next_set.strftime('%H:%M')}")
+    
+    visibility = Visibility(
+        isVisible=is_visible,
+        message="\n".join(visibility_message)
+    )
+    
+    # Slowly varying attributes come from the metadata cache
+    attributes = body_attributes(planet_name, current_time)
+    base_data = {
+        "constellation": attributes["constellation"],
+        "magnitude": attributes["magnitude"],
+        "phase": attributes["phase"]
+    }
+    
+    return make_celestial_object(
+        path_format,
+        daily_path,
+        name=planet_name,
+        type="planet",
+        visibility=visibility,
+        base_data=base_data
+    )
+
+def build_moon_object(calculator: CelestialCalculator, moon: ephem.Body, daily_path: DailyPath,
+                      current_time: datetime,
+                      path_format: PathFormat) -> Union[CelestialObject, CompactCelestialObject]:
+    """Response object for the Moon already computed at ``current_time``"""
+    return make_celestial_object(
+        path_format,
+        daily_path,
+        name="Moon",
+        type="moon",
+        visibility=Visibility(
+            isVisible=bool(calculator.above_horizon(float(moon.alt) * 180/np.pi, float(moon.az) * 180/np.pi)),
+            message="Moon visibility information"
+        ),
+        base_data={"phase": body_attributes("Moon", current_time)["phase"]}
+    )
+
+def merge_current_position(obj: Union[CelestialObject, CompactCelestialObject], daily_path: DailyPath,
+                           now: float, position: Position) -> None:
+    """Put ``position`` at the path sample at or before ``now`` (an ephem date)"""
+    # Path times are numeric, so the sample is found without parsing any timestamps
+    current_idx = int(np.searchsorted(daily_path.times, now, side="right")) - 1
+    if not 0 <= current_idx < len(daily_path.times):
+        return
+    if isinstance(obj, CompactCelestialObject):
+        obj.path.current_index = current_idx
+        obj.path.current = position
+    else:
+        obj.daily_path[current_idx] = position
+
+def get_planet_data(planet_name: str, calculator: CelestialCalculator, path_format: PathFormat = PathFormat(),
+                    current_time: Optional[datetime] = None) -> Union[CelestialObject, CompactCelestialObject]:
+    """Calculate detailed data for a specific planet at ``current_time`` (default: now)"""
+    logger.debug(f"Calculating detailed data for planet: {planet_name}")
     
     try:
-        # Create planet object and set current time
-        planet = get_planet_body(planet_name)
-        current_time = datetime.now()
-        calculator.observer.date = current_time
-        
-        # Compute current position
-        planet.compute(calculator.observer)
-        
-        # Calculate daily path (positions throughout the day)
-        daily_path: List[Position] = []
-        start_time = current_time.replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        for hour in range(24):
-            time = start_time + timedelta(hours=hour)
-            calculator.observer.date = time
-            planet.compute(calculator.observer)
-            
-            position = Position(
-                time=time.isoformat(),
-                altitude=float(planet.alt) * 180/np.pi,
-                azimuth=float(planet.az) * 180/np.pi
-            )
-            daily_path.append(position)
-        
-        # Calculate visibility information
-        calculator.observer.date = current_time
-        planet.compute(calculator.observer)
-        
-        # Get next rise and set times
-        try:
-            next_rise = ephem.Date(calculator.observer.next_rising(planet)).datetime()
-            next_set = ephem.Date(calculator.observer.next_setting(planet)).datetime()
-        except ephem.CircumpolarError:
-            next_rise = None
-            next_set = None
-        
-        # Determine current visibility
-        current_alt = float(planet.alt) * 180/np.pi
-        is_visible = current_alt > 0
-        
-        visibility_message = []
-        if is_visible:
-            visibility_message.append(f"Currently visible at {current_alt:.1f}° above horizon")
-        else:
-            visibility_message.append("Currently below horizon")
-        
-        if next_rise:
-            visibility_message.append(f"Next rise: {next_rise.strftime('%H:%M')}")
-        if next_set:
-            visibility_message.append(f"Next set: {next_set.strftime('%H:%M')}")
-        
-        visibility = Visibility(
-            isVisible=is_visible,
-            message="\n".join(visibility_message)
-        )
-        
-        # Get additional base data
-        base_data = {
-            "constellation": ephem.constellation(planet)[1],
-            "magnitude": float(planet.mag),
-            "phase": float(planet.phase) if hasattr(planet, 'phase') else None
-        }
-        
-        logger.info(f"Successfully calculated data for {planet_name}")
-        return CelestialObject(
-            name=planet_name,
-            type="planet",
-            daily_path=daily_path,
-            visibility=visibility,
-            base_data=base_data
-        )
+        # Validate the name, then compute the planet once at the current time
+        get_planet_body(planet_name)
+        current_time = current_time or utc_now()
+        planet = observe_body(planet_name, calculator.observer_at(current_time))
+        daily_path = format_path(calculator, planet_name, current_time, path_format)
+        return build_planet_object(planet_name, calculator, planet, daily_path, current_time, path_format)
         
     except Exception as e:
         logger.error(f"Error calculating planet data for {planet_name}: {str(e)}", exc_info=True)
         raise
 
-@app.get("/realtime-positions")
-async def get_realtime_positions() -> Dict[str, Position]:
+def compute_realtime_positions(calculator: CelestialCalculator) -> Dict[str, Position]:
+    """Current Moon position"""
+    moon = observe_body("Moon", calculator.observer_at())
+    position = current_position(moon, utc_now().isoformat())
+    
+    logger.debug(f"Moon position calculated: alt={position.altitude}, az={position.azimuth}")
+    return {"Moon": position}
+
+def compute_daily_positions(calculator: CelestialCalculator, path_format: PathFormat = PathFormat(),
+                            merge_current: bool = False,
+                            current_time: Optional[datetime] = None) -> Dict[str, Union[CelestialObject, CompactCelestialObject]]:
+    """Daily paths and visibility for all planets and the Moon, in one pass over the bodies.
+
+    Visibility is for ``current_time`` (default: now). With ``merge_current``
+    each body's current position, from the same computation that decides its
+    visibility, replaces the path sample at or before that time.
+    """
+    current_time = current_time or utc_now()
+    observer = calculator.observer_at(current_time)
+    now = float(observer.date)
+    timestamp = current_time.isoformat()
+    
+    result = {}
+    for body_name in DAILY_BODIES:
+        body = observe_body(body_name, observer)
+        daily_path = format_path(calculator, body_name, current_time, path_format)
+        if body_name == "Moon":
+            obj = build_moon_object(calculator, body, daily_path, current_time, path_format)
+        else:
+            obj = build_planet_object(body_name, calculator, body, daily_path, current_time, path_format)
+        if merge_current:
+            merge_current_position(obj, daily_path, now, current_position(body, timestamp))
+        result[body_name] = obj
+    
+    return result
+
+def parse_satellite_keys(satellites: Optional[str]) -> Optional[List[str]]:
+    """Satellite names or NORAD ids from a comma-separated query parameter, checked against the catalog"""
+    if satellites is None:
+        return None
+    keys = [key.strip() for key in satellites.split(",") if key.strip()]
     try:
-        logger.info("Calculating realtime positions")
-        
-        calculator.observer.date = datetime.now()
-        moon = ephem.Moon()
-        moon.compute(calculator.observer)
-        
-        position = Position(
-            time=datetime.now().isoformat(),
-            altitude=float(moon.alt) * 180/np.pi,
-            azimuth=float(moon.az) * 180/np.pi
+        require_satellite_catalog().select(keys)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=f"Unknown satellites: {e.args[0]}")
+    return keys
+
+def require_satellite_catalog() -> SatelliteCatalog:
+    """The satellite catalog, or a 503 when none is configured or loadable"""
+    try:
+        return get_satellite_catalog()
+    except SatelliteCatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+def to_pass_info(satellite_pass: SatellitePass) -> SatellitePassInfo:
+    start, peak, end = to_datetimes(np.array([satellite_pass.start, satellite_pass.peak, satellite_pass.end]))
+    return SatellitePassInfo(
+        name=satellite_pass.name,
+        norad_id=satellite_pass.norad_id,
+        start=start.isoformat(),
+        peak=peak.isoformat(),
+        end=end.isoformat(),
+        max_altitude=satellite_pass.max_altitude,
+        visible=satellite_pass.visible,
+        path=positions_from_arrays(satellite_pass.times, satellite_pass.altitudes, satellite_pass.azimuths)
+    )
+
+def build_satellite_objects(passes: List[SatellitePass]) -> Dict[str, CelestialObject]:
+    """One object per satellite whose ``daily_path`` is its next pass"""
+    result = {}
+    for satellite_pass in passes:
+        if satellite_pass.name in result:
+            continue
+        peak = to_datetimes(np.array([satellite_pass.peak]))[0]
+        result[satellite_pass.name] = CelestialObject(
+            name=satellite_pass.name,
+            type="satellite",
+            base_data=BaseData(),
+            visibility=Visibility(
+                isVisible=satellite_pass.visible,
+                message=f"Next pass peaks at {satellite_pass.max_altitude:.1f}° at {peak.strftime('%H:%M')}"
+            ),
+            daily_path=positions_from_arrays(satellite_pass.times, satellite_pass.altitudes, satellite_pass.azimuths)
         )
-        
-        logger.info(f"Moon position calculated: alt={position.altitude}, az={position.azimuth}")
-        return {"Moon": position}
+    return result
+
+def compute_satellite_passes(calculator: CelestialCalculator, keys: Optional[List[str]], hours: float,
+                             min_altitude: float, visible_only: bool) -> List[SatellitePassInfo]:
+    passes = cached_passes(calculator, keys, utc_now(), hours, min_altitude)
+    with stage_timer("model"):
+        return [to_pass_info(p) for p in passes if p.visible or not visible_only]
+
+def compute_combined_positions(calculator: CelestialCalculator, path_format: PathFormat = PathFormat(),
+                               satellite_keys: Optional[List[str]] = None,
+                               current_time: Optional[datetime] = None) -> Dict[str, Union[CelestialObject, CompactCelestialObject]]:
+    """Daily positions with every body's realtime position merged in, plus any requested satellites"""
+    current_time = current_time or utc_now()
+    result = compute_daily_positions(calculator, path_format, merge_current=True, current_time=current_time)
+    if satellite_keys:
+        result.update(build_satellite_objects(cached_passes(calculator, satellite_keys, current_time)))
+    return result
+
+def compute_visible_stars(calculator: CelestialCalculator, max_magnitude: float, min_altitude: float,
+                          center: Optional[Tuple[float, float]], radius: Optional[float], limit: int) -> List[StarObject]:
+    """Catalog stars above the site's horizon now, or within a field of view, brightest first"""
+    observer = calculator.observer_at(utc_now())
+    with stage_timer("stars"):
+        stars = visible_stars(observer, max_magnitude, min_altitude, center, radius, limit,
+                              calculator.horizon)
+    return [StarObject(**star._asdict()) for star in stars]
+
+@app.on_event("startup")
+async def warm_caches():
+    """Fill today's caches before the worker starts accepting requests"""
+    locations = parse_locations(WARMUP_LOCATIONS, Location(DEFAULT_LAT, DEFAULT_LONG, DEFAULT_ELEVATION))
+    if locations:
+        started = time.perf_counter()
+        await run_compute(warm_up, locations)
+        startup_duration.set(time.perf_counter() - started, "warmup")
+        logger.info(f"Warmed caches for {len(locations)} locations in {time.perf_counter() - started:.2f}s")
+
+_loop_monitor: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def start_loop_monitor():
+    global _loop_monitor
+    if LOOP_LAG_INTERVAL > 0:
+        _loop_monitor = asyncio.create_task(monitor_event_loop())
+
+@app.on_event("shutdown")
+async def stop_loop_monitor():
+    if _loop_monitor is not None:
+        _loop_monitor.cancel()
+
+@app.on_event("shutdown")
+def stop_executor():
+    shutdown_executor()
+
+@app.on_event("shutdown")
+async def stop_weather_service():
+    await close_weather_service()
+
+@app.get("/realtime-positions")
+async def get_realtime_positions(
+    calculator: CelestialCalculator = Depends(location_calculator)
+) -> Dict[str, Position]:
+    try:
+        logger.debug("Calculating realtime positions")
+        return await run_compute(compute_realtime_positions, calculator)
     except Exception as e:
         logger.error(f"Error in get_realtime_positions: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/realtime-positions/stream")
+async def stream_realtime_positions(
+    request: Request,
+    bodies: Optional[str] = Query(None, description="Comma-separated body names"),
+    interval: float = Query(5.0, ge=MIN_STREAM_INTERVAL, le=MAX_STREAM_INTERVAL),
+    format: Optional[Literal["ndjson", "sse"]] = None,
+    calculator: CelestialCalculator = Depends(location_calculator)
+):
+    """Push realtime positions every ``interval`` seconds as NDJSON or Server-Sent Events"""
+    names = tuple(name.strip().title() for name in bodies.split(",")) if bodies else tuple(DAILY_BODIES)
+    unknown = [name for name in names if name not in BODY_CLASSES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown bodies: {', '.join(unknown)}. Supported bodies: {', '.join(BODY_CLASSES)}"
+        )
+    
+    use_sse = format == "sse" or (format is None and "text/event-stream" in request.headers.get("accept", ""))
+    logger.info(f"Opening {'SSE' if use_sse else 'NDJSON'} position stream for {', '.join(names)}")
+    
+    async def updates():
+        stream = broadcaster.stream(calculator, names, interval)
+        try:
+            async for payload in stream:
+                yield f"data: {payload}\n\n" if use_sse else payload + "\n"
+        finally:
+            # Unsubscribe as soon as the client goes away
+            await stream.aclose()
+    
+    return StreamingResponse(
+        updates(),
+        media_type="text/event-stream" if use_sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def requested_time(bucket: TimeBucket, day: Optional[date]) -> datetime:
+    """The bucket's start, moved to ``day`` when one was requested"""
+    return bucket.start if day is None else datetime.combine(day, bucket.start.time())
+
+def location_etag(endpoint: str, calculator: CelestialCalculator, current_time: datetime, *parts) -> str:
+    """ETag of a bucketed response at the calculator's (pooled) location"""
+    return make_etag(endpoint, calculator.lat, calculator.lon, calculator.elevation, calculator.horizon_key,
+                     current_time, *parts)
+
 @app.get("/daily_positions")
-async def get_daily_positions() -> Dict[str, CelestialObject]:
+async def get_daily_positions(
+    request: Request,
+    response: Response,
+    day: Optional[date] = Query(None, alias="date", description="UTC day; defaults to today"),
+    calculator: CelestialCalculator = Depends(location_calculator),
+    path_format: PathFormat = Depends(requested_path_format)
+) -> Dict[str, Union[CelestialObject, CompactCelestialObject]]:
     """Get daily positions for all planets"""
-    logger.info("Calculating daily positions for all planets")
+    bucket = time_bucket()
+    current_time = requested_time(bucket, day)
+    etag = location_etag("daily_positions", calculator, current_time, DAILY_BODIES, path_format)
+    not_modified = conditional_response(request, response, etag, bucket)
+    if not_modified is not None:
+        return not_modified
+    
+    logger.debug("Calculating daily positions for all planets")
     try:
-        result = {}
-        for planet_name in SUPPORTED_PLANETS:
-            planet_data = await get_planet_data(planet_name)
-            result[planet_name] = planet_data
-        
-        # Add moon data
-        calculator.observer.date = datetime.now()
-        moon = ephem.Moon()
-        moon.compute(calculator.observer)
-        
-        daily_path = []
-        start_time = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        for hour in range(24):
-            time = start_time + timedelta(hours=hour)
-            calculator.observer.date = time
-            moon.compute(calculator.observer)
-            
-            position = Position(
-                time=time.isoformat(),
-                altitude=float(moon.alt) * 180/np.pi,
-                azimuth=float(moon.az) * 180/np.pi
-            )
-            daily_path.append(position)
-        
-        result["Moon"] = CelestialObject(
-            name="Moon",
-            type="moon",
-            daily_path=daily_path,
-            visibility=Visibility(
-                isVisible=float(moon.alt) > 0,
-                message="Moon visibility information"
-            ),
-            base_data={"phase": float(moon.phase)}
-        )
-        
-        return result
+        return await run_compute(compute_daily_positions, calculator, path_format, False, current_time)
     except Exception as e:
         logger.error(f"Error in get_daily_positions: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/combined-positions")
-async def get_combined_positions():
+async def get_combined_positions(
+    request: Request,
+    response: Response,
+    calculator: CelestialCalculator = Depends(location_calculator),
+    path_format: PathFormat = Depends(requested_path_format),
+    satellites: Optional[str] = Query(None, description="Comma-separated satellite names or NORAD ids"),
+    day: Optional[date] = Query(None, alias="date", description="UTC day; defaults to today")
+) -> Dict[str, Union[CelestialObject, CompactCelestialObject]]:
     """Get combined daily and realtime positions in a single request"""
+    satellite_keys = parse_satellite_keys(satellites)
+    bucket = time_bucket()
+    current_time = requested_time(bucket, day)
+    satellite_version = require_satellite_catalog().version if satellite_keys else None
+    etag = location_etag("combined-positions", calculator, current_time, DAILY_BODIES, path_format,
+                         satellite_keys, satellite_version)
+    not_modified = conditional_response(request, response, etag, bucket)
+    if not_modified is not None:
+        return not_modified
+    
     try:
-        logger.info("Fetching combined positions")
-        
-        # Get current time for performance comparison
-        start_time = datetime.now()
-        
-        # Get daily positions directly
-        result = {}
-        for planet_name in SUPPORTED_PLANETS:
-            planet_data = await get_planet_data(planet_name)
-            result[planet_name] = planet_data
-        
-        # Add moon data
-        calculator.observer.date = datetime.now()
-        moon = ephem.Moon()
-        moon.compute(calculator.observer)
-        
-        daily_path = []
-        start_time_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        
-        for hour in range(24):
-            time = start_time_day + timedelta(hours=hour)
-            calculator.observer.date = time
-            moon.compute(calculator.observer)
-            
-            position = Position(
-                time=time.isoformat(),
-                altitude=float(moon.alt) * 180/np.pi,
-                azimuth=float(moon.az) * 180/np.pi
-            )
-            daily_path.append(position)
-        
-        result["Moon"] = CelestialObject(
-            name="Moon",
-            type="moon",
-            daily_path=daily_path,
-            visibility=Visibility(
-                isVisible=float(moon.alt) > 0,
-                message="Moon visibility information"
-            ),
-            base_data={"phase": float(moon.phase)}
-        )
-        
-        daily_positions = result
-        
-        # Get realtime positions
-        realtime_positions = await get_realtime_positions()
-        
-        # Merge realtime data into daily data
-        current_time = datetime.now()
-        for obj_name, position in realtime_positions.items():
-            if obj_name in daily_positions:
-                # Find the appropriate index in the daily path using binary search
-                obj_data = daily_positions[obj_name]
-                daily_path = obj_data.daily_path
-                
-                # Only process if there's a daily path
-                if daily_path:
-                    # Binary search implementation
-                    low, high = 0, len(daily_path) - 1
-                    current_idx = -1
-                    
-                    while low <= high and current_idx == -1:
-                        mid = (low + high) // 2
-                        mid_time = datetime.fromisoformat(daily_path[mid].time)
-                        
-                        if mid_time < current_time:
-                            if mid == len(daily_path) - 1 or datetime.fromisoformat(daily_path[mid + 1].time) > current_time:
-                                current_idx = mid
-                            else:
-                                low = mid + 1
-                        else:
-                            high = mid - 1
-                    
-                    # Update the position if found
-                    if current_idx != -1 and current_idx < len(daily_path):
-                        daily_positions[obj_name].daily_path[current_idx] = position
-        
-        # Log performance
-        processing_time = (datetime.now() - start_time).total_seconds()
-        logger.info(f"Combined positions processed in {processing_time:.3f} seconds")
-        
-        return daily_positions
+        logger.debug("Fetching combined positions")
+        return await run_compute(compute_combined_positions, calculator, path_format, satellite_keys, current_time)
+    except SatelliteCatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         logger.error(f"Error in get_combined_positions: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/batch/positions")
+async def post_batch_positions(request: BatchRequest):
+    """Stream daily paths and visible objects for many locations as NDJSON"""
+    bodies = request.bodies or DAILY_BODIES
+    dates = request.dates or [utc_now().date()]
+    try:
+        validate_batch(request.locations, dates, bodies, request.step_minutes)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    logger.info(f"Streaming batch positions for {len(request.locations)} locations x {len(dates)} dates")
+    return StreamingResponse(
+        iter_batch_results(request.locations, dates, bodies, request.step_minutes),
+        media_type="application/x-ndjson"
+    )
+
+def validate_range(start: date, end: date, max_days: int = MAX_EVENT_DAYS) -> int:
+    """Number of days from ``start`` to ``end`` inclusive; 400 if out of bounds"""
+    days = (end - start).days + 1
+    if not 1 <= days <= max_days:
+        raise HTTPException(status_code=400, detail=f"end must be 0 to {max_days - 1} days after start")
+    return days
+
+def compute_path_range(calculator: CelestialCalculator, start: date, days: int, names: List[str],
+                       path_format: PathFormat) -> List[DayPaths]:
+    """Every body's path for each day of a range, computing only days not already cached"""
+    paths = {name: format_paths(calculator, name, start, days, path_format) for name in names}
+    return [
+        make_day_paths(path_format, start + timedelta(days=d), {name: paths[name][d] for name in names})
+        for d in range(days)
+    ]
+
+@app.get("/paths")
+async def get_paths(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    bodies: Optional[str] = Query(None, description="Comma-separated body names"),
+    calculator: CelestialCalculator = Depends(location_calculator),
+    path_format: PathFormat = Depends(requested_path_format)
+) -> List[DayPaths]:
+    """Daily paths for every UTC day from ``start`` to ``end`` (inclusive, defaults to ``start``)"""
+    names = [name.strip().title() for name in bodies.split(",")] if bodies else DAILY_BODIES
+    unknown = [name for name in names if name not in BODY_CLASSES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown bodies: {', '.join(unknown)}. Supported bodies: {', '.join(BODY_CLASSES)}"
+        )
+    start = start or utc_now().date()
+    days = validate_range(start, end or start, MAX_PATH_DAYS)
+    
+    try:
+        logger.debug(f"Computing paths for {days} days")
+        return await run_compute(compute_path_range, calculator, start, days, names, path_format)
+    except Exception as e:
+        logger.error(f"Error in get_paths: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/events")
+async def get_events(
+    start: Optional[date] = None,
+    days: int = Query(1, ge=1, le=MAX_EVENT_DAYS),
+    end: Optional[date] = Query(None, description="Last day (inclusive); overrides days"),
+    bodies: Optional[str] = Query(None, description="Comma-separated body names"),
+    calculator: CelestialCalculator = Depends(location_calculator)
+) -> List[DayEvents]:
+    """Rise, transit, set and twilight times per day over a date range"""
+    start = start or utc_now().date()
+    if end is not None:
+        days = validate_range(start, end)
+    names = [name.strip().title() for name in bodies.split(",")] if bodies else list(BODY_CLASSES)
+    unknown = [name for name in names if name not in BODY_CLASSES]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown bodies: {', '.join(unknown)}. Supported bodies: {', '.join(BODY_CLASSES)}"
+        )
+    
+    try:
+        logger.debug(f"Solving events for {days} days")
+        solved = await run_compute(solve_events, calculator, start, days)
+        return [to_day_events(day, names) for day in solved]
+    except Exception as e:
+        logger.error(f"Error in get_events: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/plan")
+async def get_plan(
+    start: Optional[date] = None,
+    nights: int = Query(7, ge=1, le=MAX_PLAN_NIGHTS),
+    planets: Optional[str] = Query(None, description="Comma-separated planet names"),
+    min_altitude: float = Query(10.0, ge=0, lt=90),
+    darkness: Literal["civil", "nautical", "astronomical"] = "astronomical",
+    forecast: Optional[Literal["stub"]] = None,
+    calculator: CelestialCalculator = Depends(location_calculator)
+) -> List[NightPlan]:
+    """Darkness, Moon interference and planet viewing windows for each night of a range"""
+    names = [name.strip().title() for name in planets.split(",")] if planets else SUPPORTED_PLANETS
+    unknown = [name for name in names if name not in SUPPORTED_PLANETS]
+    if unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown planets: {', '.join(unknown)}. Supported planets: {', '.join(SUPPORTED_PLANETS)}"
+        )
+    
+    try:
+        logger.debug(f"Planning {nights} nights")
+        return await run_compute(cached_plan, calculator, start or utc_now().date(), nights,
+                                 names, min_altitude, darkness, forecast)
+    except Exception as e:
+        logger.error(f"Error in get_plan: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/sky")
+async def get_sky(
+    request: Request,
+    response: Response,
+    at: Optional[datetime] = Query(None, description="Instant (UTC); defaults to now"),
+    min_altitude: Optional[float] = Query(None, ge=-90, le=90, description="Degrees above the site's horizon"),
+    max_magnitude: Optional[float] = Query(None, le=15),
+    stars: bool = False,
+    paths: bool = False,
+    calculator: CelestialCalculator = Depends(location_calculator),
+    path_format: PathFormat = Depends(requested_path_format)
+) -> SkySnapshot:
+    """Alt/az, magnitude and constellation of every body at one instant, with optional filters"""
+    if at is not None and at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    bucket = time_bucket(at)
+    when = at or bucket.start
+    etag = location_etag("sky", calculator, when, min_altitude, max_magnitude, stars, paths, path_format)
+    not_modified = conditional_response(request, response, etag, bucket)
+    if not_modified is not None:
+        return not_modified
+    
+    try:
+        logger.debug(f"Taking a sky snapshot at {when.isoformat()}")
+        return await run_compute(sky_snapshot, calculator, when, min_altitude, max_magnitude,
+                                 stars, paths, path_format)
+    except Exception as e:
+        logger.error(f"Error in get_sky: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/stars")
+async def get_stars(
+    max_magnitude: float = Query(4.0, le=15),
+    min_altitude: float = Query(0.0, ge=-90, le=90, description="Degrees above the site's horizon"),
+    alt: Optional[float] = Query(None, ge=-90, le=90, description="Field of view centre altitude"),
+    az: Optional[float] = Query(None, ge=0, le=360, description="Field of view centre azimuth"),
+    radius: Optional[float] = Query(None, gt=0, le=180, description="Field of view radius in degrees"),
+    limit: int = Query(500, ge=1, le=MAX_STAR_RESULTS),
+    calculator: CelestialCalculator = Depends(location_calculator)
+) -> List[StarObject]:
+    """Catalog stars brighter than ``max_magnitude`` above the horizon or within a field of view"""
+    fov = (alt, az, radius)
+    if any(v is not None for v in fov) and any(v is None for v in fov):
+        raise HTTPException(status_code=400, detail="alt, az and radius must be given together")
+    center = (alt, az) if alt is not None else None
+    
+    try:
+        logger.debug(f"Querying stars brighter than {max_magnitude}")
+        return await run_compute(compute_visible_stars, calculator, max_magnitude, min_altitude,
+                                 center, radius, limit)
+    except Exception as e:
+        logger.error(f"Error in get_stars: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/satellites/passes")
+async def get_satellite_passes(
+    satellites: Optional[str] = Query(None, description="Comma-separated satellite names or NORAD ids"),
+    hours: float = Query(24.0, gt=0, le=MAX_WINDOW_HOURS),
+    min_altitude: float = Query(10.0, ge=0, lt=90),
+    visible_only: bool = False,
+    calculator: CelestialCalculator = Depends(location_calculator)
+) -> List[SatellitePassInfo]:
+    """Passes over the location in the next ``hours``, from the TLE file named by CELESTIAL_SATELLITE_TLE"""
+    require_satellite_catalog()
+    satellite_keys = parse_satellite_keys(satellites)
+    try:
+        logger.debug(f"Predicting satellite passes for the next {hours} hours")
+        return await run_compute(compute_satellite_passes, calculator, satellite_keys,
+                                 hours, min_altitude, visible_only)
+    except SatelliteCatalogUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error in get_satellite_passes: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request, stage, cache and per-body counters in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
+
 @app.get("/planets")
 async def list_planets():
     """Get list of all supported planets"""
-    logger.info("Returning list of supported planets")
+    logger.debug("Returning list of supported planets")
     return {"planets": SUPPORTED_PLANETS}
 
 @app.get("/planet/{planet_name}")
-async def get_planet(planet_name: str) -> CelestialObject:
+async def get_planet(
+    planet_name: str,
+    request: Request,
+    response: Response,
+    day: Optional[date] = Query(None, alias="date", description="UTC day; defaults to today"),
+    calculator: CelestialCalculator = Depends(location_calculator),
+    path_format: PathFormat = Depends(requested_path_format)
+) -> Union[CelestialObject, CompactCelestialObject]:
     """Get detailed data for a specific planet"""
     try:
         # Normalize planet name to match our supported list
         normalized_name = planet_name.title()
-        logger.info(f"Received request for planet: {planet_name} (normalized: {normalized_name})")
+        logger.debug(f"Received request for planet: {planet_name} (normalized: {normalized_name})")
         
         if normalized_name not in SUPPORTED_PLANETS:
             logger.warning(f"Unsupported planet requested: {planet_name}")
@@ -323,7 +700,14 @@ async def get_planet(planet_name: str) -> CelestialObject:
                 detail=f"Planet {planet_name} not found. Supported planets: {', '.join(SUPPORTED_PLANETS)}"
             )
             
-        return await get_planet_data(normalized_name)
+        bucket = time_bucket()
+        current_time = requested_time(bucket, day)
+        etag = location_etag("planet", calculator, current_time, normalized_name, path_format)
+        not_modified = conditional_response(request, response, etag, bucket)
+        if not_modified is not None:
+            return not_modified
+        
+        return await run_compute(get_planet_data, normalized_name, calculator, path_format, current_time)
         
     except HTTPException:
         raise
@@ -331,154 +715,95 @@ async def get_planet(planet_name: str) -> CelestialObject:
         logger.error(f"Error processing request for {planet_name}: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/bodies/{body_name}/info")
+async def get_body_info(
+    body_name: str,
+    request: Request,
+    response: Response,
+    at: Optional[datetime] = Query(None, description="Instant (UTC); defaults to now")
+) -> BodyInfo:
+    """Constellation, magnitude, phase, size and distances of a planet, the Moon or the Sun"""
+    normalized_name = body_name.title()
+    if normalized_name not in BODY_CLASSES:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Body {body_name} not found. Supported bodies: {', '.join(BODY_CLASSES)}"
+        )
+    if at is not None and at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    # The same everywhere on Earth, so no location in the ETag
+    bucket = info_bucket(at)
+    etag = make_etag("body-info", normalized_name, bucket.start)
+    not_modified = conditional_response(request, response, etag, bucket)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        return await run_compute(body_info, normalized_name, at or bucket.start)
+    except Exception as e:
+        logger.error(f"Error in get_body_info: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/horizon")
+async def get_horizon(
+    calculator: CelestialCalculator = Depends(location_calculator)
+) -> HorizonProfile:
+    """The location's horizon mask, for drawing; a flat horizon where none is configured"""
+    mask = calculator.horizon
+    if mask is None:
+        return HorizonProfile(masked=False, resolution=360.0, altitudes=[0.0])
+    return HorizonProfile(masked=True, resolution=mask.resolution,
+                          altitudes=[round(float(alt), 2) for alt in mask.table])
+
 @app.get("/weather")
 async def get_weather(lat: float = DEFAULT_LAT, lon: float = DEFAULT_LONG) -> Weather:
     """Get current weather conditions for astronomical observations"""
     try:
-        logger.info(f"Fetching weather data for coordinates: {lat}, {lon}")
-        
-        # Calculate sunrise and sunset times using ephem
-        obs = ephem.Observer()
-        obs.lat = str(lat)
-        obs.lon = str(lon)
+        logger.debug(f"Fetching weather data for coordinates: {lat}, {lon}")
+        weather = await get_weather_service().get(lat, lon)
         
-        # Calculate today's sunrise
-        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        obs.date = today
-        sun = ephem.Sun()
+        # Sunrise comes from the cached event solver of the pooled calculator
+        now = utc_now()
+        next_sunrise = await run_compute(next_event, get_calculator(lat, lon), "Sun", "rises", now)
+        if next_sunrise is None:
+            return weather
         
-        # Calculate sunrise and time to leave (30 minutes before sunrise)
-        next_sunrise = obs.next_rising(sun).datetime()
+        # Time to leave is 30 minutes before sunrise
         time_to_leave = next_sunrise - timedelta(minutes=30)
-        
-        if WEATHER_MOCK_ENABLED:
-            # Mock data since we don't have a real API key
-            # In a real app, we would call the OpenWeatherMap API like:
-            # response = requests.get(f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={API_KEY}&units=metric")
-            
-            # Get current time
-            current_time = datetime.now()
-            
-            # Generate realistic mock weather based on time of day and randomness
-            hour = current_time.hour
-            is_night = hour >= 18 or hour <= 6
-            
-            # Generate some randomness for the weather conditions
-            import random
-            rand_factor = random.random()
-            
-            # Conditions are better at night for observations
-            if is_night:
-                cloud_cover = random.randint(0, 40)  # Less clouds at night in our simulation
-                condition = "Clear" if cloud_cover < 20 else "Partly Cloudy"
-                temperature = 10 + (rand_factor * 10)  # 10-20 degrees at night
-            else:
-                cloud_cover = random.randint(20, 80)  # More clouds during the day
-                if cloud_cover < 30:
-                    condition = "Clear"
-                elif cloud_cover < 60:
-                    condition = "Partly Cloudy"
-                else:
-                    condition = "Cloudy"
-                temperature = 15 + (rand_factor * 15)  # 15-30 degrees during the day
-            
-            # Wind affects observation quality
-            wind_speed = random.randint(0, 25) / 3.6  # Convert km/h to m/s
-            
-            # Humidity
-            humidity = random.randint(40, 90)
-            
-            # Atmospheric visibility (good for observation)
-            visibility = 5 + (rand_factor * 15)  # 5-20 km
-            
-            # Determine if conditions are good for observation
-            is_good_for_observation = (
-                is_night and 
-                cloud_cover < 30 and 
-                wind_speed < 5 and 
-                visibility > 10
-            )
-            
-            weather_data = Weather(
-                temperature=round(temperature, 1),
-                condition=condition,
-                humidity=humidity,
-                wind_speed=round(wind_speed, 1),
-                cloud_cover=cloud_cover,
-                visibility=round(visibility, 1),
-                observation_time=current_time.isoformat(),
-                is_good_for_observation=is_good_for_observation,
-                sunrise_time=next_sunrise.isoformat(),
-                time_to_leave=time_to_leave.isoformat()
-            )
-            
-            logger.info(f"Weather conditions: {condition}, Cloud cover: {cloud_cover}%, Good for observation: {is_good_for_observation}")
-            return weather_data
-        else:
-            # Use the real OpenWeatherMap API
-            if not OPENWEATHERMAP_API_KEY:
-                raise ValueError("OpenWeatherMap API key not configured. Please add your API key to OPENWEATHERMAP_API_KEY.")
-                
-            # Make request to OpenWeatherMap API
-            response = requests.get(
-                f"https://api.openweathermap.org/data/2.5/weather?lat={lat}&lon={lon}&appid={OPENWEATHERMAP_API_KEY}&units=metric"
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"OpenWeatherMap API error: {response.status_code} - {response.text}")
-                raise HTTPException(status_code=502, detail=f"Weather API error: {response.status_code}")
-                
-            data = response.json()
-            
-            # Extract data from OpenWeatherMap response
-            weather_condition = data['weather'][0]['main']
-            weather_description = data['weather'][0]['description']
-            temp = data['main']['temp']
-            humidity = data['main']['humidity']
-            
-            # Wind speed comes in m/s by default with units=metric
-            wind_speed = data['wind']['speed']
-            
-            # Cloud cover percentage
-            cloud_cover = data.get('clouds', {}).get('all', 0)
-            
-            # Visibility in km (comes in meters from API)
-            visibility = data.get('visibility', 0) / 1000
-            
-            # Current time
-            current_time = datetime.now()
-            
-            # Determine if conditions are good for observation
-            # Good conditions: Clear sky at night, low wind, good visibility
-            is_night = current_time.hour >= 18 or current_time.hour <= 6
-            is_clear = weather_condition.lower() in ['clear', 'few clouds']
-            is_calm = wind_speed < 5.0
-            is_visible = visibility > 8.0
-            
-            is_good_for_observation = is_night and is_clear and is_calm and is_visible
-            
-            # Create weather data object
-            weather_data = Weather(
-                temperature=temp,
-                condition=weather_condition,
-                humidity=humidity,
-                wind_speed=wind_speed,
-                cloud_cover=cloud_cover,
-                visibility=visibility,
-                observation_time=current_time.isoformat(),
-                is_good_for_observation=is_good_for_observation,
-                sunrise_time=next_sunrise.isoformat(),
-                time_to_leave=time_to_leave.isoformat()
-            )
-            
-            logger.info(f"Weather from API: {weather_condition}, Cloud cover: {cloud_cover}%, Good for observation: {is_good_for_observation}")
-            return weather_data
-            
+        logger.debug(f"Weather conditions: {weather.condition}, Cloud cover: {weather.cloud_cover}%, "
+                     f"Good for observation: {weather.is_good_for_observation}")
+        return weather.model_copy(update={
+            "sunrise_time": next_sunrise.isoformat(),
+            "time_to_leave": time_to_leave.isoformat()
+        })
+    
+    except WeatherProviderError as e:
+        raise HTTPException(status_code=502, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching weather data: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error fetching weather data: {str(e)}")
 
+startup_duration.set(time.perf_counter() - _import_started, "imports")
+
 if __name__ == "__main__":
+    import os
+    import shutil
+    import tempfile
     import uvicorn
-    logger.info("Starting FastAPI server")
-    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
+    workers = int(os.environ.get("CELESTIAL_WORKERS", "1"))
+    if workers > 1:
+        # Workers re-import this module, so the shared cache is configured through the
+        # environment. Without an explicit directory each run gets a fresh private one
+        private_dir = None
+        if not os.environ.get("CELESTIAL_SHARED_CACHE_DIR"):
+            private_dir = os.environ["CELESTIAL_SHARED_CACHE_DIR"] = tempfile.mkdtemp(prefix="celestial-cache-")
+        logger.info(f"Starting FastAPI server with {workers} workers sharing "
+                    f"{os.environ['CELESTIAL_SHARED_CACHE_DIR']}")
+        try:
+            uvicorn.run("main:app", host="0.0.0.0", port=8000, log_level="info", workers=workers)
+        finally:
+            if private_dir is not None:
+                shutil.rmtree(private_dir, ignore_errors=True)
+    else:
+        logger.info("Starting FastAPI server")
+        uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
\ No newline at end of file
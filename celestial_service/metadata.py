@@ -0,0 +1,103 @@
+# celestial_service/metadata.py
+"""Slowly varying per-body attributes, cached per refresh interval.
+
+Constellation, magnitude, phase, apparent size and distances change over
+hours rather than seconds, and hardly depend on where the observer is (the
+Moon's parallax moves it by at most a degree). Each attribute has a refresh
+interval in ``REFRESH_SECONDS``. Attributes sharing an interval are computed
+together, geocentrically, at the start of that interval's time bucket (see
+``conditional.time_bucket``) and cached until the bucket ends, so one
+``body.compute()`` serves every location and request in the bucket.
+
+The position endpoints read magnitude, constellation and phase from here
+instead of deriving them from the body they just computed, and
+``/bodies/{name}/info`` serves the full set with a ``Cache-Control`` that
+lasts until the first attribute is due for a refresh.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import ephem
+
+from cache import TTLCache
+from conditional import TimeBucket, time_bucket, utc_now
+from ephemeris import make_body
+from metrics import body_computations, register_cache, stage_timer
+from models import BodyInfo
+
+# Seconds each attribute stays cached; every interval must divide a day
+REFRESH_SECONDS: Dict[str, int] = {
+    "constellation": 3600,
+    "magnitude": 3600,
+    "phase": 900,  # the Moon's illuminated fraction moves ~0.3% an hour
+    "size": 3600,
+    "earth_distance": 900,
+    "sun_distance": 3600,
+}
+
+ATTRIBUTES: Dict[str, Callable[[ephem.Body], Any]] = {
+    "constellation": lambda body: ephem.constellation(body)[1],
+    "magnitude": lambda body: float(body.mag),
+    "phase": lambda body: float(body.phase),  # percent illuminated
+    "size": lambda body: float(body.size),  # apparent diameter, arcseconds
+    "earth_distance": lambda body: float(body.earth_distance),  # AU
+    "sun_distance": lambda body: float(body.sun_distance),  # AU
+}
+
+# Refresh interval -> the attributes computed together for it
+_GROUPS: Dict[int, List[str]] = {}
+for _name, _seconds in REFRESH_SECONDS.items():
+    _GROUPS.setdefault(_seconds, []).append(_name)
+
+BODY_TYPES = {"Moon": "moon", "Sun": "sun"}
+
+_MISSING = object()
+
+INFO_CACHE_SIZE = 256
+info_cache = TTLCache(maxsize=INFO_CACHE_SIZE, ttl=max(REFRESH_SECONDS.values()))
+register_cache("body_info", info_cache)
+
+
+# Buckets are counted from here; any midnight gives the same boundaries as time_bucket
+_EPOCH = datetime(2000, 1, 1)
+
+
+def _compute_group(name: str, start: datetime, attributes: List[str]) -> Dict[str, Any]:
+    body = make_body(name)
+    with stage_timer("ephemeris"):
+        body.compute(ephem.Date(start))
+    body_computations.inc(name, "info")
+    return {attribute: ATTRIBUTES[attribute](body) for attribute in attributes}
+
+
+def body_attributes(name: str, when: Optional[datetime] = None) -> Dict[str, Any]:
+    """Every attribute in ``REFRESH_SECONDS`` for ``name`` at ``when`` (default: now), from the cache"""
+    # On the hot path a lookup has to cost less than the ephem calls it
+    # replaces, so the key is the bucket's index rather than its start
+    elapsed = ((when or utc_now()) - _EPOCH).total_seconds()
+    values: Dict[str, Any] = {}
+    for seconds, attributes in _GROUPS.items():
+        index = int(elapsed // seconds)
+        group = info_cache.get((name, seconds, index), _MISSING)
+        if group is _MISSING:
+            group = _compute_group(name, _EPOCH + timedelta(seconds=index * seconds), attributes)
+            info_cache.set((name, seconds, index), group)
+        values.update(group)
+    return values
+
+
+def info_bucket(when: Optional[datetime] = None) -> TimeBucket:
+    """The span over which none of the attributes is refreshed"""
+    return time_bucket(when, min(REFRESH_SECONDS.values()))
+
+
+def body_info(name: str, when: Optional[datetime] = None) -> BodyInfo:
+    """Cached attributes of ``name`` at ``when`` (default: now), with when they are next refreshed"""
+    when = when or utc_now()
+    return BodyInfo(
+        name=name,
+        type=BODY_TYPES.get(name, "planet"),
+        **body_attributes(name, when),
+        refresh_seconds=REFRESH_SECONDS,
+        valid_until=info_bucket(when).end.isoformat(),
+    )
@@ -0,0 +1,324 @@
+# celestial_service/metrics.py
+"""In-process metrics rendered in the Prometheus text exposition format.
+
+Counters and histograms are labelled, thread-safe and kept in one module
+level ``registry``; ``/metrics`` renders it. Stage timers are coarse and
+disjoint:
+
+- ``ephemeris``: event solving and current-position ``body.compute()`` calls
+- ``path_sampling``: computing a path's alt/az arrays on a cache miss
+- ``model``: building ``Position``/``CelestialObject`` response models
+- ``serialization``: from the endpoint returning to the response starting
+  (response-model validation and JSON encoding)
+
+``celestial_startup_duration_seconds`` records how long the worker took to
+import and to warm its caches (see ``startup.py``).
+
+``celestial_event_loop_lag_seconds`` is how late the event loop wakes a
+task that sleeps ``CELESTIAL_LOOP_LAG_INTERVAL`` seconds at a time (``0``
+turns the monitor off). Anything that blocks the loop (synchronous
+compute in an ``async`` endpoint, a blocking HTTP call) shows up there
+before it shows up in request latency.
+
+Caches registered with ``register_cache`` report their hit/miss counts at
+scrape time. With ``CELESTIAL_EXECUTOR=process`` compute runs in worker
+processes, so only the request histograms and main-process stages are seen.
+"""
+import asyncio
+import functools
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+
+from cache import TTLCache
+
+# Prometheus client defaults, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+STAGE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+LOOP_LAG_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+LOOP_LAG_INTERVAL = float(os.environ.get("CELESTIAL_LOOP_LAG_INTERVAL", "0.1"))  # seconds
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Monotonic count per label combination"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge:
+    """Last set value per label combination"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        with self._lock:
+            return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # labels -> [per-bucket counts..., sum, count]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    def count(self, *labels: str) -> int:
+        with self._lock:
+            state = self._values.get(labels)
+            return int(state[-1]) if state else 0
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bucket_names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, state in sorted(self._values.items()):
+                cumulative = 0.0
+                for bound, count in zip(self.buckets, state):
+                    cumulative += count
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(bucket_names, labels + (_format_value(bound),))} "
+                        f"{_format_value(cumulative)}"
+                    )
+                suffix = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{suffix} {_format_value(state[-2])}")
+                lines.append(f"{self.name}_count{suffix} {_format_value(state[-1])}")
+        return lines
+
+
+class Registry:
+    """Every metric plus the caches whose stats are reported at scrape time"""
+
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+        self.caches: Dict[str, TTLCache] = {}
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+
+    def _cache_lines(self) -> List[str]:
+        stats = {name: cache.stats() for name, cache in sorted(self.caches.items())}
+        lines = []
+        for field, kind, documentation in (
+            ("hits", "counter", "Cache lookups that found a live entry"),
+            ("misses", "counter", "Cache lookups that found nothing or an expired entry"),
+            ("size", "gauge", "Entries currently cached"),
+        ):
+            name = f"celestial_cache_{field}" + ("_total" if kind == "counter" else "")
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+            lines += [f'{name}{{cache="{cache}"}} {values[field]}' for cache, values in stats.items()]
+        return lines
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics.values():
+            lines += metric.render()
+        lines += self._cache_lines()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    "celestial_request_duration_seconds",
+    "Time to produce the response, by route template",
+    ("method", "endpoint", "status"),
+)
+stage_duration = registry.histogram(
+    "celestial_stage_duration_seconds",
+    "Time spent per request-processing stage",
+    ("stage",),
+    buckets=STAGE_BUCKETS,
+)
+startup_duration = registry.gauge(
+    "celestial_startup_duration_seconds",
+    "Time spent per worker startup phase: module imports and cache warm-up",
+    ("phase",),
+)
+body_computations = registry.counter(
+    "celestial_body_computations_total",
+    "Ephemeris computations per body: position lookups, fitted tracks and table lookups",
+    ("body", "kind"),
+)
+event_loop_lag = registry.histogram(
+    "celestial_event_loop_lag_seconds",
+    "How late the event loop resumed a periodically sleeping monitor task",
+    buckets=LOOP_LAG_BUCKETS,
+)
+
+
+def register_cache(name: str, cache: TTLCache) -> None:
+    """Report ``cache``'s hit/miss/size stats under ``cache="name"``"""
+    registry.caches[name] = cache
+
+
+def stage_timer(stage: str):
+    """Context manager timing one stage into ``celestial_stage_duration_seconds``"""
+    return stage_duration.time(stage)
+
+
+async def monitor_event_loop(interval: float = LOOP_LAG_INTERVAL) -> None:
+    """Observe ``event_loop_lag`` every ``interval`` seconds until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        event_loop_lag.observe(max(0.0, loop.time() - expected))
+
+
+# Per-request slot where TimedRoute records when the endpoint returned
+_endpoint_returned: ContextVar[Optional[List[float]]] = ContextVar("endpoint_returned", default=None)
+
+
+class TimedRoute(APIRoute):
+    """APIRoute that notes when its endpoint returns, so serialization can be timed"""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kw):
+            try:
+                return await endpoint(*args, **kw)
+            finally:
+                returned = _endpoint_returned.get()
+                if returned is not None:
+                    returned[0] = time.perf_counter()
+
+        super().__init__(path, timed_endpoint, **kwargs)
+
+
+def _route_template(scope) -> str:
+    # Label by route template, not raw path, to keep the label set bounded
+    route = scope.get("route")
+    if route is None:
+        for candidate in scope["app"].router.routes:
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate
+                break
+    return getattr(route, "path", "unmatched")
+
+
+class RequestMetricsMiddleware:
+    """ASGI middleware recording per-endpoint latency and serialization time.
+
+    Latency runs to the start of the response, so streaming endpoints report
+    their time to first byte rather than the stream's lifetime.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        returned = [0.0]
+        token = _endpoint_returned.set(returned)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                if returned[0]:
+                    stage_duration.observe(now - returned[0], "serialization")
+                request_duration.observe(
+                    now - started, scope["method"], _route_template(scope), str(message["status"])
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _endpoint_returned.reset(token)
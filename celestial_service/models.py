@@ -1,6 +1,7 @@
 # celestial_service/models.py
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Literal
+from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Literal, Union
+from datetime import date
 
 class Position(BaseModel):
     time: str
@@ -17,11 +18,134 @@ class Visibility(BaseModel):
 
 class CelestialObject(BaseModel):
     name: str
-    type: Literal['planet', 'star', 'moon', 'sun']
+    type: Literal['planet', 'star', 'moon', 'sun', 'satellite']
     base_data: BaseData
     visibility: Visibility  # Changed to required Visibility object
     daily_path: List[Position]
 
+class ColumnarPath(BaseModel):
+    """Compact daily path: a start time, a fixed step and parallel value columns"""
+    start: str  # ISO format time of the first sample
+    step_seconds: float
+    count: int
+    encoding: Literal['json', 'float32-base64']
+    altitude: Union[List[float], str]  # base64 of little-endian float32 when packed
+    azimuth: Union[List[float], str]
+    current_index: Optional[int] = None  # sample replaced by ``current`` in combined responses
+    current: Optional[Position] = None
+
+class AdaptivePath(BaseModel):
+    """Compact daily path sampled adaptively: linear interpolation stays within ``tolerance``"""
+    start: str  # ISO format time of the first sample
+    tolerance: float  # maximum interpolation error in degrees
+    count: int
+    offsets: List[float]  # seconds since ``start``, increasing
+    altitude: List[float]
+    azimuth: List[float]  # interpolate along the shorter arc
+    current_index: Optional[int] = None  # sample replaced by ``current`` in combined responses
+    current: Optional[Position] = None
+
+class CompactCelestialObject(BaseModel):
+    name: str
+    type: Literal['planet', 'star', 'moon', 'sun', 'satellite']
+    base_data: BaseData
+    visibility: Visibility
+    path: Union[ColumnarPath, AdaptivePath]
+
+class StarObject(BaseModel):
+    name: str
+    magnitude: float
+    altitude: float  # degrees, refracted
+    azimuth: float
+    ra: float  # degrees, J2000
+    dec: float
+    spectral: Optional[str] = None
+    constellation: Optional[str] = None
+
+class SatellitePassInfo(BaseModel):
+    name: str
+    norad_id: int
+    start: str  # ISO format time strings
+    peak: str
+    end: str
+    max_altitude: float  # degrees, geometric
+    visible: bool  # sunlit against a dark sky at some point of the pass
+    path: List[Position]
+
+class DayPaths(BaseModel):
+    date: str  # ISO format date (UTC day)
+    paths: Dict[str, Union[List[Position], ColumnarPath, AdaptivePath]]
+
+class SkyObject(BaseModel):
+    name: str
+    type: Literal['planet', 'star', 'moon', 'sun']
+    altitude: float  # degrees, refracted
+    azimuth: float
+    magnitude: float
+    constellation: str
+    path: Optional[Union[List[Position], ColumnarPath, AdaptivePath]] = None  # only when requested
+
+class SkySnapshot(BaseModel):
+    time: str  # ISO format time of the snapshot
+    objects: List[SkyObject]  # highest first
+
+class BodyInfo(BaseModel):
+    name: str
+    type: Literal['planet', 'moon', 'sun']
+    constellation: str
+    magnitude: float
+    phase: float  # percent illuminated
+    size: float  # apparent diameter, arcseconds
+    earth_distance: float  # AU
+    sun_distance: float
+    refresh_seconds: Dict[str, int]  # how long each attribute is cached for
+    valid_until: str  # ISO format time the first attribute is refreshed
+
+class HorizonProfile(BaseModel):
+    masked: bool  # false where no horizon mask is configured
+    resolution: float  # degrees of azimuth between entries, starting at north
+    altitudes: List[float]  # lowest visible altitude per azimuth step
+
+class TimeWindow(BaseModel):
+    start: str  # ISO format time string
+    end: str
+
+class BodyEvents(BaseModel):
+    rise: Optional[str] = None  # first rise within the day
+    transit: Optional[str] = None
+    set: Optional[str] = None  # first set within the day
+    transit_altitude: Optional[float] = None
+    always_up: bool = False
+    never_up: bool = False
+    above_horizon: List[TimeWindow]  # every above-horizon window within the day
+
+class Twilight(BaseModel):
+    dawn: Optional[str] = None
+    dusk: Optional[str] = None
+
+class DayEvents(BaseModel):
+    date: str  # ISO format date (UTC day)
+    bodies: Dict[str, BodyEvents]
+    twilight: Dict[str, Twilight]  # keyed by 'civil', 'nautical', 'astronomical'
+
+class PlanetWindows(BaseModel):
+    windows: List[TimeWindow]  # above the minimum altitude during darkness
+    best_time: Optional[str] = None  # highest point during darkness
+    best_altitude: Optional[float] = None
+
+class MoonInterference(BaseModel):
+    illumination: float  # illuminated fraction at mid-darkness
+    up: List[TimeWindow]  # Moon above the horizon during darkness
+    up_fraction: float  # share of the darkness with the Moon up
+
+class NightPlan(BaseModel):
+    date: str  # ISO format date of the evening (local mean time)
+    darkness: List[TimeWindow]
+    dark_hours: float
+    moon: MoonInterference
+    planets: Dict[str, PlanetWindows]
+    cloud_cover: Optional[float] = None  # percentage, only with a forecast
+
 class Weather(BaseModel):
     temperature: float  # in Celsius
     condition: str  # e.g., "Clear", "Cloudy", "Rain"
@@ -32,4 +156,16 @@ class Weather(BaseModel):
     observation_time: str  # ISO format time string
     is_good_for_observation: bool  # Whether conditions are good for sky observation
     sunrise_time: Optional[str] = None  # ISO format time string for sunrise
-    time_to_leave: Optional[str] = None  # ISO format time string for when to leave (30 min before sunrise)
\ No newline at end of file
+    time_to_leave: Optional[str] = None  # ISO format time string for when to leave (30 min before sunrise)
+
+class BatchLocation(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lon: float = Field(ge=-180, le=180)
+    elevation: float = 0  # in metres
+    id: Optional[str] = None  # echoed back so callers can match results
+
+class BatchRequest(BaseModel):
+    locations: List[BatchLocation]
+    dates: Optional[List[date]] = None  # defaults to today
+    bodies: Optional[List[str]] = None  # defaults to the planets and the Moon
+    step_minutes: int = 60  # sampling interval of the daily paths
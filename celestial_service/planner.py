@@ -0,0 +1,149 @@
+# celestial_service/planner.py
+"""Observation plans over a run of nights.
+
+Night ``d`` runs from local mean noon on ``d`` to local mean noon the next
+day, so every evening and the following morning fall in one night whatever
+the longitude. For the whole range each body's track is fitted once (or
+sliced from the installed table) and evaluated on one ``PLAN_GRID_MINUTES``
+grid, so a 30-night plan costs the same number of ``body.compute()`` calls
+per day as one ``/events`` request. Windows are read off the grid, with
+their edges placed by linear interpolation between samples.
+
+Darkness is the Sun's unrefracted centre below the ``TWILIGHT_ALTITUDES``
+level of the requested kind, as in ``events.py``. A planet's windows are
+where it is above ``min_altitude`` and the site's horizon mask during
+darkness; the Moon's are reported as interference, together with its
+illuminated fraction at mid-darkness. The Moon brightens the sky even from
+behind a building, so its windows use the true horizon.
+"""
+from datetime import date, datetime, time, timedelta
+from typing import TYPE_CHECKING, List, Optional, Sequence, Tuple
+
+import ephem
+import numpy as np
+
+from cache import TTLCache
+from ephemeris import fitted_track, make_body, to_datetimes, topocentric_altaz
+from events import TWILIGHT_ALTITUDES
+from metrics import register_cache, stage_timer
+from models import MoonInterference, NightPlan, PlanetWindows, TimeWindow
+from weather import stub_night_cloud_cover
+
+if TYPE_CHECKING:
+    from calculator import CelestialCalculator
+
+PLAN_GRID_MINUTES = 5
+MAX_PLAN_NIGHTS = 90
+
+PLAN_CACHE_SIZE = 256
+PLAN_CACHE_TTL = 6 * 3600  # seconds
+plan_cache = TTLCache(maxsize=PLAN_CACHE_SIZE, ttl=PLAN_CACHE_TTL)
+register_cache("plan", plan_cache)
+
+
+def _windows(times: np.ndarray, values: np.ndarray) -> List[Tuple[float, float]]:
+    """Spans where ``values`` is positive, with edges interpolated between samples"""
+    positive = values > 0
+    idx = np.flatnonzero(positive[:-1] != positive[1:])
+    edges = times[idx] + (times[idx + 1] - times[idx]) * values[idx] / (values[idx] - values[idx + 1])
+    bounds = ([times[0]] if positive[0] else []) + edges.tolist() + ([times[-1]] if positive[-1] else [])
+    return [(float(a), float(b)) for a, b in zip(bounds[::2], bounds[1::2])]
+
+
+def _duration(windows: Sequence[Tuple[float, float]]) -> float:
+    return sum(b - a for a, b in windows)
+
+
+def _time_windows(windows: Sequence[Tuple[float, float]]) -> List[TimeWindow]:
+    flat = to_datetimes(np.array(windows).ravel()) if windows else []
+    return [TimeWindow(start=a.isoformat(), end=b.isoformat()) for a, b in zip(flat[::2], flat[1::2])]
+
+
+def _elongation(ra1: np.ndarray, dec1: np.ndarray, ra2: np.ndarray, dec2: np.ndarray) -> np.ndarray:
+    cos_e = np.sin(dec1) * np.sin(dec2) + np.cos(dec1) * np.cos(dec2) * np.cos(ra1 - ra2)
+    return np.arccos(np.clip(cos_e, -1.0, 1.0))
+
+
+def compute_plan(calculator: "CelestialCalculator", start: date, nights: int, planets: Sequence[str],
+                 min_altitude: float = 10.0, darkness: str = "astronomical",
+                 forecast: Optional[str] = None) -> List[NightPlan]:
+    """One ``NightPlan`` per night from the evening of ``start``"""
+    level = TWILIGHT_ALTITUDES[darkness]
+    # Local mean noon of ``start``, as an ephem date
+    t0 = float(ephem.Date(datetime.combine(start, time(12)))) - calculator.lon / 360.0
+    per_night = (24 * 60) // PLAN_GRID_MINUTES
+    times = t0 + np.arange(nights * per_night + 1) * (PLAN_GRID_MINUTES / 1440.0)
+    observer = calculator.observer_at(t0)
+    lat, lon, elevation = float(observer.lat), float(observer.lon), float(observer.elevation)
+    pressure, temp = float(observer.pressure), float(observer.temp)
+
+    altitudes = {}
+    floors = {}  # per planet, the lowest usable altitude at each sample
+    radec = {}
+    with stage_timer("ephemeris"):
+        for name in list(planets) + ["Moon", "Sun"]:
+            ra, dec, dist = fitted_track(make_body(name), observer, times[0], times[-1])(times)
+            radec[name] = (ra, dec)
+            # Twilight uses the Sun's centre against the unrefracted horizon
+            altitudes[name], azimuths = topocentric_altaz(
+                ra, dec, dist, times, lat, lon, elevation, 0.0 if name == "Sun" else pressure, temp
+            )
+            if name in planets:
+                floors[name] = np.maximum(min_altitude, calculator.horizon_altitude(azimuths))
+    dark = level - altitudes["Sun"]
+    illumination = (1 - np.cos(_elongation(*radec["Moon"], *radec["Sun"]))) / 2
+
+    plans = []
+    with stage_timer("model"):
+        for n in range(nights):
+            night = slice(n * per_night, (n + 1) * per_night + 1)
+            t = times[night]
+            dark_windows = _windows(t, dark[night])
+            dark_days = _duration(dark_windows)
+            if dark_windows:
+                middle = 0.5 * (dark_windows[0][0] + dark_windows[-1][1])
+            else:
+                middle = 0.5 * (t[0] + t[-1])
+
+            moon_windows = _windows(t, np.minimum(altitudes["Moon"][night], dark[night]))
+            planet_windows = {}
+            for name in planets:
+                alt = altitudes[name][night]
+                usable = np.minimum(alt - floors[name][night], dark[night])
+                best = int(np.argmax(np.where(usable > 0, alt, -np.inf))) if (usable > 0).any() else None
+                planet_windows[name] = PlanetWindows(
+                    windows=_time_windows(_windows(t, usable)),
+                    best_time=to_datetimes(t[best:best + 1])[0].isoformat() if best is not None else None,
+                    best_altitude=float(alt[best]) if best is not None else None,
+                )
+
+            night_date = start + timedelta(days=n)
+            plans.append(NightPlan(
+                date=night_date.isoformat(),
+                darkness=_time_windows(dark_windows),
+                dark_hours=round(dark_days * 24, 2),
+                moon=MoonInterference(
+                    illumination=round(float(np.interp(middle, times, illumination)), 3),
+                    up=_time_windows(moon_windows),
+                    up_fraction=round(_duration(moon_windows) / dark_days, 3) if dark_days else 0.0,
+                ),
+                planets=planet_windows,
+                cloud_cover=(
+                    stub_night_cloud_cover(calculator.lat, calculator.lon, night_date)
+                    if forecast == "stub" else None
+                ),
+            ))
+    return plans
+
+
+def cached_plan(calculator: "CelestialCalculator", start: date, nights: int, planets: Sequence[str],
+                min_altitude: float = 10.0, darkness: str = "astronomical",
+                forecast: Optional[str] = None) -> List[NightPlan]:
+    """``compute_plan`` shared by requests for the same pooled location and parameters"""
+    key = (
+        round(calculator.lat, 6), round(calculator.lon, 6), round(calculator.elevation, 1), calculator.horizon_key,
+        start, nights, tuple(planets), min_altitude, darkness, forecast,
+    )
+    return plan_cache.get_or_compute(
+        key, lambda: compute_plan(calculator, start, nights, planets, min_altitude, darkness, forecast)
+    )
@@ -0,0 +1,110 @@
+# celestial_service/sampling.py
+"""Adaptive path sampling with a bound on interpolation error.
+
+Starting from a coarse grid, every interval where a probe point (every eighth
+of the interval) is further than half of ``tolerance`` degrees (great-circle)
+from the straight-line interpolation of its endpoints is split in two, down
+to ``MIN_STEP_MINUTES``. All intervals are checked together in each round,
+and evaluations come from a fitted ``GeocentricTrack``, so refining costs no
+extra ``body.compute()`` calls. The result is dense where the alt/az curve
+bends (refraction at the horizon, high transits) and sparse where it doesn't.
+Only the step floor can leave an interval above tolerance: where refraction
+cuts off just below the horizon, the error is bounded by one minute of motion.
+
+Clients reconstruct any time in the span by interpolating linearly between
+neighbouring samples: altitude directly, azimuth along the shorter arc.
+"""
+from typing import Callable, Tuple
+
+import ephem
+import numpy as np
+
+from ephemeris import fitted_track, topocentric_altaz
+
+DEFAULT_TOLERANCE_DEG = 0.1
+MIN_TOLERANCE_DEG = 0.01
+MAX_TOLERANCE_DEG = 5.0
+MIN_STEP_MINUTES = 1.0
+MAX_STEP_MINUTES = 120.0
+
+_PROBE_FRACTIONS = np.arange(1, 8) / 8.0
+# Probes only sample the error curve, so split at a fraction of the tolerance
+# to leave headroom for the error between them
+TOLERANCE_MARGIN = 0.5
+
+
+def _wrap180(angle: np.ndarray) -> np.ndarray:
+    return np.mod(angle + 180.0, 360.0) - 180.0
+
+
+def interpolate_altaz(times: np.ndarray, altitudes: np.ndarray, azimuths: np.ndarray,
+                      at: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Linear alt/az interpolation of a sampled path, azimuth along the shorter arc"""
+    at = np.asarray(at, dtype=float)
+    i = np.clip(np.searchsorted(times, at, side="right") - 1, 0, len(times) - 2)
+    frac = (at - times[i]) / (times[i + 1] - times[i])
+    alt = altitudes[i] + frac * (altitudes[i + 1] - altitudes[i])
+    az = azimuths[i] + frac * _wrap180(azimuths[i + 1] - azimuths[i])
+    return alt, np.mod(az, 360.0)
+
+
+def angular_distance(alt1: np.ndarray, az1: np.ndarray,
+                     alt2: np.ndarray, az2: np.ndarray) -> np.ndarray:
+    """Great-circle distance (degrees) between alt/az points"""
+    alt1, az1, alt2, az2 = (np.radians(a) for a in (alt1, az1, alt2, az2))
+    cos_d = (np.sin(alt1) * np.sin(alt2) +
+             np.cos(alt1) * np.cos(alt2) * np.cos(az1 - az2))
+    return np.degrees(np.arccos(np.clip(cos_d, -1.0, 1.0)))
+
+
+def adaptive_sample(evaluate: Callable[[np.ndarray], Tuple[np.ndarray, np.ndarray]],
+                    start: float, end: float, tolerance: float = DEFAULT_TOLERANCE_DEG,
+                    min_step_minutes: float = MIN_STEP_MINUTES,
+                    max_step_minutes: float = MAX_STEP_MINUTES) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sample ``evaluate`` over ``[start, end]`` (ephem dates) to within ``tolerance`` degrees"""
+    min_step = min_step_minutes / 1440.0
+    n = max(1, int(np.ceil((end - start) / (max_step_minutes / 1440.0))))
+    times = np.linspace(start, end, n + 1)
+    altitudes, azimuths = evaluate(times)
+    # active[i] marks the interval starting at sample i as still unchecked
+    active = np.ones(len(times), dtype=bool)
+    active[-1] = False
+
+    while active.any():
+        idx = np.flatnonzero(active)
+        width = times[idx + 1] - times[idx]
+        # Probe every eighth of the interval, so a sharp bend off-centre
+        # (refraction near the horizon) is caught as well as broad curvature
+        probes = times[idx][:, None] + width[:, None] * _PROBE_FRACTIONS
+        probe_alt, probe_az = evaluate(probes.ravel())
+        est_alt, est_az = interpolate_altaz(times, altitudes, azimuths, probes.ravel())
+        error = angular_distance(probe_alt, probe_az, est_alt, est_az).reshape(probes.shape).max(axis=1)
+        split = (error > tolerance * TOLERANCE_MARGIN) & (width > 2 * min_step)
+        mids = probes[:, 3]
+        mid_alt = probe_alt.reshape(probes.shape)[:, 3]
+        mid_az = probe_az.reshape(probes.shape)[:, 3]
+
+        active[:] = False
+        active[idx[split]] = True
+        times = np.concatenate([times, mids[split]])
+        altitudes = np.concatenate([altitudes, mid_alt[split]])
+        azimuths = np.concatenate([azimuths, mid_az[split]])
+        active = np.concatenate([active, np.ones(int(split.sum()), dtype=bool)])
+
+        order = np.argsort(times, kind="stable")
+        times, altitudes, azimuths, active = times[order], altitudes[order], azimuths[order], active[order]
+
+    return times, altitudes, azimuths
+
+
+def adaptive_body_path(body: ephem.Body, observer: ephem.Observer, start: float, end: float,
+                       tolerance: float = DEFAULT_TOLERANCE_DEG) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Adaptively sampled alt/az path of ``body`` between two ephem dates"""
+    track = fitted_track(body, observer, start, end)
+    lat, lon, elevation = float(observer.lat), float(observer.lon), float(observer.elevation)
+    pressure, temp = float(observer.pressure), float(observer.temp)
+
+    def evaluate(times):
+        return topocentric_altaz(*track(times), times, lat, lon, elevation, pressure, temp)
+
+    return adaptive_sample(evaluate, start, end, tolerance)
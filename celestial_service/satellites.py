@@ -0,0 +1,305 @@
+# celestial_service/satellites.py
+"""Satellite pass prediction from a local TLE file.
+
+``CELESTIAL_SATELLITE_TLE`` names a file of two- or three-line element sets
+(a Celestrak download, say); nothing is fetched over the network. Every
+satellite in a chunk is propagated with SGP4 over the whole window at once
+(``sgp4.api.SatrecArray``) on a coarse grid, and the positions are turned
+into topocentric altitude/azimuth in NumPy. Only the coarse brackets where
+a satellite is above ``min_altitude`` are then resampled finely, which
+gives the rise, peak and set times and the pass path.
+
+A pass is flagged visible when, at some fine sample, the satellite is
+sunlit (outside a cylindrical Earth shadow) while the Sun is below
+``DARK_SUN_ALTITUDE`` for the observer. Altitudes are geometric: no
+refraction is applied.
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import ephem
+import numpy as np
+from sgp4.api import Satrec, SatrecArray
+
+from cache import TTLCache
+from ephemeris import DJD_OFFSET, geocentric_radec, local_sidereal_time, make_body, topocentric_altaz
+from metrics import register_cache, stage_timer
+
+logger = logging.getLogger(__name__)
+
+SATELLITE_TLE_PATH = os.environ.get("CELESTIAL_SATELLITE_TLE", "")
+
+COARSE_STEP_SECONDS = 60.0
+FINE_STEP_SECONDS = 5.0
+# Satellites propagated together in one coarse pass, bounding memory use
+PROPAGATION_CHUNK = 512
+MAX_WINDOW_HOURS = 72
+# Sun altitude (degrees) below which the sky is dark enough to see a satellite
+DARK_SUN_ALTITUDE = -6.0
+
+PASS_CACHE_SIZE = 256
+PASS_CACHE_TTL = 15 * 60  # seconds
+# Window starts are snapped to this many seconds so nearby requests share results
+WINDOW_QUANTUM_SECONDS = 300
+
+WGS84_A_KM = 6378.137
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+pass_cache = TTLCache(maxsize=PASS_CACHE_SIZE, ttl=PASS_CACHE_TTL)
+register_cache("satellite_passes", pass_cache)
+
+
+class SatellitePass(NamedTuple):
+    name: str
+    norad_id: int
+    start: float  # ephem dates
+    peak: float
+    end: float
+    max_altitude: float  # degrees
+    visible: bool
+    times: np.ndarray  # fine samples between start and end
+    altitudes: np.ndarray
+    azimuths: np.ndarray
+
+
+def parse_tle(text: str) -> List[Tuple[str, str, str]]:
+    """(name, line1, line2) for every element set; unnamed sets are named after their NORAD id"""
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+    sets = []
+    i = 0
+    while i < len(lines) - 1:
+        if lines[i].startswith("1 ") and lines[i + 1].startswith("2 "):
+            sets.append((lines[i][2:7].strip(), lines[i], lines[i + 1]))
+            i += 2
+        elif i + 2 < len(lines) and lines[i + 1].startswith("1 ") and lines[i + 2].startswith("2 "):
+            sets.append((lines[i].lstrip("0 ").strip(), lines[i + 1], lines[i + 2]))
+            i += 3
+        else:
+            i += 1
+    return sets
+
+
+class SatelliteCatalog:
+    """Parsed element sets, looked up by name or NORAD id"""
+
+    def __init__(self, element_sets: Sequence[Tuple[str, str, str]], version: Hashable = None):
+        self.names = [name for name, _, _ in element_sets]
+        self.satrecs = [Satrec.twoline2rv(line1, line2) for _, line1, line2 in element_sets]
+        self.norad_ids = [int(satrec.satnum) for satrec in self.satrecs]
+        self.version = version
+        self._index = {}
+        for i, (name, norad_id) in enumerate(zip(self.names, self.norad_ids)):
+            self._index.setdefault(name.upper(), i)
+            self._index.setdefault(str(norad_id), i)
+
+    def __len__(self) -> int:
+        return len(self.satrecs)
+
+    def select(self, keys: Optional[Sequence[str]] = None) -> List[int]:
+        """Indices for names or NORAD ids (every satellite when ``keys`` is None); raises KeyError"""
+        if keys is None:
+            return list(range(len(self)))
+        missing = [key for key in keys if key.strip().upper() not in self._index]
+        if missing:
+            raise KeyError(", ".join(missing))
+        return sorted({self._index[key.strip().upper()] for key in keys})
+
+
+def load_satellite_catalog(path: str = SATELLITE_TLE_PATH) -> SatelliteCatalog:
+    if not path:
+        return SatelliteCatalog([])
+    with open(path) as f:
+        text = f.read()
+    return SatelliteCatalog(parse_tle(text), version=(path, os.path.getmtime(path)))
+
+
+class SatelliteCatalogUnavailable(Exception):
+    """No TLE file is configured, or it has never been readable"""
+
+
+_catalog: Optional[SatelliteCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_satellite_catalog() -> SatelliteCatalog:
+    """The configured catalog, reloaded when the TLE file changes.
+
+    While the file is missing or unreadable (being rotated, say) the last
+    catalog loaded keeps being served. Raises ``SatelliteCatalogUnavailable``
+    when no file is configured or none has ever loaded.
+    """
+    global _catalog
+    if not SATELLITE_TLE_PATH:
+        raise SatelliteCatalogUnavailable("No satellite catalog configured (set CELESTIAL_SATELLITE_TLE)")
+    with _catalog_lock:
+        try:
+            version = (SATELLITE_TLE_PATH, os.path.getmtime(SATELLITE_TLE_PATH))
+            if _catalog is None or _catalog.version != version:
+                _catalog = load_satellite_catalog()
+        except OSError as e:
+            if _catalog is None:
+                raise SatelliteCatalogUnavailable(f"Satellite catalog unavailable: {e}") from e
+            logger.warning(f"Could not reload {SATELLITE_TLE_PATH}, serving the previous catalog: {e}")
+        return _catalog
+
+
+def _observer_ecef(lat: float, lon: float, elevation: float) -> np.ndarray:
+    """Observer position (km) on the WGS84 ellipsoid; lat/lon in radians, elevation in metres"""
+    n = WGS84_A_KM / np.sqrt(1 - WGS84_E2 * np.sin(lat) ** 2)
+    h = elevation / 1000.0
+    return np.array([
+        (n + h) * np.cos(lat) * np.cos(lon),
+        (n + h) * np.cos(lat) * np.sin(lon),
+        (n * (1 - WGS84_E2) + h) * np.sin(lat),
+    ])
+
+
+def _propagate(satrecs: SatrecArray, times: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """TEME positions (km), shape ``(n_sats, n_times, 3)``, and a validity mask"""
+    jd = times + DJD_OFFSET
+    whole = np.floor(jd)
+    errors, positions, _ = satrecs.sgp4(whole, jd - whole)
+    return positions, errors == 0
+
+
+def _altaz(positions: np.ndarray, times: np.ndarray, lat: float, lon: float,
+           elevation: float) -> Tuple[np.ndarray, np.ndarray]:
+    """Geometric altitude/azimuth (degrees) of TEME positions for one observer"""
+    # TEME -> Earth-fixed is a rotation by Greenwich mean sidereal time
+    gmst = local_sidereal_time(times, 0.0)
+    cos_g, sin_g = np.cos(gmst), np.sin(gmst)
+    x = cos_g * positions[..., 0] + sin_g * positions[..., 1]
+    y = -sin_g * positions[..., 0] + cos_g * positions[..., 1]
+    site = _observer_ecef(lat, lon, elevation)
+    dx, dy, dz = x - site[0], y - site[1], positions[..., 2] - site[2]
+
+    sin_lat, cos_lat, sin_lon, cos_lon = np.sin(lat), np.cos(lat), np.sin(lon), np.cos(lon)
+    east = -sin_lon * dx + cos_lon * dy
+    north = -sin_lat * cos_lon * dx - sin_lat * sin_lon * dy + cos_lat * dz
+    up = cos_lat * cos_lon * dx + cos_lat * sin_lon * dy + sin_lat * dz
+    alt = np.degrees(np.arctan2(up, np.hypot(east, north)))
+    az = np.mod(np.degrees(np.arctan2(east, north)), 360.0)
+    return alt, az
+
+
+def _sunlit(positions: np.ndarray, sun_ra: np.ndarray, sun_dec: np.ndarray) -> np.ndarray:
+    """Whether TEME positions are outside a cylindrical Earth shadow"""
+    sun = np.stack([np.cos(sun_dec) * np.cos(sun_ra), np.cos(sun_dec) * np.sin(sun_ra),
+                    np.sin(sun_dec)], axis=-1)
+    along = np.sum(positions * sun, axis=-1)
+    across = np.linalg.norm(positions - along[..., None] * sun, axis=-1)
+    return (along > 0) | (across > WGS84_A_KM)
+
+
+def _brackets(above: np.ndarray) -> List[Tuple[int, int]]:
+    """(first, last) coarse indices of each run of True, widened by one sample either side"""
+    edges = np.diff(np.concatenate([[0], above.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1) - 1
+    return [(max(0, s - 1), min(len(above) - 1, e + 1)) for s, e in zip(starts, ends)]
+
+
+def _crossing(t: np.ndarray, alt: np.ndarray, i: int, min_altitude: float) -> float:
+    """Time ``min_altitude`` is crossed between samples ``i`` and ``i + 1``, interpolated linearly"""
+    a0, a1 = alt[i] - min_altitude, alt[i + 1] - min_altitude
+    return float(t[i] + (t[i + 1] - t[i]) * a0 / (a0 - a1))
+
+
+def _refine(satrec: Satrec, name: str, t0: float, t1: float, window: Tuple[float, float],
+            observer: ephem.Observer, min_altitude: float) -> Optional[SatellitePass]:
+    """Resample one coarse bracket finely and locate the pass inside it"""
+    fine = np.arange(t0, t1 + 1e-9, FINE_STEP_SECONDS / 86400.0)
+    positions, valid = _propagate(SatrecArray([satrec]), fine)
+    lat, lon, elevation = float(observer.lat), float(observer.lon), float(observer.elevation)
+    alt, az = _altaz(positions[0], fine, lat, lon, elevation)
+    alt = np.where(valid[0], alt, -90.0)
+    inside = np.flatnonzero(alt >= min_altitude)
+    if not inside.size:
+        return None
+    first, last = inside[0], inside[-1]
+    start = _crossing(fine, alt, first - 1, min_altitude) if first > 0 else float(fine[0])
+    end = _crossing(fine, alt, last, min_altitude) if last < len(fine) - 1 else float(fine[-1])
+    start, end = max(start, window[0]), min(end, window[1])
+
+    # Parabola through the highest sample and its neighbours
+    k = int(np.argmax(alt))
+    peak, max_altitude = float(fine[k]), float(alt[k])
+    if 0 < k < len(fine) - 1:
+        y0, y1, y2 = alt[k - 1], alt[k], alt[k + 1]
+        curvature = y0 - 2 * y1 + y2
+        if curvature < 0:
+            shift = 0.5 * (y0 - y2) / curvature
+            peak += shift * (fine[1] - fine[0])
+            max_altitude = float(y1 - 0.25 * (y0 - y2) * shift)
+
+    path = slice(first, last + 1)
+    sun_ra, sun_dec, sun_dist = geocentric_radec(make_body("Sun"), observer, fine[path])
+    sun_alt, _ = topocentric_altaz(sun_ra, sun_dec, sun_dist, fine[path], lat, lon, elevation)
+    lit = _sunlit(positions[0, path], sun_ra, sun_dec)
+    return SatellitePass(
+        name=name,
+        norad_id=int(satrec.satnum),
+        start=start,
+        peak=peak,
+        end=end,
+        max_altitude=max_altitude,
+        visible=bool(np.any(lit & (sun_alt < DARK_SUN_ALTITUDE))),
+        times=fine[path],
+        altitudes=alt[path],
+        azimuths=az[path],
+    )
+
+
+def predict_passes(observer: ephem.Observer, catalog: SatelliteCatalog, indices: Sequence[int],
+                   hours: float = 24.0, min_altitude: float = 10.0) -> List[SatellitePass]:
+    """Passes above ``min_altitude`` from the observer's date over the next ``hours``, by start time"""
+    t0 = float(observer.date)
+    window = (t0, t0 + hours / 24.0)
+    coarse = np.arange(window[0], window[1] + 1e-9, COARSE_STEP_SECONDS / 86400.0)
+    lat, lon, elevation = float(observer.lat), float(observer.lon), float(observer.elevation)
+
+    passes = []
+    for chunk_start in range(0, len(indices), PROPAGATION_CHUNK):
+        chunk = list(indices[chunk_start:chunk_start + PROPAGATION_CHUNK])
+        with stage_timer("satellite_search"):
+            positions, valid = _propagate(SatrecArray([catalog.satrecs[i] for i in chunk]), coarse)
+            alt, _ = _altaz(positions, coarse, lat, lon, elevation)
+        # Loose threshold so passes peaking between coarse samples are still bracketed
+        candidates = valid & (alt >= min_altitude - 2.0)
+        with stage_timer("satellite_refine"):
+            for row in np.flatnonzero(candidates.any(axis=1)):
+                i = chunk[row]
+                for first, last in _brackets(candidates[row]):
+                    found = _refine(catalog.satrecs[i], catalog.names[i],
+                                    coarse[first], coarse[last],
+                                    window, observer, min_altitude)
+                    if found is not None:
+                        passes.append(found)
+    passes.sort(key=lambda p: (p.start, p.norad_id))
+    return passes
+
+
+def cached_passes(calculator, keys: Optional[Sequence[str]] = None, start: Optional[datetime] = None,
+                  hours: float = 24.0, min_altitude: float = 10.0) -> List[SatellitePass]:
+    """Passes for a pooled calculator's location, shared by requests in the same window.
+
+    Raises KeyError for names or ids that are not in the catalog and
+    ``SatelliteCatalogUnavailable`` when there is no catalog.
+    """
+    catalog = get_satellite_catalog()
+    indices = catalog.select(keys)
+    observer = calculator.observer_at(start)
+    # Snap the window start so requests a few seconds apart hit the same entry
+    quantum = WINDOW_QUANTUM_SECONDS / 86400.0
+    observer.date = np.floor(float(observer.date) / quantum) * quantum
+    key = (
+        round(calculator.lat, 6), round(calculator.lon, 6), round(calculator.elevation, 1),
+        catalog.version, tuple(indices), float(observer.date), hours, min_altitude,
+    )
+    return pass_cache.get_or_compute(
+        key, lambda: predict_passes(observer, catalog, indices, hours, min_altitude)
+    )
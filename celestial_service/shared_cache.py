@@ -0,0 +1,196 @@
+# celestial_service/shared_cache.py
+"""Result cache shared by every worker process on a host.
+
+With ``CELESTIAL_SHARED_CACHE_DIR`` set (``main.py`` creates a private
+temporary directory for it when started with ``CELESTIAL_WORKERS`` > 1),
+computed daily paths are also stored as one ``.npz`` file of plain arrays
+per key in that directory, so a path computed by one worker is read by the
+others instead of being recomputed. Entries are written with ``encode``
+(value to named arrays) and read back with ``decode``, and loaded with
+``allow_pickle=False``: nothing in the directory is ever unpickled. The
+directory must belong to the service's user and be closed to everyone else
+(mode 0700); it is created that way if missing and refused otherwise.
+
+A miss takes an exclusive ``flock`` on the key's lock file, checks again
+and only then computes: however many workers ask for the same (location,
+day, body) at once, one computes it and the rest wait and read the result.
+``locked`` holds the locks of several keys at once, for values computed in
+bulk. Files are written to a temporary name and renamed into place, so
+readers never see a partial entry. Entries expire ``ttl`` seconds after
+they were written.
+
+The per-process ``TTLCache`` stays in front of this store, so a worker
+only touches the disk for entries it hasn't seen yet.
+"""
+import fcntl
+import hashlib
+import os
+import stat
+import tempfile
+import threading
+import time
+import zipfile
+from contextlib import ExitStack, contextmanager
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, Optional
+
+import numpy as np
+
+SHARED_CACHE_DIR = os.environ.get("CELESTIAL_SHARED_CACHE_DIR", "")
+# Expired entries are swept after this many writes
+PRUNE_EVERY = 256
+ENTRY_SUFFIX = ".npz"
+
+_MISSING = object()
+
+
+def private_directory(directory: str) -> str:
+    """Create ``directory`` with mode 0700, or check that an existing one is as private"""
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    # lstat, so a symlink planted in the directory's place is refused too
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise PermissionError(
+            f"Refusing to use {directory} as the shared cache: it must be a directory "
+            f"owned by this user and closed to group and others (mode 0700)"
+        )
+    return directory
+
+
+class SharedCache:
+    """On-disk cache of array-encoded values with a cross-process single-flight lock per key"""
+
+    def __init__(self, directory: str, ttl: float,
+                 encode: Callable[[Any], Dict[str, np.ndarray]],
+                 decode: Callable[[Dict[str, np.ndarray]], Any]):
+        self.directory = private_directory(directory)
+        self.ttl = ttl
+        self.encode = encode
+        self.decode = decode
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: Hashable) -> str:
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode()).hexdigest() + ENTRY_SUFFIX)
+
+    def _read(self, path: str) -> Any:
+        try:
+            if os.path.getmtime(path) + self.ttl <= time.time():
+                return _MISSING
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            return _MISSING
+        return self.decode(arrays)
+
+    def _write(self, path: str, value: Any) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **self.encode(value))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        value = self._read(self._path(key))
+        self._count(value is not _MISSING)
+        return default if value is _MISSING else value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Store without taking the key's lock; use inside ``locked`` for values computed in bulk"""
+        self._write(self._path(key), value)
+
+    @contextmanager
+    def locked(self, keys: Iterable[Hashable]) -> Iterator[None]:
+        """Hold the single-flight locks of every key in ``keys``.
+
+        Locks are always taken in the order of their file names, so
+        processes locking overlapping sets of keys can't deadlock.
+        """
+        with ExitStack() as stack:
+            for path in sorted({self._path(key) for key in keys}):
+                lock_file = stack.enter_context(open(path + ".lock", "a"))
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                stack.callback(fcntl.flock, lock_file, fcntl.LOCK_UN)
+            yield
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the stored value for ``key``; on a miss exactly one process computes it"""
+        path = self._path(key)
+        value = self._read(path)
+        if value is not _MISSING:
+            self._count(True)
+            return value
+        with self.locked([key]):
+            # Another worker may have filled it while we waited
+            value = self._read(path)
+            if value is not _MISSING:
+                self._count(True)
+                return value
+            self._count(False)
+            value = compute()
+            self._write(path, value)
+        return value
+
+    def prune(self) -> int:
+        """Remove expired entries and their lock files; returns how many entries were removed"""
+        removed = 0
+        cutoff = time.time() - self.ttl
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                if entry.stat().st_mtime > cutoff:
+                    continue
+                # A lock is only dropped once its entry is gone; at worst a
+                # worker holding it and a newcomer then both compute the key
+                if entry.name.endswith(".lock") and os.path.exists(entry.path[:-len(".lock")]):
+                    continue
+                os.unlink(entry.path)
+                removed += not entry.name.endswith(".lock")
+            except OSError:
+                pass
+        return removed
+
+    def clear(self) -> None:
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(ENTRY_SUFFIX):
+                try:
+                    os.unlink(entry.path)
+                except OSError:
+                    pass
+
+    def stats(self) -> dict:
+        size = sum(1 for entry in os.scandir(self.directory) if entry.name.endswith(ENTRY_SUFFIX))
+        with self._lock:
+            return {"size": size, "maxsize": None, "hits": self.hits, "misses": self.misses}
+
+    def __len__(self) -> int:
+        return self.stats()["size"]
+
+
+def make_shared_cache(ttl: float, encode: Callable[[Any], Dict[str, np.ndarray]],
+                      decode: Callable[[Dict[str, np.ndarray]], Any],
+                      directory: str = SHARED_CACHE_DIR) -> Optional[SharedCache]:
+    """A store in ``directory``, or ``None`` when sharing is not configured"""
+    return SharedCache(directory, ttl, encode, decode) if directory else None
@@ -0,0 +1,109 @@
+# celestial_service/snapshot.py
+"""What is in the sky at one instant.
+
+Geocentric tracks are the same for every site, so each body's track over
+the UTC day is fitted once (or read from the ephemeris table) and cached.
+A snapshot evaluates the tracks at the requested time and converts every
+body to alt/az in one vectorized pass; with the magnitude and
+constellation cached in ``metadata.py`` they are gathered into arrays so
+altitude and magnitude filters are applied in one pass too.
+Catalog stars, when asked for, come from the indexed query in
+``stars.py``. Nothing here samples a daily path; ``paths=True`` attaches
+the cached ones for the bodies that pass the filters.
+"""
+from datetime import datetime, time
+from typing import Iterable, Optional
+
+import ephem
+import numpy as np
+
+from cache import TTLCache
+from calculator import CelestialCalculator
+from ephemeris import BODY_CLASSES, GeocentricTrack, evaluate_tracks, fitted_track, make_body, radec_to_altaz
+from formats import PathFormat, compact_path, format_path
+from metadata import BODY_TYPES, body_attributes
+from metrics import register_cache, stage_timer
+from models import SkyObject, SkySnapshot
+from stars import visible_stars
+
+# Stars are only considered down to this magnitude unless a fainter limit is asked for
+DEFAULT_STAR_MAGNITUDE = 4.0
+
+# One geocentric track per (body, UTC day), shared by every site
+TRACK_CACHE_SIZE = 64
+track_cache = TTLCache(maxsize=TRACK_CACHE_SIZE, ttl=24 * 3600)
+register_cache("snapshot_tracks", track_cache)
+
+
+def day_track(name: str, observer: ephem.Observer, when: datetime) -> GeocentricTrack:
+    """``name``'s geocentric track over the UTC day containing ``when``"""
+    t0 = float(ephem.Date(datetime.combine(when.date(), time())))
+    return track_cache.get_or_compute(
+        (name, t0), lambda: fitted_track(make_body(name), observer, t0, t0 + 1.0)
+    )
+
+
+def sky_snapshot(calculator: CelestialCalculator, when: datetime,
+                 min_altitude: Optional[float] = None, max_magnitude: Optional[float] = None,
+                 include_stars: bool = False, paths: bool = False,
+                 path_format: PathFormat = PathFormat(),
+                 bodies: Iterable[str] = BODY_CLASSES) -> SkySnapshot:
+    """Bodies (and optionally catalog stars) at ``when``, highest first"""
+    observer = calculator.observer_at(when)
+    names = list(bodies)
+    t = float(observer.date)
+    with stage_timer("ephemeris"):
+        ra, dec, dist = evaluate_tracks([day_track(name, observer, when) for name in names], t)
+        altitude, azimuth = radec_to_altaz(ra, dec, dist, observer, np.full(len(names), t))
+    attributes = [body_attributes(name, when) for name in names]
+    magnitude = np.array([a["magnitude"] for a in attributes])
+    constellations = [a["constellation"] for a in attributes]
+
+    keep = np.ones(len(names), dtype=bool)
+    if min_altitude is not None:
+        # Measured from the site's horizon mask, which is 0° without one
+        keep &= altitude > calculator.horizon_altitude(azimuth) + min_altitude
+    if max_magnitude is not None:
+        keep &= magnitude <= max_magnitude
+
+    objects = []
+    with stage_timer("model"):
+        for i in np.flatnonzero(keep):
+            name = names[i]
+            path = None
+            if paths:
+                daily_path = format_path(calculator, name, when, path_format)
+                path = list(daily_path.positions) if path_format.name == "json" else compact_path(path_format, daily_path)
+            objects.append(SkyObject(
+                name=name,
+                type=BODY_TYPES.get(name, "planet"),
+                altitude=float(altitude[i]),
+                azimuth=float(azimuth[i]),
+                magnitude=float(magnitude[i]),
+                constellation=constellations[i],
+                path=path,
+            ))
+
+    if include_stars:
+        with stage_timer("stars"):
+            stars = visible_stars(
+                observer,
+                DEFAULT_STAR_MAGNITUDE if max_magnitude is None else max_magnitude,
+                -90.0 if min_altitude is None else min_altitude,
+                horizon=None if min_altitude is None else calculator.horizon,
+            )
+        with stage_timer("model"):
+            objects += [
+                SkyObject(
+                    name=star.name,
+                    type="star",
+                    altitude=star.altitude,
+                    azimuth=star.azimuth,
+                    magnitude=star.magnitude,
+                    constellation=star.constellation,
+                )
+                for star in stars
+            ]
+
+    objects.sort(key=lambda obj: obj.altitude, reverse=True)
+    return SkySnapshot(time=when.isoformat(), objects=objects)
@@ -0,0 +1,356 @@
+# celestial_service/stars.py
+"""Star catalog with a sky-grid index and vectorized alt/az.
+
+The catalog is held as NumPy arrays (J2000 RA/Dec, magnitude) and indexed
+by a sky grid: declination bands ``STAR_GRID_DEG`` tall, each cut into RA
+cells of roughly equal area. Within a cell stars are sorted by magnitude,
+so "brighter than M" is a prefix of every cell. A query (the sky above
+the horizon, or a field of view) is a cone in J2000; only the cells that
+intersect it are read, the cone is then tested exactly, and alt/az is
+computed for the survivors in one NumPy pass. No ``ephem.FixedBody`` is
+created per star.
+
+By default the catalog is ``data/bright_stars.csv``: every Hipparcos star
+to V 6.5, about 8,900 of them. ``CELESTIAL_STAR_CATALOG`` can point at
+another CSV in the same format, a header and the columns
+``name,ra,dec,mag`` (degrees, J2000) and optionally ``spectral``. The
+bundled file is rebuilt from the Hipparcos 2 catalog (ESA/CDS I/311
+``hip2.dat``, as in the ``hipparcos-catalog`` package) with::
+
+    python stars.py build --hip2 hip2.dat --names star_designations.parquet
+
+Positions are moved from the catalog's J1991.25 epoch to J2000 by proper
+motion, Hipparcos Hp magnitudes are converted to Johnson V from B-V, and
+stars are named from the proper names and Bayer/Flamsteed designations
+in ``--names`` (starplot's table; reading it needs ``pyarrow``), falling
+back to ``HIP <number>``. The stars also in ephem's built-in list keep
+its magnitudes (Hp saturates for the brightest) and spectral types.
+"""
+import argparse
+import csv
+import math
+import os
+import threading
+from typing import List, NamedTuple, Optional, Tuple
+
+import ephem
+import ephem.stars
+import numpy as np
+
+from ephemeris import DJD_OFFSET, topocentric_altaz
+from horizon import HorizonMask
+
+BUNDLED_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "bright_stars.csv")
+STAR_CATALOG_PATH = os.environ.get("CELESTIAL_STAR_CATALOG", "") or BUNDLED_CATALOG_PATH
+STAR_GRID_DEG = 5.0
+# Refraction lifts stars up to ~0.6 degrees, so the horizon cone is widened
+HORIZON_MARGIN_DEG = 1.0
+MAX_STAR_RESULTS = 5000
+
+J2000_DJD = 2451545.0 - DJD_OFFSET
+
+
+class StarPosition(NamedTuple):
+    name: str
+    magnitude: float
+    altitude: float
+    azimuth: float
+    ra: float  # degrees, J2000
+    dec: float
+    spectral: str
+    constellation: str
+
+
+def _parse_edb(line: str) -> Optional[Tuple[str, float, float, float, str]]:
+    """Fixed-object line of an XEphem database (the format of ``ephem.stars.db``)"""
+    fields = line.split(",")
+    if len(fields) < 5 or not fields[1].startswith("f"):
+        return None
+    kind = fields[1].split("|")
+    ra_hours = float(fields[2].split("|")[0])
+    dec_deg = float(fields[3].split("|")[0])
+    return fields[0], ra_hours * 15.0, dec_deg, float(fields[4]), kind[2] if len(kind) > 2 else ""
+
+
+def _read_csv(path: str) -> List[Tuple[str, float, float, float, str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [
+            (row["name"], float(row["ra"]), float(row["dec"]), float(row["mag"]), row.get("spectral") or "")
+            for row in csv.DictReader(f)
+        ]
+
+
+def precession_matrix(t: float) -> np.ndarray:
+    """Rotation from J2000 mean equatorial coordinates to those of ephem date ``t`` (Meeus 21.3)"""
+    T = (t - J2000_DJD) / 36525.0
+    arcsec = np.pi / (180 * 3600)
+    zeta = (2306.2181 * T + 0.30188 * T**2 + 0.017998 * T**3) * arcsec
+    z = (2306.2181 * T + 1.09468 * T**2 + 0.018203 * T**3) * arcsec
+    theta = (2004.3109 * T - 0.42665 * T**2 - 0.041833 * T**3) * arcsec
+
+    def rz(a):
+        return np.array([[np.cos(a), -np.sin(a), 0], [np.sin(a), np.cos(a), 0], [0, 0, 1]])
+
+    def ry(a):
+        return np.array([[np.cos(a), 0, -np.sin(a)], [0, 1, 0], [np.sin(a), 0, np.cos(a)]])
+
+    return rz(z) @ ry(theta) @ rz(zeta)
+
+
+def _unit_vectors(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    return np.stack([np.cos(dec) * np.cos(ra), np.cos(dec) * np.sin(ra), np.sin(dec)], axis=-1)
+
+
+class StarCatalog:
+    """Stars sorted by sky-grid cell, then by magnitude within each cell"""
+
+    def __init__(self, rows: List[Tuple[str, float, float, float, str]],
+                 grid_deg: float = STAR_GRID_DEG):
+        self.grid_deg = grid_deg
+        self.n_bands = int(math.ceil(180.0 / grid_deg))
+        # Fewer RA cells towards the poles keeps cells roughly equal in area
+        band_centres = -90.0 + (np.arange(self.n_bands) + 0.5) * grid_deg
+        self.band_cells = np.maximum(
+            1, np.round(360.0 / grid_deg * np.cos(np.radians(band_centres)))
+        ).astype(int)
+        self.band_offset = np.concatenate([[0], np.cumsum(self.band_cells)])
+
+        ra = np.radians([r[1] for r in rows])
+        dec = np.radians([r[2] for r in rows])
+        mag = np.array([r[3] for r in rows], dtype=float)
+        cell = self._cell(ra, dec)
+        order = np.lexsort((mag, cell))
+
+        self.names = [rows[i][0] for i in order]
+        self.spectral = [rows[i][4] for i in order]
+        self.ra, self.dec, self.mag = ra[order], dec[order], mag[order]
+        self.vectors = _unit_vectors(self.ra, self.dec)
+        # Fixed in J2000, so looked up once rather than per query
+        self.constellations = [ephem.constellation((r, d))[1] for r, d in zip(self.ra, self.dec)]
+        n_cells = int(self.band_offset[-1])
+        # Stars of cell c are [cell_start[c], cell_start[c + 1])
+        self.cell_start = np.searchsorted(cell[order], np.arange(n_cells + 1))
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _cell(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        band = np.clip(((np.degrees(dec) + 90.0) // self.grid_deg).astype(int), 0, self.n_bands - 1)
+        cells = self.band_cells[band]
+        column = np.minimum((np.mod(ra, 2 * np.pi) / (2 * np.pi) * cells).astype(int), cells - 1)
+        return self.band_offset[band] + column
+
+    def _cells_in_cone(self, ra: float, dec: float, radius: float) -> np.ndarray:
+        """Ids of every grid cell that may hold a star within ``radius`` of (ra, dec) (radians)"""
+        lo = max(-np.pi / 2, dec - radius)
+        hi = min(np.pi / 2, dec + radius)
+        first_band = int((np.degrees(lo) + 90.0) // self.grid_deg)
+        last_band = min(self.n_bands - 1, int((np.degrees(hi) + 90.0) // self.grid_deg))
+        cells = []
+        for band in range(first_band, last_band + 1):
+            n = self.band_cells[band]
+            # Widest RA half-width of the cone within the band (at its pole-most edge)
+            band_lo = np.radians(-90.0 + band * self.grid_deg)
+            band_hi = band_lo + np.radians(self.grid_deg)
+            edge = max(abs(band_lo), abs(band_hi))
+            if radius >= np.pi / 2 - abs(dec) or edge >= np.pi / 2 - 1e-9:
+                half_width = np.pi
+            else:
+                s = np.sin(radius) / max(np.cos(dec) * np.cos(edge), 1e-12)
+                half_width = np.pi if s >= 1 else np.arcsin(s)
+            if half_width >= np.pi:
+                columns = np.arange(n)
+            else:
+                width = 2 * np.pi / n
+                first = int(np.floor((ra - half_width) / width))
+                last = int(np.floor((ra + half_width) / width))
+                columns = np.unique(np.mod(np.arange(first, last + 1), n))
+            cells.append(self.band_offset[band] + columns)
+        return np.concatenate(cells) if cells else np.empty(0, dtype=int)
+
+    def cone(self, ra: float, dec: float, radius: float, max_magnitude: float) -> np.ndarray:
+        """Indices of stars within ``radius`` of (ra, dec), J2000 radians, no fainter than ``max_magnitude``"""
+        cells = self._cells_in_cone(ra, dec, radius)
+        starts = self.cell_start[cells]
+        ends = self.cell_start[cells + 1]
+        # Magnitude-sorted cells: the bright stars of each are a prefix
+        for i, (a, b) in enumerate(zip(starts, ends)):
+            ends[i] = a + np.searchsorted(self.mag[a:b], max_magnitude, side="right")
+        if not len(cells):
+            return np.empty(0, dtype=int)
+        candidates = np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+        if not candidates.size:
+            return candidates
+        centre = _unit_vectors(np.array(ra), np.array(dec))
+        inside = self.vectors[candidates] @ centre >= np.cos(radius)
+        return candidates[inside]
+
+
+def load_catalog(path: str = STAR_CATALOG_PATH) -> StarCatalog:
+    """Stars from a CSV at ``path``, or ephem's built-in bright stars when ``path`` is empty"""
+    if path:
+        return StarCatalog(_read_csv(path))
+    return StarCatalog(_ephem_stars())
+
+
+def _ephem_stars() -> List[Tuple[str, float, float, float, str]]:
+    rows = [_parse_edb(line) for line in ephem.stars.db.splitlines()]
+    return [row for row in rows if row is not None]
+
+
+_catalog: Optional[StarCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> StarCatalog:
+    """The configured catalog, loaded on first use"""
+    global _catalog
+    if _catalog is None:
+        with _catalog_lock:
+            if _catalog is None:
+                _catalog = load_catalog()
+    return _catalog
+
+
+def visible_stars(observer: ephem.Observer, max_magnitude: float = 4.0, min_altitude: float = 0.0,
+                  center: Optional[Tuple[float, float]] = None, radius: Optional[float] = None,
+                  limit: int = MAX_STAR_RESULTS, horizon: Optional[HorizonMask] = None) -> List[StarPosition]:
+    """Stars no fainter than ``max_magnitude`` above ``min_altitude`` at the observer's date.
+
+    With a ``horizon`` mask ``min_altitude`` is measured from the mask in
+    each star's direction rather than from 0°. With ``center`` (altitude,
+    azimuth in degrees) and ``radius`` (degrees) the search is limited to
+    that field of view. Results are brightest first.
+    """
+    catalog = get_catalog()
+    t = float(observer.date)
+    lat, lon = float(observer.lat), float(observer.lon)
+    to_date = precession_matrix(t)
+
+    if center is None:
+        # Everything above the horizon: a hemisphere around the zenith
+        centre_of_date = _unit_vectors(np.array(float(observer.sidereal_time())), np.array(lat))
+        lowest = min_altitude + (float(horizon.table.min()) if horizon is not None else 0.0)
+        radius_rad = np.radians(90.0 - min(lowest, 0.0) + HORIZON_MARGIN_DEG)
+    else:
+        ra_c, dec_c = observer.radec_of(np.radians(center[1]), np.radians(center[0]))
+        centre_of_date = _unit_vectors(np.array(float(ra_c)), np.array(float(dec_c)))
+        radius_rad = np.radians(radius + HORIZON_MARGIN_DEG)
+    # Back to J2000, where the index lives
+    x, y, z = to_date.T @ centre_of_date
+    index = catalog.cone(float(np.arctan2(y, x)), float(np.arcsin(np.clip(z, -1, 1))),
+                         float(min(radius_rad, np.pi)), max_magnitude)
+    if not index.size:
+        return []
+
+    vectors = catalog.vectors[index] @ to_date.T
+    ra = np.arctan2(vectors[:, 1], vectors[:, 0])
+    dec = np.arcsin(np.clip(vectors[:, 2], -1, 1))
+    times = np.full(index.size, t)
+    alt, az = topocentric_altaz(ra, dec, np.inf, times, lat, lon, float(observer.elevation),
+                                float(observer.pressure), float(observer.temp))
+
+    keep = alt > (min_altitude if horizon is None else horizon.altitude(az) + min_altitude)
+    if center is not None:
+        c_alt, c_az = np.radians(center)
+        cos_d = (np.sin(np.radians(alt)) * np.sin(c_alt) +
+                 np.cos(np.radians(alt)) * np.cos(c_alt) * np.cos(np.radians(az) - c_az))
+        keep &= cos_d >= np.cos(np.radians(radius))
+    selected = np.flatnonzero(keep)
+    selected = selected[np.argsort(catalog.mag[index[selected]], kind="stable")][:limit]
+
+    return [
+        StarPosition(
+            name=catalog.names[i],
+            magnitude=float(catalog.mag[i]),
+            altitude=float(alt[j]),
+            azimuth=float(az[j]),
+            ra=float(np.degrees(catalog.ra[i])),
+            dec=float(np.degrees(catalog.dec[i])),
+            spectral=catalog.spectral[i],
+            constellation=catalog.constellations[i],
+        )
+        for j, i in ((j, index[j]) for j in selected)
+    ]
+
+
+# Building the bundled catalog from Hipparcos 2
+
+# Years from the Hipparcos epoch (J1991.25) to J2000
+HIPPARCOS_TO_J2000_YEARS = 8.75
+# V - Hp as a quadratic in B-V, fitted to ephem's bright stars (median
+# residual 0.012 mag); B-V is clipped to the fitted range
+HP_TO_V = (0.175, -0.333, 0.0)
+HP_TO_V_COLOUR_RANGE = (-0.3, 1.6)
+MAS_TO_DEG = 1.0 / 3.6e6
+
+
+def read_hip2(path: str) -> np.ndarray:
+    """HIP number, J2000 RA/Dec (degrees) and V magnitude of every star in ``hip2.dat``"""
+    # Columns: HIP, RArad, DErad, pmRA (mas/yr, times cos Dec), pmDE, Hpmag, B-V
+    hip, ra, dec, pm_ra, pm_dec, hp, bv = np.loadtxt(path, usecols=(0, 4, 5, 7, 8, 19, 23), unpack=True)
+    dec_deg = np.degrees(dec) + pm_dec * MAS_TO_DEG * HIPPARCOS_TO_J2000_YEARS
+    ra_deg = np.degrees(ra) + pm_ra * MAS_TO_DEG * HIPPARCOS_TO_J2000_YEARS / np.cos(dec)
+    v = hp + np.polyval(HP_TO_V, np.clip(bv, *HP_TO_V_COLOUR_RANGE))
+    return np.stack([hip, np.mod(ra_deg, 360.0), dec_deg, v], axis=-1)
+
+
+def read_designations(path: str) -> dict:
+    """HIP number -> (proper name, Bayer letter, Flamsteed number) from starplot's table"""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(path, columns=["hip", "name", "bayer", "flamsteed"]).to_pydict()
+    return {
+        hip: (name or "", bayer or "", flamsteed)
+        for hip, name, bayer, flamsteed in zip(table["hip"], table["name"], table["bayer"], table["flamsteed"])
+    }
+
+
+def star_name(hip: int, ra: float, dec: float, designations: dict) -> str:
+    name, bayer, flamsteed = designations.get(hip, ("", "", None))
+    if name:
+        return name
+    if bayer or flamsteed:
+        constellation = ephem.constellation((math.radians(ra), math.radians(dec)))[0]
+        return f"{bayer or flamsteed} {constellation}"
+    return f"HIP {hip}"
+
+
+def build_catalog(hip2_path: str, names_path: Optional[str], output: str, max_magnitude: float) -> int:
+    """Write the stars of ``hip2_path`` no fainter than ``max_magnitude`` to a CSV; returns how many"""
+    stars = read_hip2(hip2_path)
+    stars = stars[stars[:, 3] <= max_magnitude + 0.5]
+    vectors = _unit_vectors(np.radians(stars[:, 1]), np.radians(stars[:, 2]))
+    spectral = {}
+    for _, ra, dec, mag, kind in _ephem_stars():
+        # The brightest Hipparcos star within an arcminute is the same star
+        near = np.flatnonzero(vectors @ _unit_vectors(np.radians(ra), np.radians(dec)) >= np.cos(np.radians(1 / 60)))
+        if near.size:
+            i = near[np.argmin(stars[near, 3])]
+            stars[i, 3] = mag
+            spectral[i] = kind
+    keep = np.flatnonzero(stars[:, 3] <= max_magnitude)
+    keep = keep[np.argsort(stars[keep, 3], kind="stable")]
+    designations = read_designations(names_path) if names_path else {}
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\n")
+        writer.writerow(["name", "ra", "dec", "mag", "spectral"])
+        for i in keep:
+            hip, ra, dec, mag = stars[i]
+            writer.writerow([star_name(int(hip), ra, dec, designations), f"{ra:.5f}", f"{dec:.5f}",
+                             f"{mag:.2f}", spectral.get(i, "")])
+    return len(keep)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the bundled star catalog from Hipparcos 2")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="convert hip2.dat to a name,ra,dec,mag,spectral CSV")
+    build.add_argument("--hip2", required=True, help="Hipparcos 2 main catalog (CDS I/311 hip2.dat)")
+    build.add_argument("--names", help="starplot's star_designations.parquet")
+    build.add_argument("--output", default=BUNDLED_CATALOG_PATH)
+    build.add_argument("--max-magnitude", type=float, default=6.5)
+    args = parser.parse_args()
+    count = build_catalog(args.hip2, args.names, args.output, args.max_magnitude)
+    print(f"Wrote {count} stars to {args.output}")
@@ -0,0 +1,102 @@
+# celestial_service/startup.py
+"""Worker start-up: cache warm-up and an import profile.
+
+FastAPI runs startup hooks before uvicorn accepts connections, so
+``main.py``'s hook calls ``warm_up`` to fill the path and event caches for
+today at every ``CELESTIAL_WARMUP_LOCATIONS`` entry (``lat,lon[,elevation]``
+separated by ``;``, default: the service's default location; ``none``
+disables it). The first request after a deploy then hits warm caches. The
+import and warm-up times are reported in
+``celestial_startup_duration_seconds``. With ``CELESTIAL_EXECUTOR=process``
+the caches live in the pool workers, and only the one that runs the warm-up
+is warmed.
+
+Run as a script to profile how long importing the service takes, module by
+module, and what a freshly started worker holds in memory:
+
+    python startup.py            # the 15 slowest imports made by main.py
+    python startup.py --top 40
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+from conditional import utc_now
+from events import solve_events
+from locations import Location, get_calculator
+
+WARMUP_LOCATIONS = os.environ.get("CELESTIAL_WARMUP_LOCATIONS", "")
+
+_IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)")
+
+
+def parse_locations(spec: str, default: Location) -> List[Location]:
+    """Locations from ``lat,lon[,elevation];...``; empty means ``default``, ``none`` means none"""
+    spec = spec.strip()
+    if not spec:
+        return [default]
+    if spec.lower() == "none":
+        return []
+    locations = []
+    for entry in spec.split(";"):
+        values = [float(v) for v in entry.split(",")]
+        if len(values) not in (2, 3):
+            raise ValueError(f"Bad warm-up location {entry!r}, expected lat,lon[,elevation]")
+        locations.append(Location(*values))
+    return locations
+
+
+def warm_up(locations: Sequence[Location], day: Optional[datetime] = None) -> None:
+    """Cache every body's daily path and the events for ``day`` (default today)"""
+    day = day or utc_now()
+    for location in locations:
+        calculator = get_calculator(*location)
+        # next_event searches today and tomorrow
+        solve_events(calculator, day.date(), 2)
+        calculator.precompute_daily_paths(day)
+
+
+def import_profile(module: str = "main") -> Tuple[float, List[Tuple[str, float, float]], int]:
+    """Wall time, (name, self ms, cumulative ms) per module ``module`` imports, and peak RSS in KiB"""
+    code = f"import resource, {module}; print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    wall = time.perf_counter() - started
+    modules: List[Tuple[str, float, float]] = []
+    children: List[Tuple[str, float, float]] = []
+    for line in result.stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if not match:
+            continue
+        entry = (match.group(4), int(match.group(1)) / 1000, int(match.group(2)) / 1000)
+        # Children are listed before their parent, two spaces deeper per level
+        depth = len(match.group(3))
+        if depth == 3:
+            children.append(entry)
+        elif depth == 1:
+            if entry[0] == module:
+                modules = [entry] + children
+            children = []
+    return wall, modules, int(result.stdout.split()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile the service's import time and memory")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    wall, modules, rss_kib = import_profile(args.module)
+    print(f"{'module':<40} {'self ms':>10} {'total ms':>10}")
+    for name, own, total in sorted(modules, key=lambda m: m[2], reverse=True)[:args.top]:
+        print(f"{name:<40} {own:>10.1f} {total:>10.1f}")
+    print(f"\ninterpreter start to import done: {wall * 1000:.0f} ms, peak RSS {rss_kib / 1024:.1f} MiB")
@@ -0,0 +1,120 @@
+# celestial_service/streaming.py
+"""Push realtime positions to many subscribers with one computation per tick.
+
+Subscribers at the same (quantized) location and cadence share a
+``PositionChannel``. The channel computes the union of the bodies its
+subscribers asked for once per tick, serializes the update once per
+distinct body selection, and fans the result out to every subscriber queue.
+"""
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Dict, Iterable, Tuple
+
+import numpy as np
+
+from calculator import CelestialCalculator
+from conditional import utc_now
+from ephemeris import make_body
+from executor import run_compute
+from metrics import body_computations, stage_timer
+
+logger = logging.getLogger(__name__)
+
+MIN_STREAM_INTERVAL = 1.0  # seconds
+MAX_STREAM_INTERVAL = 300.0
+
+
+def compute_positions(calculator: CelestialCalculator, bodies: Iterable[str]) -> Dict[str, dict]:
+    """Current alt/az of each body, shaped like ``Position``"""
+    now = utc_now()
+    observer = calculator.observer_at(now)
+    timestamp = now.isoformat()
+    positions = {}
+    for name in bodies:
+        body = make_body(name)
+        with stage_timer("ephemeris"):
+            body.compute(observer)
+        body_computations.inc(name, "position")
+        positions[name] = {
+            "time": timestamp,
+            "altitude": float(body.alt) * 180/np.pi,
+            "azimuth": float(body.az) * 180/np.pi,
+        }
+    return positions
+
+
+def _offer(queue: asyncio.Queue, item: str) -> None:
+    # Slow consumers skip stale updates rather than buffering them
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(item)
+
+
+class PositionChannel:
+    """One ticking computation shared by every subscriber to a location/cadence"""
+
+    def __init__(self, calculator: CelestialCalculator, interval: float):
+        self.calculator = calculator
+        self.interval = interval
+        self.subscribers: Dict[asyncio.Queue, Tuple[str, ...]] = {}
+        self.task = None
+
+    def subscribe(self, bodies: Tuple[str, ...]) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.subscribers[queue] = bodies
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self.subscribers.pop(queue, None)
+        if not self.subscribers and self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self) -> None:
+        while self.subscribers:
+            started = time.monotonic()
+            wanted = sorted({name for bodies in self.subscribers.values() for name in bodies})
+            try:
+                positions = await run_compute(compute_positions, self.calculator, wanted)
+            except Exception as e:
+                logger.error(f"Error computing streamed positions: {str(e)}", exc_info=True)
+            else:
+                encoded: Dict[Tuple[str, ...], str] = {}
+                for queue, bodies in list(self.subscribers.items()):
+                    if bodies not in encoded:
+                        encoded[bodies] = json.dumps({name: positions[name] for name in bodies})
+                    _offer(queue, encoded[bodies])
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+class PositionBroadcaster:
+    """Registry of channels keyed by location grid cell and cadence"""
+
+    def __init__(self):
+        self.channels: Dict[tuple, PositionChannel] = {}
+
+    def subscriber_count(self) -> int:
+        return sum(len(channel.subscribers) for channel in self.channels.values())
+
+    async def stream(self, calculator: CelestialCalculator, bodies: Tuple[str, ...],
+                     interval: float) -> AsyncIterator[str]:
+        """Yield JSON-encoded ``{body: Position}`` updates until the caller stops"""
+        key = (calculator.lat, calculator.lon, calculator.elevation, interval)
+        channel = self.channels.get(key)
+        if channel is None:
+            channel = self.channels[key] = PositionChannel(calculator, interval)
+        queue = channel.subscribe(bodies)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            channel.unsubscribe(queue)
+            if not channel.subscribers and self.channels.get(key) is channel:
+                del self.channels[key]
+
+
+broadcaster = PositionBroadcaster()
@@ -0,0 +1,190 @@
+# celestial_service/tables.py
+"""Precomputed ephemeris tables, memory-mapped at runtime.
+
+A table stores, for every body, the Chebyshev segments that
+``GeocentricTrack`` would otherwise fit on each request: geocentric
+apparent RA/Dec and distance, which are the same for every site. Paths,
+events and adaptive samples for any location are then a slice of the
+table plus the NumPy alt/az conversion, with no ``ephem`` calls.
+
+File layout (little-endian)::
+
+    b"SKYTAB01" | uint32 header length | JSON header | padding to 64 bytes
+    float64 coefficients [body, segment, node, (ra, dec, distance)]
+    float64 angular radius [body, segment]
+
+The file is opened with ``np.memmap``, so worker processes share the
+page cache instead of each holding a copy, and startup costs only the
+header parse. Build one with::
+
+    python tables.py build --start 2026-01-01 --days 366 --output ephemeris.tab
+
+and point ``CELESTIAL_EPHEMERIS_TABLE`` at it. Spans outside the table
+fall back to fitting with ``ephem``.
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+from datetime import date, datetime, time
+from typing import Dict, Iterable, Optional
+
+import ephem
+import numpy as np
+
+from ephemeris import (
+    BODY_CLASSES, SEGMENT_DAYS, SEGMENT_NODES, GeocentricTrack, make_body, set_ephemeris_table
+)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SKYTAB01"
+HEADER_ALIGN = 64
+TABLE_PATH = os.environ.get("CELESTIAL_EPHEMERIS_TABLE", "")
+
+
+class EphemerisTable:
+    """Read-only, memory-mapped view of a table file"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not an ephemeris table")
+            (header_len,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_len))
+        self.path = path
+        self.bodies = header["bodies"]
+        self.start = header["start"]  # ephem date of the first segment edge
+        self.segment_days = header["segment_days"]
+        self.n_segments = header["segments"]
+        self.nodes = header["nodes"]
+        self._index = {name: i for i, name in enumerate(self.bodies)}
+
+        offset = _data_offset(header_len)
+        shape = (len(self.bodies), self.n_segments, self.nodes, 3)
+        self.coeffs = np.memmap(path, dtype="<f8", mode="r", offset=offset, shape=shape)
+        self.radius = np.memmap(
+            path, dtype="<f8", mode="r",
+            offset=offset + int(np.prod(shape)) * 8, shape=shape[:2]
+        )
+        self.edges = self.start + np.arange(self.n_segments + 1) * self.segment_days
+
+    @property
+    def end(self) -> float:
+        return float(self.edges[-1])
+
+    def covers(self, t0: float, t1: float) -> bool:
+        return self.start <= t0 and t1 <= self.end
+
+    def track(self, body_name: str, t0: float, t1: float) -> Optional[GeocentricTrack]:
+        """Track over the segments spanning ``[t0, t1]``, or None if not covered"""
+        body = self._index.get(body_name)
+        if body is None or not self.covers(t0, t1):
+            return None
+        # The end instant lies on the last segment's closing edge, not in a segment past it
+        first = min(int(np.floor((t0 - self.start) / self.segment_days)), self.n_segments - 1)
+        last = max(first + 1, int(np.ceil((t1 - self.start) / self.segment_days)))
+        first, last = max(0, first), min(self.n_segments, last)
+        # Slices of the memmap: no copy until evaluated
+        return GeocentricTrack.from_segments(
+            self.edges[first:last + 1], self.coeffs[body, first:last], self.radius[body, first]
+        )
+
+
+def _data_offset(header_len: int) -> int:
+    end = len(MAGIC) + 4 + header_len
+    return (end + HEADER_ALIGN - 1) // HEADER_ALIGN * HEADER_ALIGN
+
+
+def build_table(path: str, start: date, days: int, bodies: Iterable[str] = BODY_CLASSES,
+                segment_days: float = SEGMENT_DAYS) -> None:
+    """Fit every body over ``days`` from midnight UTC on ``start`` and write the table"""
+    bodies = list(bodies)
+    t0 = float(ephem.Date(datetime.combine(start, time())))
+    n_segments = int(np.ceil(days / segment_days))
+    t1 = t0 + n_segments * segment_days
+    # Geocentric quantities don't depend on where the observer is
+    observer = ephem.Observer()
+
+    coeffs = np.empty((len(bodies), n_segments, SEGMENT_NODES, 3))
+    radius = np.empty((len(bodies), n_segments))
+    for i, name in enumerate(bodies):
+        body = make_body(name)
+        track = GeocentricTrack(body, observer, t0, t1, segment_days)
+        coeffs[i] = track.coeffs
+        # The Moon's angular size changes by ~10% over a month, so keep it per segment
+        for s in range(n_segments):
+            observer.date = track.edges[s]
+            body.compute(observer)
+            radius[i, s] = float(body.radius)
+        logger.info(f"Fitted {name}: {n_segments} segments")
+
+    header = json.dumps({
+        "bodies": bodies,
+        "start": t0,
+        "segment_days": segment_days,
+        "segments": n_segments,
+        "nodes": SEGMENT_NODES,
+        "created": datetime.now().isoformat(),
+    }).encode()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header)))
+        f.write(header)
+        f.write(b"\0" * (_data_offset(len(header)) - f.tell()))
+        f.write(coeffs.astype("<f8").tobytes())
+        f.write(radius.astype("<f8").tobytes())
+    # Atomic replace, so running workers never map a half-written file
+    os.replace(tmp_path, path)
+
+
+def load_configured_table() -> Optional[EphemerisTable]:
+    """Install the table named by ``CELESTIAL_EPHEMERIS_TABLE``, if any"""
+    if not TABLE_PATH:
+        return None
+    try:
+        table = EphemerisTable(TABLE_PATH)
+    except (OSError, ValueError) as e:
+        logger.error(f"Not using ephemeris table {TABLE_PATH}: {str(e)}")
+        return None
+    set_ephemeris_table(table)
+    first, last = (to.datetime().date() for to in (ephem.Date(table.start), ephem.Date(table.end)))
+    logger.info(f"Using ephemeris table {TABLE_PATH} ({', '.join(table.bodies)}; {first} to {last})")
+    return table
+
+
+def describe(table: EphemerisTable) -> Dict[str, object]:
+    return {
+        "path": table.path,
+        "bodies": table.bodies,
+        "start": ephem.Date(table.start).datetime().isoformat(),
+        "end": ephem.Date(table.end).datetime().isoformat(),
+        "segment_days": table.segment_days,
+        "segments": table.n_segments,
+        "nodes": table.nodes,
+        "bytes": os.path.getsize(table.path),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Build or inspect precomputed ephemeris tables")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="precompute a table")
+    build.add_argument("--start", type=date.fromisoformat, default=date.today())
+    build.add_argument("--days", type=int, default=366)
+    build.add_argument("--segment-days", type=float, default=SEGMENT_DAYS)
+    build.add_argument("--bodies", nargs="+", default=list(BODY_CLASSES), choices=list(BODY_CLASSES))
+    build.add_argument("--output", default=TABLE_PATH or "ephemeris.tab")
+    info = commands.add_parser("info", help="describe an existing table")
+    info.add_argument("path", nargs="?", default=TABLE_PATH or "ephemeris.tab")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_table(args.output, args.start, args.days, args.bodies, args.segment_days)
+        print(json.dumps(describe(EphemerisTable(args.output)), indent=2))
+    else:
+        print(json.dumps(describe(EphemerisTable(args.path)), indent=2))
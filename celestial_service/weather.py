@@ -0,0 +1,263 @@
+# celestial_service/weather.py
+"""Weather providers behind ``/weather``.
+
+``CELESTIAL_WEATHER_PROVIDER`` picks the source:
+
+- ``mock`` (default): plausible random conditions, as the service always had
+- ``stub``: deterministic conditions derived from the location and hour, for
+  tests and benchmarks
+- ``openweathermap``: the OpenWeatherMap current-weather API, keyed by
+  ``OPENWEATHERMAP_API_KEY``, through one pooled ``httpx.AsyncClient`` with
+  ``CELESTIAL_WEATHER_TIMEOUT`` seconds per request; ``httpx`` is only
+  imported when this provider is used, and ``CELESTIAL_OPENWEATHERMAP_URL``
+  replaces the API's URL
+
+``WeatherService`` caches readings per location grid cell (see
+``locations.py``) for ``CELESTIAL_WEATHER_TTL`` seconds, and concurrent
+lookups for the same cell share one upstream request.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from typing import TYPE_CHECKING, Dict, Optional
+
+from cache import TTLCache
+from locations import Location, quantize_location
+from metrics import register_cache, stage_timer
+from models import Weather
+
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+WEATHER_PROVIDERS = ("mock", "stub", "openweathermap")
+WEATHER_PROVIDER = os.environ.get("CELESTIAL_WEATHER_PROVIDER", "mock").lower()
+OPENWEATHERMAP_API_KEY = os.environ.get("OPENWEATHERMAP_API_KEY", "")
+# Overridable so load tests can point the provider at a local stand-in (see loadtest.py)
+OPENWEATHERMAP_URL = os.environ.get("CELESTIAL_OPENWEATHERMAP_URL",
+                                    "https://api.openweathermap.org/data/2.5/weather")
+WEATHER_TIMEOUT = float(os.environ.get("CELESTIAL_WEATHER_TIMEOUT", "5"))  # seconds
+WEATHER_CACHE_TTL = float(os.environ.get("CELESTIAL_WEATHER_TTL", "600"))  # seconds
+WEATHER_CACHE_SIZE = 1024
+MAX_WEATHER_CONNECTIONS = 20
+
+if WEATHER_PROVIDER not in WEATHER_PROVIDERS:
+    raise ValueError(
+        f"Unknown CELESTIAL_WEATHER_PROVIDER {WEATHER_PROVIDER!r}, expected one of {', '.join(WEATHER_PROVIDERS)}"
+    )
+
+_MISSING = object()
+
+
+class WeatherProviderError(Exception):
+    """The upstream weather source failed or timed out"""
+
+
+def _stub_fractions(key: str) -> tuple:
+    """Four independent fractions in [0, 1) derived from ``key``"""
+    digest = hashlib.sha256(key.encode()).digest()
+    return tuple(int.from_bytes(digest[i:i + 4], "little") / 2**32 for i in range(0, 16, 4))
+
+
+def stub_night_cloud_cover(lat: float, lon: float, night: date) -> float:
+    """Deterministic cloud cover (percent) for a night, as a stand-in forecast"""
+    return float(round(_stub_fractions(f"{lat:.1f},{lon:.1f},{night.isoformat()}")[0] * 100))
+
+
+def _is_night(when: datetime) -> bool:
+    return when.hour >= 18 or when.hour <= 6
+
+
+def _condition(cloud_cover: float) -> str:
+    if cloud_cover < 30:
+        return "Clear"
+    if cloud_cover < 60:
+        return "Partly Cloudy"
+    return "Cloudy"
+
+
+class WeatherProvider(ABC):
+    """Current conditions for a location; ``sunrise_time``/``time_to_leave`` are left unset"""
+
+    @abstractmethod
+    async def fetch(self, lat: float, lon: float) -> Weather:
+        ...
+
+    async def aclose(self) -> None:
+        pass
+
+
+class MockWeatherProvider(WeatherProvider):
+    """Random conditions, clearer at night"""
+
+    async def fetch(self, lat: float, lon: float) -> Weather:
+        current_time = datetime.now()
+        is_night = _is_night(current_time)
+        rand_factor = random.random()
+
+        # Conditions are better at night for observations
+        if is_night:
+            cloud_cover = random.randint(0, 40)
+            condition = "Clear" if cloud_cover < 20 else "Partly Cloudy"
+            temperature = 10 + (rand_factor * 10)  # 10-20 degrees at night
+        else:
+            cloud_cover = random.randint(20, 80)
+            condition = _condition(cloud_cover)
+            temperature = 15 + (rand_factor * 15)  # 15-30 degrees during the day
+
+        wind_speed = random.randint(0, 25) / 3.6  # Convert km/h to m/s
+        humidity = random.randint(40, 90)
+        visibility = 5 + (rand_factor * 15)  # 5-20 km
+
+        return Weather(
+            temperature=round(temperature, 1),
+            condition=condition,
+            humidity=humidity,
+            wind_speed=round(wind_speed, 1),
+            cloud_cover=cloud_cover,
+            visibility=round(visibility, 1),
+            observation_time=current_time.isoformat(),
+            is_good_for_observation=is_night and cloud_cover < 30 and wind_speed < 5 and visibility > 10,
+        )
+
+
+class StubWeatherProvider(WeatherProvider):
+    """Deterministic conditions: the same location and hour always give the same weather"""
+
+    async def fetch(self, lat: float, lon: float) -> Weather:
+        current_time = datetime.now()
+        hour = current_time.replace(minute=0, second=0, microsecond=0)
+        a, b, c, d = _stub_fractions(f"{lat:.3f},{lon:.3f},{hour.isoformat()}")
+
+        cloud_cover = round(a * 100)
+        wind_speed = round(b * 10, 1)
+        visibility = round(5 + c * 15, 1)
+        return Weather(
+            temperature=round(5 + d * 20, 1),
+            condition=_condition(cloud_cover),
+            humidity=round(40 + b * 50),
+            wind_speed=wind_speed,
+            cloud_cover=cloud_cover,
+            visibility=visibility,
+            observation_time=current_time.isoformat(),
+            is_good_for_observation=(
+                _is_night(current_time) and cloud_cover < 30 and wind_speed < 5 and visibility > 10
+            ),
+        )
+
+
+class OpenWeatherMapProvider(WeatherProvider):
+    """OpenWeatherMap current weather over a pooled async HTTP client"""
+
+    def __init__(self, api_key: str, timeout: float = WEATHER_TIMEOUT,
+                 client: Optional["httpx.AsyncClient"] = None):
+        if not api_key:
+            raise ValueError("OpenWeatherMap API key not configured. Set OPENWEATHERMAP_API_KEY.")
+        import httpx
+        self.api_key = api_key
+        self.client = client or httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=MAX_WEATHER_CONNECTIONS,
+                                max_keepalive_connections=MAX_WEATHER_CONNECTIONS),
+        )
+
+    async def fetch(self, lat: float, lon: float) -> Weather:
+        import httpx
+        try:
+            response = await self.client.get(
+                OPENWEATHERMAP_URL,
+                params={"lat": lat, "lon": lon, "appid": self.api_key, "units": "metric"},
+            )
+        except httpx.HTTPError as e:
+            raise WeatherProviderError(f"Weather API request failed: {e!r}") from e
+        if response.status_code != 200:
+            logger.error(f"OpenWeatherMap API error: {response.status_code} - {response.text}")
+            raise WeatherProviderError(f"Weather API error: {response.status_code}")
+
+        data = response.json()
+        weather_condition = data['weather'][0]['main']
+        wind_speed = data['wind']['speed']  # m/s with units=metric
+        visibility = data.get('visibility', 0) / 1000  # metres to km
+        current_time = datetime.now()
+
+        # Good conditions: clear sky at night, low wind, good visibility
+        is_clear = weather_condition.lower() in ['clear', 'few clouds']
+        return Weather(
+            temperature=data['main']['temp'],
+            condition=weather_condition,
+            humidity=data['main']['humidity'],
+            wind_speed=wind_speed,
+            cloud_cover=data.get('clouds', {}).get('all', 0),
+            visibility=visibility,
+            observation_time=current_time.isoformat(),
+            is_good_for_observation=_is_night(current_time) and is_clear and wind_speed < 5.0 and visibility > 8.0,
+        )
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+def make_provider(name: str = WEATHER_PROVIDER) -> WeatherProvider:
+    """Provider for a ``CELESTIAL_WEATHER_PROVIDER`` name"""
+    if name == "stub":
+        return StubWeatherProvider()
+    if name == "openweathermap":
+        return OpenWeatherMapProvider(OPENWEATHERMAP_API_KEY)
+    return MockWeatherProvider()
+
+
+class WeatherService:
+    """Cached, coalesced lookups against one provider"""
+
+    def __init__(self, provider: WeatherProvider, ttl: float = WEATHER_CACHE_TTL,
+                 maxsize: int = WEATHER_CACHE_SIZE):
+        self.provider = provider
+        self.cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._inflight: Dict[Location, asyncio.Future] = {}
+
+    async def _fetch(self, cell: Location) -> Weather:
+        with stage_timer("weather_upstream"):
+            weather = await self.provider.fetch(cell.lat, cell.lon)
+        self.cache.set(cell, weather)
+        return weather
+
+    async def get(self, lat: float, lon: float) -> Weather:
+        """Current weather for the grid cell containing (lat, lon)"""
+        cell = quantize_location(lat, lon)
+        weather = self.cache.get(cell, _MISSING)
+        if weather is not _MISSING:
+            return weather
+        task = self._inflight.get(cell)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(cell))
+            self._inflight[cell] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cell, None))
+        # One caller going away must not cancel the lookup the others wait on
+        return await asyncio.shield(task)
+
+    async def aclose(self) -> None:
+        await self.provider.aclose()
+
+
+_service: Optional[WeatherService] = None
+
+
+def get_weather_service() -> WeatherService:
+    """The configured service, created on first use"""
+    global _service
+    if _service is None:
+        _service = WeatherService(make_provider())
+        register_cache("weather", _service.cache)
+    return _service
+
+
+async def close_weather_service() -> None:
+    global _service
+    if _service is not None:
+        await _service.aclose()
+        _service = None
@@ -5,5 +5,32 @@ function getCompassDirection(azimuth) {
     return directions[index];
 }
 
+// Altitude/azimuth at any time from an adaptive path (format=adaptive), without
+// asking the server. Linear interpolation between neighbouring samples stays
+// within path.tolerance degrees; azimuth is interpolated along the shorter arc.
+function interpolatePathPosition(path, time) {
+    if (!path || !path.count) return null;
+    // Server times are naive UTC ISO strings
+    const start = Date.parse(path.start + 'Z');
+    const elapsed = ((time instanceof Date ? time.getTime() : Date.parse(time)) - start) / 1000;
+    const offsets = path.offsets;
+    if (elapsed < offsets[0] || elapsed > offsets[offsets.length - 1]) return null;
+
+    let low = 0;
+    let high = offsets.length - 1;
+    while (high - low > 1) {
+        const mid = (low + high) >> 1;
+        if (offsets[mid] <= elapsed) low = mid; else high = mid;
+    }
+    const span = offsets[high] - offsets[low];
+    const frac = span > 0 ? (elapsed - offsets[low]) / span : 0;
+    const dAz = ((path.azimuth[high] - path.azimuth[low]) % 360 + 540) % 360 - 180;
+    return {
+        altitude: path.altitude[low] + frac * (path.altitude[high] - path.altitude[low]),
+        azimuth: ((path.azimuth[low] + frac * dAz) % 360 + 360) % 360
+    };
+}
+
 // Make it available globally
-window.getCompassDirection = getCompassDirection;
\ No newline at end of file
+window.getCompassDirection = getCompassDirection;
+window.interpolatePathPosition = interpolatePathPosition;
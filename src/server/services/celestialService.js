@@ -8,6 +8,49 @@ async function fetchJson(url) {
     return response.data;
 }
 
+// Decode one column of a compact path from the Python service
+function decodeColumn(values, encoding) {
+    if (encoding !== 'float32-base64') {
+        return values;
+    }
+    const buffer = Buffer.from(values, 'base64');
+    const column = new Array(buffer.length / 4);
+    for (let i = 0; i < column.length; i++) {
+        column[i] = buffer.readFloatLE(i * 4);
+    }
+    return column;
+}
+
+// Expand packed/columnar paths back into the daily_path arrays the client expects
+function expandCompactPaths(data) {
+    Object.values(data).forEach((object) => {
+        if (!object.path) {
+            return;
+        }
+        const { start, step_seconds, count, encoding, current_index, current } = object.path;
+        const altitude = decodeColumn(object.path.altitude, encoding);
+        const azimuth = decodeColumn(object.path.azimuth, encoding);
+        const startMs = Date.parse(`${start}Z`);
+
+        const dailyPath = new Array(count);
+        for (let i = 0; i < count; i++) {
+            dailyPath[i] = {
+                // Same naive ISO format as the JSON responses
+                time: new Date(startMs + i * step_seconds * 1000).toISOString().slice(0, 19),
+                altitude: altitude[i],
+                azimuth: azimuth[i]
+            };
+        }
+        if (current && current_index !== null && current_index < count) {
+            dailyPath[current_index] = current;
+        }
+
+        object.daily_path = dailyPath;
+        delete object.path;
+    });
+    return data;
+}
+
 // Cache for weather data
 const weatherCache = {
     data: null,
@@ -18,10 +61,23 @@ const weatherCache = {
 // Cache mechanism for celestial data
 const cache = {
     data: null,
+    etag: null, // validator of the cached combined positions
     timestamp: 0,
     validityPeriod: 60000 // 1 minute cache validity
 };
 
+// Fetch JSON, revalidating with the ETag of a cached copy; resolves to null on 304
+async function fetchJsonIfChanged(url, etag) {
+    const response = await axios.get(url, {
+        headers: etag ? { 'If-None-Match': etag } : {},
+        validateStatus: (status) => (status >= 200 && status < 300) || status === 304
+    });
+    if (response.status === 304) {
+        return null;
+    }
+    return { data: response.data, etag: response.headers.etag || null };
+}
+
 export async function fetchWeatherData(forceRefresh = false) {
     try {
         // Check cache if not forcing refresh
@@ -52,14 +108,19 @@ export async function fetchCelestialData(forceRefresh = false) {
             return cache.data;
         }
 
-        // Fetch combined data from new endpoint
-        const combinedData = await fetchJson(`${PYTHON_SERVICE_URL}/combined-positions`);
-        
-        // Update cache
-        cache.data = combinedData;
+        // Fetch combined data from new endpoint, with paths in the packed format;
+        // an unchanged response (304) keeps the cached copy
+        const fetched = await fetchJsonIfChanged(
+            `${PYTHON_SERVICE_URL}/combined-positions?format=packed`,
+            forceRefresh ? null : cache.etag
+        );
+        if (fetched) {
+            cache.data = expandCompactPaths(fetched.data);
+            cache.etag = fetched.etag;
+        }
         cache.timestamp = now;
         
-        return combinedData;
+        return cache.data;
     } catch (error) {
         // If the combined endpoint doesn't exist yet, fall back to the old approach
         try {